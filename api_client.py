@@ -1,16 +1,84 @@
 """
 API Client for CDC Voucher System
 Complete version with ALL methods
+
+All calls share one pooled, keep-alive HTTP session, so repeat calls (e.g. a
+merchant terminal redeeming tokens) reuse an open connection instead of
+opening a new one each time. Every call has a timeout, idempotent calls
+(GET/DELETE) are retried with backoff on connection errors and 502/503/504
+responses, and per-endpoint latencies are kept for get_latency_stats().
+
+AsyncCDCApiClient offers the same calls as coroutines for asyncio code
+such as the Flet apps (see api_tasks.py).
 """
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_BASE_URL = "http://localhost:8000"
 
+# (connect, read) seconds; override per endpoint with `timeouts`
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Keep-alive connections held open to the API
+POOL_SIZE = 10
+
+# Retries for idempotent calls, with exponential backoff from RETRY_BACKOFF seconds
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.2
+RETRY_STATUSES = (502, 503, 504)
+
+# Recent latencies kept per endpoint for the percentiles
+LATENCY_SAMPLES = 200
+
+# Calls an AsyncCDCApiClient runs at once (matches the connection pool)
+ASYNC_WORKERS = POOL_SIZE
+
 class CDCApiClient:
     """Client for communicating with Flask API"""
     
-    def __init__(self, base_url=API_BASE_URL):
+    def __init__(self, base_url=API_BASE_URL, timeout=DEFAULT_TIMEOUT, timeouts=None, retries=RETRY_ATTEMPTS):
+        """
+        Args:
+            base_url: API server URL
+            timeout: Default (connect, read) timeout in seconds, or one number
+            timeouts: Optional {method name: timeout}, e.g. {"redeem_token": 5}
+            retries: Attempts after the first for idempotent calls
+        """
         self.base_url = base_url
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        # url -> (ETag, body text) of the last response, for conditional GETs
+        self._etags = {}
+
+        # POST calls (register, generate, redeem) are never retried once
+        # sent; connection failures before sending are safe to retry
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS", "DELETE"}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # endpoint -> {"calls", "errors", "total_ms", "max_ms", "samples"}
+        self._latency = {}
+        self._latency_lock = threading.Lock()
     
     # ==================
     # HOUSEHOLD METHODS
@@ -18,77 +86,96 @@ class CDCApiClient:
     
     def register_household(self, members, postal_code):
         """Register a new household"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/households",
-                json={"members": members, "postal_code": postal_code}
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "register_household", "POST", "/api/households",
+            json={"members": members, "postal_code": postal_code}
+        )
+    
+    def register_households_bulk(self, households):
+        """Register a list of {"members": [...], "postal_code": ...} households"""
+        return self._request(
+            "register_households_bulk", "POST", "/api/households/bulk",
+            json={"households": households}
+        )
     
     def get_balance(self, household_id):
         """Get household voucher balance"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/households/{household_id}/balance"
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "get_balance", "GET", f"/api/households/{household_id}/balance", etag=True
+        )
     
     def claim_vouchers(self, household_id, tranche):
         """Claim vouchers for a household"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/households/{household_id}/claim",
-                json={"tranche": tranche}
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "claim_vouchers", "POST", f"/api/households/{household_id}/claim",
+            json={"tranche": tranche}
+        )
     
     def generate_token(self, household_id, vouchers):
         """Generate redemption token"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/token/generate",
-                json={"household_id": household_id, "vouchers": vouchers}
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "generate_token", "POST", "/api/token/generate",
+            json={"household_id": household_id, "vouchers": vouchers}
+        )
+    
+    def get_tokens(self, household_id):
+        """Get the household's live redemption tokens"""
+        return self._request("get_tokens", "GET", f"/api/households/{household_id}/tokens")
     
     def get_transactions(self, household_id, limit=20):
         """Get transaction history"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/households/{household_id}/transactions",
-                params={"limit": limit}
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "get_transactions", "GET", f"/api/households/{household_id}/transactions",
+            params={"limit": limit}
+        )
     
     def get_notifications(self, household_id):
         """Get unread notifications"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/households/{household_id}/notifications"
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "get_notifications", "GET", f"/api/households/{household_id}/notifications"
+        )
     
     def mark_notification_read(self, notification_id):
         """Mark notification as read"""
-        try:
-            response = requests.delete(
-                f"{self.base_url}/api/notifications/{notification_id}"
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request(
+            "mark_notification_read", "DELETE", f"/api/notifications/{notification_id}"
+        )
+    
+    def stream_notifications(self, household_id, timeout=300):
+        """
+        Yield notifications as the server pushes them (Server-Sent Events)
+
+        Returns when the server closes the stream after `timeout` seconds;
+        connection errors are raised so the caller can reconnect.
+        """
+        with self.session.get(
+            f"{self.base_url}/api/households/{household_id}/notifications/stream",
+            params={"timeout": timeout},
+            stream=True,
+            timeout=(5, 60)
+        ) as response:
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].strip())
+                elif not line and data_lines:
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+    
+    def mark_notifications_read(self, household_id, notification_ids=None):
+        """Mark several notifications as read (all unread if no IDs given)"""
+        return self._request(
+            "mark_notifications_read", "POST", f"/api/households/{household_id}/notifications/read",
+            json={"notification_ids": notification_ids}
+        )
+    
+    def clear_notifications(self, household_id):
+        """Clear all notifications for a household"""
+        return self._request(
+            "clear_notifications", "DELETE", f"/api/households/{household_id}/notifications"
+        )
     
     # ==================
     # MERCHANT METHODS
@@ -96,47 +183,170 @@ class CDCApiClient:
     
     def register_merchant(self, merchant_data):
         """Register a new merchant"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/merchants",
-                json=merchant_data
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request("register_merchant", "POST", "/api/merchants", json=merchant_data)
     
     def get_merchant(self, merchant_id):
         """Get merchant details - THIS METHOD WAS MISSING!"""
-        try:
-            response = requests.get(
-                f"{self.base_url}/api/merchants/{merchant_id}"
-            )
-            return response.json(), response.status_code
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return self._request("get_merchant", "GET", f"/api/merchants/{merchant_id}", etag=True)
+    
+    def get_merchant_analytics(self, merchant_id):
+        """Get pre-aggregated sales figures for a merchant"""
+        return self._request(
+            "get_merchant_analytics", "GET", f"/api/merchants/{merchant_id}/analytics"
+        )
     
     def redeem_token(self, token, merchant_id):
         """Redeem a token at merchant"""
+        return self._request(
+            "redeem_token", "POST", "/api/token/redeem",
+            json={"token": token, "merchant_id": merchant_id}
+        )
+    
+    # ==================
+    # HELPER METHODS
+    # ==================
+    
+    def _request(self, endpoint, method, path, etag=False, **kwargs):
+        """
+        Send one API call on the pooled session
+
+        Args:
+            endpoint: Name the call's timeout and latency are kept under
+            method: HTTP method
+            path: URL path under base_url
+            etag: Send If-None-Match and reuse the last body on a 304
+            kwargs: Passed to requests (json, params)
+
+        Returns:
+            (response dict, status code); ({"error": ...}, 500) on failure
+        """
+        url = f"{self.base_url}{path}"
+        cached = self._etags.get(url) if etag else None
+        if cached:
+            kwargs["headers"] = {"If-None-Match": cached[0]}
+
+        start = time.perf_counter()
         try:
-            response = requests.post(
-                f"{self.base_url}/api/token/redeem",
-                json={"token": token, "merchant_id": merchant_id}
+            response = self.session.request(
+                method, url, timeout=self.timeouts.get(endpoint, self.timeout), **kwargs
             )
-            return response.json(), response.status_code
+            if response.status_code == 304 and cached:
+                # Parsed again so callers never share (and mutate) one dict
+                result = json.loads(cached[1]), 200
+            else:
+                if etag:
+                    if response.status_code == 200 and response.headers.get("ETag"):
+                        self._etags[url] = (response.headers["ETag"], response.text)
+                    else:
+                        self._etags.pop(url, None)
+                result = response.json(), response.status_code
         except Exception as e:
+            self._record_latency(endpoint, start, failed=True)
             return {"error": str(e)}, 500
+        self._record_latency(endpoint, start, failed=result[1] >= 500)
+        return result
     
-    # ==================
-    # HELPER METHODS
-    # ==================
+    def _record_latency(self, endpoint, start, failed):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._latency_lock:
+            stats = self._latency.get(endpoint)
+            if stats is None:
+                stats = self._latency[endpoint] = {
+                    "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "samples": deque(maxlen=LATENCY_SAMPLES)
+                }
+            stats["calls"] += 1
+            stats["errors"] += failed
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["samples"].append(elapsed_ms)
+    
+    def get_latency_stats(self):
+        """
+        Round-trip times per endpoint (including retries)
+
+        Returns:
+            {endpoint: {"calls", "errors", "avg_ms", "p50_ms", "p95_ms", "max_ms"}};
+            percentiles cover the last LATENCY_SAMPLES calls
+        """
+        with self._latency_lock:
+            result = {}
+            for endpoint, stats in self._latency.items():
+                samples = sorted(stats["samples"])
+                result[endpoint] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 1),
+                    "p50_ms": round(samples[len(samples) // 2], 1),
+                    "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+                    "max_ms": round(stats["max_ms"], 1)
+                }
+            return result
     
     def check_connection(self):
         """Check if Flask API is running"""
+        # A one-off request, not retried: the apps call this at startup
+        # and should report a stopped server straight away
         try:
-            response = requests.get(f"{self.base_url}/", timeout=2)
+            requests.get(f"{self.base_url}/", timeout=2)
             return True
         except:
             return False
+    
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+class AsyncCDCApiClient:
+    """
+    asyncio variant of CDCApiClient
+    
+    Every CDCApiClient method (except stream_notifications) is available as
+    a coroutine with the same arguments, e.g.
+    `response, status = await client.get_balance(uid)`. Calls run on a
+    small thread pool over the wrapped client's pooled session, so awaiting
+    one never blocks the event loop. A call made while an identical one
+    (same method and arguments) is still in flight waits for that one
+    instead of sending a second request, so a double-clicked button or two
+    views loading the same balance cost one round trip.
+    """
+    
+    def __init__(self, client=None, max_workers=ASYNC_WORKERS):
+        self.client = client or CDCApiClient()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-client")
+        # (loop, method, arguments) -> future of the request in flight
+        self._in_flight = {}
+        self.coalesced = 0
+    
+    async def call(self, method, *args, **kwargs):
+        """Run a CDCApiClient method off the event loop and return its result"""
+        loop = asyncio.get_running_loop()
+        key = (id(loop), method, json.dumps([args, kwargs], sort_keys=True, default=str))
+        future = self._in_flight.get(key)
+        if future is None:
+            future = loop.run_in_executor(
+                self._executor, functools.partial(getattr(self.client, method), *args, **kwargs)
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shielded so one caller giving up does not cancel the others' request
+        return await asyncio.shield(future)
+    
+    def __getattr__(self, name):
+        method = getattr(self.client, name, None)
+        if name.startswith("_") or name == "stream_notifications" or not callable(method):
+            raise AttributeError(name)
+        
+        async def api_call(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+        api_call.__name__ = name
+        api_call.__doc__ = method.__doc__
+        return api_call
 
 # Create singleton instance
-api_client = CDCApiClient()
\ No newline at end of file
+api_client = CDCApiClient()
+
+# Shares the singleton's connection pool
+async_api_client = AsyncCDCApiClient(api_client)
@@ -0,0 +1,80 @@
+"""
+Background API calls for the Flet apps
+
+ApiTaskRunner sends API calls from Flet event handlers without waiting for
+them: each call runs as a task on the page's event loop through
+AsyncCDCApiClient, and when the response arrives a callback updates the
+controls and the page is refreshed. Identical calls already in flight are
+coalesced by the client, and a call given a `key` supersedes an earlier
+one with the same key, so a view only ever shows the latest response.
+
+    runner = ApiTaskRunner(page)
+    runner.run("get_balance", uid, key="view", on_result=show_dashboard)
+
+Threads that must block outside the event loop (the notification stream)
+hand their results back with call_soon().
+"""
+from api_client import async_api_client
+
+class ApiTaskRunner:
+    """Runs AsyncCDCApiClient calls for one Flet page"""
+
+    def __init__(self, page, client=async_api_client):
+        self.page = page
+        self.client = client
+        # key -> marker of the latest call started under that key (set from
+        # handler threads, only read by tasks, so never deleted)
+        self._latest = {}
+
+    def run(self, method, *args, on_result=None, key=None, **kwargs):
+        """
+        Start an API call and return immediately
+
+        Args:
+            method: CDCApiClient method name, e.g. "get_balance"
+            args, kwargs: Arguments for that method
+            on_result: Called as on_result(response, status) when the call
+                completes; the page is updated afterwards
+            key: Optional slot name; a later call with the same key drops
+                this call's result (e.g. "view" for the screen being loaded)
+
+        Returns:
+            concurrent.futures.Future of (response, status)
+        """
+        marker = object()
+        if key is not None:
+            self._latest[key] = marker
+
+        async def task():
+            response, status = await self.client.call(method, *args, **kwargs)
+            if key is not None and self._latest.get(key) is not marker:
+                # Superseded by a newer call with the same key
+                return response, status
+            if on_result is not None:
+                try:
+                    on_result(response, status)
+                except Exception as e:
+                    print(f"❌ Error handling {method} response: {e}")
+            self.page.update()
+            return response, status
+
+        return self.page.run_task(task)
+
+    def call_soon(self, callback, *args):
+        """
+        Run callback(*args) on the page's event loop, from any thread
+
+        The page is updated afterwards, as for run() results.
+
+        Returns:
+            concurrent.futures.Future of the callback's return value
+        """
+        async def task():
+            try:
+                return callback(*args)
+            except Exception as e:
+                print(f"❌ Error in {getattr(callback, '__name__', 'callback')}: {e}")
+            finally:
+                self.page.update()
+
+        return self.page.run_task(task)
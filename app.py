@@ -1,33 +1,63 @@
 # "AN6007 Group 13"
-import csv
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, redirect, flash, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, flash, url_for, stream_with_context
 from services.household_service import (
     register_household,
-    get_redemption_balance,
+    register_households_bulk,
+    get_cached_balance,
     load_households,
     households,
-    save_households
+    household_cache
 )
+from services.household_loader import iter_households
 from services.voucher_service import claim_voucher
-from services.redemption_service import redeem_voucher
-from services.merchant_service import register_merchant, load_merchants, merchants
+from services.token_service import token_store
+from services.disbursement_service import start_disbursement, get_disbursement_status, resume_disbursements
+from services.redemption_service import (
+    redeem_voucher,
+    generate_household_token,
+    redeem_household_token,
+    log_token_redemption
+)
+from services.merchant_service import register_merchant, load_merchants, merchants, merchant_cache, get_cached_merchant
+from services.response_cache import response_cache
+from services.analytics_service import load_analytics, get_merchant_analytics
+from services.redemption_archive import start_archive_compactor
+from services.redemption_log import redemption_log
+from services.event_bus import event_bus
+from services.storage_backend import get_backend, API_LEADER_LOCK
+from utils.file_utils import try_lock_file
 from services.notification_service import (
     create_redemption_notification,
     get_transaction_history,
-    get_unread_notifications
+    start_history_compactor,
+    legacy_files_pending,
+    get_unread_notifications,
+    mark_notifications_read,
+    clear_all_notifications,
+    delete_notification as remove_notification
 )
-import random
-import string
-import os
-import csv
-from datetime import datetime
+import io
+import json
+import queue
+import time
 
 app = Flask(__name__)
 app.secret_key = "an6007_group13_secret_key"
 
 load_households()
 load_merchants()
+load_analytics()
+
+# When several worker processes serve the API (see wsgi.py), only the one
+# holding this lock runs the background compaction and disbursement jobs
+leader_lock = try_lock_file(API_LEADER_LOCK)
+if leader_lock is not None:
+    start_history_compactor()
+    start_archive_compactor()
+    resume_disbursements()
+    if get_backend() is None and legacy_files_pending():
+        print("⚠️ Old notification/transaction files are not shown until converted: "
+              "stop the API and run python -m services.notification_service migrate")
 
 print("=" * 60)
 print("🚀 CDC VOUCHER API - Starting...")
@@ -52,6 +82,7 @@ def login_ui():
              login_id = request.form.get("household_id", "").strip()
 
         # 1. Check if it's a Household
+        load_households()
         if login_id in households:
             return redirect(f"/ui/balance/{login_id}")
         
@@ -80,88 +111,23 @@ def merchant_dashboard_ui(merchant_id):
     if request.method == "POST":
         token = request.form.get("token", "").strip()
         
-        # Find household corresponding to the token
-        target_household = None
-        token_data = None
-        
-        for hid, h in households.items():
-            if h.get("active_token") == token:
-                target_household = hid
-                token_data = h.get("token_data")
-                break
+        # Consume the token and deduct vouchers atomically
+        redemption = redeem_household_token(token)
         
-        if target_household and token_data:
-            # Calculate total amount (Handle nested structure: {tranche: {denom: count}})
-            total_amount = 0
-            voucher_list_for_csv = []
-            
-            h_obj = households[target_household]
-            
-            # Deduct vouchers with strict tranche matching
-            # token_data structure expected: { "Jan2026": { "10": 1 }, "May2025": { "2": 2 } }
-            for tranche_name, vouchers in token_data.items():
-                if tranche_name not in h_obj.get("vouchers", {}):
-                    continue
-                    
-                for denom, count in vouchers.items():
-                    denom = str(denom)
-                    count = int(count)
-                    total_amount += int(denom) * count
-                    
-                    # Prepare for CSV
-                    for _ in range(count):
-                        voucher_list_for_csv.append(int(denom))
-                    
-                    # Deduct logic
-                    if denom in h_obj["vouchers"][tranche_name]:
-                        current_val = h_obj["vouchers"][tranche_name][denom]
-                        h_obj["vouchers"][tranche_name][denom] = max(0, current_val - count)
-
-            # Sort for display consistency
-            voucher_list_for_csv.sort()
-            
-            # Clear Token
-            households[target_household]["active_token"] = None
-            households[target_household]["token_data"] = None
-            save_households()
+        if redemption:
+            target_household = redemption["household_id"]
+            token_data = redemption["vouchers"]
+            total_amount = redemption["total_amount"]
+            voucher_list_for_csv = redemption["voucher_values"]
             
             # ============================================================
-            # CSV generation logic
+            # Redemption logging
             # ============================================================
             try:
-                csv_dir = os.path.join("storage", "redemptions")
-                os.makedirs(csv_dir, exist_ok=True)
-                
-                now = datetime.now()
-                csv_filename = f"Redeem{now.strftime('%Y%m%d%H')}.csv"
-                csv_path = os.path.join(csv_dir, csv_filename)
-                file_exists = os.path.exists(csv_path)
-                
-                txn_id = f"TX{now.strftime('%Y%m%d%H%M%S')}"
-                txn_time_str = now.strftime("%Y-%m-%d-%H%M%S")
-                
-                with open(csv_path, mode='a', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    if not file_exists:
-                        writer.writerow([
-                            "Transaction_ID", "Household_ID", "Merchant_ID", 
-                            "Transaction_Date_Time", "Voucher_Code", "Denomination_Used", 
-                            "Amount_Redeemed", "Payment_Status", "Remarks"
-                        ])
-                    
-                    total_items = len(voucher_list_for_csv)
-                    for index, denom_val in enumerate(voucher_list_for_csv):
-                        remark = "Final denomination used" if index == total_items - 1 else str(index + 1)
-                        v_code = f"V{target_household[-4:]}{str(index+1).zfill(3)}"
-                        
-                        writer.writerow([
-                            txn_id, target_household, merchant_id, txn_time_str,
-                            v_code, f"${denom_val}.00", f"${total_amount}.00",
-                            "Completed", remark
-                        ])
-                print(f"✅ CSV Logged from Web UI: {csv_path}")
+                log_token_redemption(target_household, merchant_id, voucher_list_for_csv, total_amount)
+                print("✅ Redemption logged from Web UI")
             except Exception as e:
-                print(f"❌ CSV Logging Error: {e}")
+                print(f"❌ Redemption Logging Error: {e}")
             # ============================================================
             
             # Send notification and record
@@ -222,11 +188,13 @@ def merchant_ui():
 @app.route("/ui/redeem/<household_id>", methods=["GET", "POST"])
 def redeem_ui(household_id):
     # 1. Basic validation
+    load_households()
     if household_id not in households:
         return "Household not found", 404
     
     household = households[household_id]
-    vouchers = household.get('vouchers', {})
+    # Vouchers held by the household's other live tokens are not selectable
+    vouchers = household.vouchers_less(token_store.reserved(household_id))
     result = None
 
     if request.method == "POST":
@@ -283,21 +251,19 @@ def redeem_ui(household_id):
         elif not has_selection:
             flash("Please select at least one voucher.", "danger")
         else:
-            # Generate Token
-            token = "TXN-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
+            # Generate Token (its vouchers are reserved until redeemed or expired)
+            entry, status = generate_household_token(household_id, token_data_structured)
             
-            # Save to database
-            households[household_id]["active_token"] = token
-            households[household_id]["token_data"] = token_data_structured # Save structured data
-            save_households()
-            
-            result = {
-                "success": True,
-                "message": "Token Generated Successfully!",
-                "token": token,
-                "vouchers": details_for_display, 
-                "total_value": total_value
-            }
+            if status != 200:
+                flash(entry["error"], "danger")
+            else:
+                result = {
+                    "success": True,
+                    "message": "Token Generated Successfully!",
+                    "token": entry["token"],
+                    "vouchers": details_for_display, 
+                    "total_value": total_value
+                }
 
     return render_template(
         "redeem_voucher.html",
@@ -310,10 +276,11 @@ def redeem_ui(household_id):
 # -----------------------
 @app.route("/ui/balance/<household_id>")
 def balance_ui(household_id):
+    load_households()
     if household_id not in households:
         return "Invalid household", 404
     household = households[household_id]
-    vouchers = household.get('vouchers', {})
+    vouchers = household.vouchers_less(token_store.reserved(household_id))
     return render_template(
         "balance.html",
         household_id=household_id,
@@ -325,6 +292,7 @@ def balance_ui(household_id):
 # -----------------------
 @app.route("/ui/claim/<household_id>", methods=["GET", "POST"])
 def claim_ui(household_id):
+    load_households()
     if household_id not in households:
         return "Invalid household", 404
     result = None
@@ -352,15 +320,45 @@ def create_household():
     response, status = register_household(request.get_json(silent=True))
     return jsonify(response), status
 
+# Content types accepted as streams by the bulk endpoint
+BULK_STREAM_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl"
+}
+
+@app.route("/api/households/bulk", methods=["POST"])
+def create_households_bulk():
+    """Register households from a JSON array, or a CSV / JSON Lines stream"""
+    if request.mimetype == "application/json":
+        data = request.get_json(silent=True)
+        rows = data.get("households") if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            return jsonify({"error": "Expected a list of households"}), 400
+    elif request.mimetype in BULK_STREAM_FORMATS:
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        rows = iter_households(lines, BULK_STREAM_FORMATS[request.mimetype])
+    else:
+        return jsonify({"error": "Send application/json, text/csv or application/x-ndjson"}), 415
+    
+    return jsonify(register_households_bulk(rows)), 200
+
 @app.route("/api/households/<household_id>/claim", methods=["POST"])
 def claim_api(household_id):
     response, status = claim_voucher(household_id, request.get_json(silent=True))
     return jsonify(response), status
 
+def send_cached(entry):
+    """Serve a CachedResponse, or 304 if the client's If-None-Match still matches"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"} if entry.status == 200 else {}
+    if entry.matches(request.headers.get("If-None-Match")):
+        response_cache.count_not_modified()
+        return Response(status=304, headers=headers)
+    return Response(entry.body, entry.status, mimetype="application/json", headers=headers)
+
 @app.route("/api/households/<household_id>/balance", methods=["GET"])
 def balance_api(household_id):
-    response, status = get_redemption_balance(household_id)
-    return jsonify(response), status
+    return send_cached(get_cached_balance(household_id))
 
 @app.route("/api/households/<household_id>/redeem", methods=["POST"])
 def redeem_api(household_id):
@@ -377,10 +375,39 @@ def get_transactions(household_id):
         "transactions": transactions
     }), 200
 
+# Heartbeat interval and longest allowed wait for pushed notifications
+STREAM_KEEPALIVE_SECONDS = 15
+MAX_WAIT_SECONDS = 300
+
+# With SQLite, notifications created by other worker processes never reach
+# this process's event bus, so waiting requests also poll storage
+SHARED_STORAGE = get_backend() is not None
+SHARED_POLL_SECONDS = 2
+
 @app.route("/api/households/<household_id>/notifications", methods=["GET"])
 def get_notifications(household_id):
-    """Get notifications"""
-    notifications = get_unread_notifications(household_id)
+    """Get notifications (long-polls up to ?wait=N seconds when there are none)"""
+    wait = min(request.args.get("wait", 0, type=int), MAX_WAIT_SECONDS)
+    
+    # Subscribe before reading so nothing published in between is missed
+    subscription = event_bus.subscribe(household_id) if wait > 0 else None
+    try:
+        notifications = get_unread_notifications(household_id)
+        deadline = time.monotonic() + wait
+        while not notifications and subscription is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                subscription.get(timeout=min(remaining, SHARED_POLL_SECONDS) if SHARED_STORAGE else remaining)
+            except queue.Empty:
+                if not SHARED_STORAGE:
+                    break
+            notifications = get_unread_notifications(household_id)
+    finally:
+        if subscription is not None:
+            event_bus.unsubscribe(household_id, subscription)
+    
     notif_list = [n["notification"] for n in notifications]
     return jsonify({
         "household_id": household_id,
@@ -388,6 +415,71 @@ def get_notifications(household_id):
         "count": len(notif_list)
     }), 200
 
+@app.route("/api/households/<household_id>/notifications/stream", methods=["GET"])
+def stream_notifications(household_id):
+    """Push new notifications as Server-Sent Events for up to ?timeout=N seconds"""
+    timeout = min(request.args.get("timeout", MAX_WAIT_SECONDS, type=int), MAX_WAIT_SECONDS)
+    subscription = event_bus.subscribe(household_id)
+    
+    def events():
+        try:
+            yield ": connected\n\n"
+            # IDs already unread at connect time or sent, when polling storage
+            seen = None
+            if SHARED_STORAGE:
+                seen = {item["notification_id"] for item in get_unread_notifications(household_id)}
+            deadline = time.monotonic() + timeout
+            last_sent = time.monotonic()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(STREAM_KEEPALIVE_SECONDS, remaining)
+                try:
+                    pending = [subscription.get(timeout=min(wait, SHARED_POLL_SECONDS) if seen is not None else wait)]
+                except queue.Empty:
+                    pending = []
+                
+                if seen is not None:
+                    stored = [
+                        dict(item["notification"], notification_id=item["notification_id"])
+                        for item in reversed(get_unread_notifications(household_id))
+                    ]
+                    fresh = []
+                    for notification in pending + stored:
+                        if notification["notification_id"] not in seen:
+                            seen.add(notification["notification_id"])
+                            fresh.append(notification)
+                    pending = fresh
+                
+                for notification in pending:
+                    yield f"event: notification\ndata: {json.dumps(notification)}\n\n"
+                    last_sent = time.monotonic()
+                if time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            event_bus.unsubscribe(household_id, subscription)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/households/<household_id>/notifications/read", methods=["POST"])
+def read_notifications(household_id):
+    """Mark notifications as read (all unread if no IDs are given)"""
+    data = request.get_json(silent=True) or {}
+    count = mark_notifications_read(household_id, data.get("notification_ids"))
+    return jsonify({"household_id": household_id, "marked": count}), 200
+
+@app.route("/api/households/<household_id>/notifications", methods=["DELETE"])
+def clear_notifications(household_id):
+    """Clear all notifications"""
+    count = clear_all_notifications(household_id)
+    return jsonify({"household_id": household_id, "cleared": count}), 200
+
 # ==========================================
 # TOKEN APIs - NEW!
 # ==========================================
@@ -404,37 +496,39 @@ def generate_token():
     
     load_households()
     
-    if household_id not in households:
-        return jsonify({"error": "Household not found"}), 404
-    
-    # Generate token
-    token = "TXN-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    
-    # Calculate total - Handle both flat (legacy) and nested (new) structures for robustness
-    total = 0
-    # Check if vouchers is nested
-    is_nested = any(isinstance(v, dict) for v in vouchers.values())
-    
-    if is_nested:
-        for tranche, denoms in vouchers.items():
-            for d, c in denoms.items():
-                total += int(d) * int(c)
-    else:
-        # Fallback for flat structure (though we should move away from this)
-        total = sum(int(d) * int(c) for d, c in vouchers.items())
-    
-    # Save token
-    households[household_id]["active_token"] = token
-    households[household_id]["token_data"] = vouchers
-    save_households()
+    # Reserves the selected vouchers until the token is redeemed or expires
+    entry, status = generate_household_token(household_id, vouchers)
+    if status != 200:
+        return jsonify(entry), status
     
+    token = entry["token"]
+    total = entry["total"]
     print(f"✅ Generated token {token} for {household_id} (${total})")
     
     return jsonify({
         "token": token,
-        "vouchers": vouchers,
+        "vouchers": entry["vouchers"],
+        "household_id": household_id,
+        "total": total,
+        "expires_at": entry["expires_at"]
+    }), 200
+
+@app.route("/api/households/<household_id>/tokens", methods=["GET"])
+def household_tokens_api(household_id):
+    """Live tokens held by a household"""
+    load_households()
+    
+    if household_id not in households:
+        return jsonify({"error": "Household not found"}), 404
+    
+    tokens = [
+        {key: entry[key] for key in ("token", "vouchers", "total", "expires_at")}
+        for entry in token_store.tokens_for(household_id)
+    ]
+    return jsonify({
         "household_id": household_id,
-        "total": total
+        "tokens": tokens,
+        "reserved": token_store.reserved(household_id)
     }), 200
 
 @app.route("/api/token/redeem", methods=["POST"])
@@ -454,92 +548,26 @@ def redeem_token():
     load_households()
     load_merchants()
     
-    # Find household with token
-    target_household = None
-    token_data = None
-    
-    for hid, h in households.items():
-        if h.get("active_token") == token:
-            target_household = hid
-            token_data = h.get("token_data")
-            break
+    # Consume the token and deduct vouchers atomically
+    redemption = redeem_household_token(token)
     
-    if not target_household or not token_data:
+    if not redemption:
         return jsonify({"error": "Invalid or expired token"}), 400
     
-    # Calculate total and Prepare CSV Data
-    total_amount = 0
-    voucher_list_for_csv = []
-    
-    household = households[target_household]
-    
-    # Check structure of token_data
-    # We expect { "Jan2026": { "10": 1 } }
-    
-    # Deduct Logic
-    for tranche_name, vouchers in token_data.items():
-        if tranche_name not in household.get("vouchers", {}):
-            continue
-            
-        for denom, count in vouchers.items():
-            denom = str(denom)
-            count = int(count)
-            total_amount += int(denom) * count
-            
-            # Prepare CSV list
-            for _ in range(count):
-                voucher_list_for_csv.append(int(denom))
-                
-            # Deduct
-            if denom in household["vouchers"][tranche_name]:
-                household["vouchers"][tranche_name][denom] = max(0, household["vouchers"][tranche_name][denom] - count)
-
-    # Clear token
-    households[target_household]["active_token"] = None
-    households[target_household]["token_data"] = None
-    save_households()
+    target_household = redemption["household_id"]
+    token_data = redemption["vouchers"]
+    total_amount = redemption["total_amount"]
+    voucher_list_for_csv = redemption["voucher_values"]
     
     merchant_name = merchants.get(merchant_id, {}).get("merchant_name", "Merchant")
     
-    # ✅ LOG TO CSV FILE - UNIFIED FORMAT WITH WEB UI
+    # ✅ LOG REDEMPTION - UNIFIED FORMAT WITH WEB UI
+    txn_id = None
     try:
-        os.makedirs("storage/redemptions", exist_ok=True)
-        now = datetime.now()
-        csv_filename = f"storage/redemptions/Redeem{now.strftime('%Y%m%d%H')}.csv"
-        csv_path = os.path.join(csv_filename) # Reuse path var
-        file_exists = os.path.exists(csv_path)
-
-        txn_id = f"TX{now.strftime('%Y%m%d%H%M%S')}"
-        txn_time_str = now.strftime("%Y-%m-%d-%H%M%S")
-        
-        # Sort for consistency
-        voucher_list_for_csv.sort()
-        
-        with open(csv_path, mode="a", newline="", encoding='utf-8') as f:
-            writer = csv.writer(f)
-            # Write Header if new file
-            if not file_exists:
-                writer.writerow([
-                    "Transaction_ID", "Household_ID", "Merchant_ID", 
-                    "Transaction_Date_Time", "Voucher_Code", "Denomination_Used", 
-                    "Amount_Redeemed", "Payment_Status", "Remarks"
-                ])
-            
-            total_items = len(voucher_list_for_csv)
-            for index, denom_val in enumerate(voucher_list_for_csv):
-                remark = "Final denomination used" if index == total_items - 1 else str(index + 1)
-                v_code = f"V{target_household[-4:]}{str(index+1).zfill(3)}"
-                
-                writer.writerow([
-                    txn_id, target_household, merchant_id, txn_time_str,
-                    v_code, f"${denom_val}.00", f"${total_amount}.00",
-                    "Completed", remark
-                ])
-                
-        print(f"✅ Logged to CSV: {csv_filename}")
-            
+        txn_id = log_token_redemption(target_household, merchant_id, voucher_list_for_csv, total_amount)
+        print(f"✅ Logged redemption {txn_id}")
     except Exception as e:
-        print(f"⚠️ CSV logging failed: {e}")
+        print(f"⚠️ Redemption logging failed: {e}")
         import traceback
         traceback.print_exc()
     
@@ -553,6 +581,7 @@ def redeem_token():
     
     return jsonify({
         "success": True,
+        "transaction_id": txn_id,
         "household_id": target_household,
         "amount": total_amount,
         "vouchers": token_data,
@@ -571,12 +600,17 @@ def merchant_api():
 @app.route("/api/merchants/<merchant_id>", methods=["GET"])
 def get_merchant(merchant_id):
     """Get merchant details"""
+    return send_cached(get_cached_merchant(merchant_id))
+
+@app.route("/api/merchants/<merchant_id>/analytics", methods=["GET"])
+def merchant_analytics(merchant_id):
+    """Get pre-aggregated sales figures for the merchant dashboard"""
     load_merchants()
     
     if merchant_id not in merchants:
         return jsonify({"error": "Merchant not found"}), 404
     
-    return jsonify(merchants[merchant_id]), 200
+    return jsonify(get_merchant_analytics(merchant_id)), 200
 
 # ==========================================
 # NOTIFICATION APIs
@@ -585,19 +619,48 @@ def get_merchant(merchant_id):
 @app.route("/api/notifications/<path:notification_id>", methods=["DELETE"])
 def delete_notification(notification_id):
     """Delete notification"""
-    filepath = f"storage/notifications/{notification_id}"
-    if not filepath.endswith('.json'):
-        filepath += '.json'
-    
     try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        if remove_notification(notification_id):
             return jsonify({"success": True}), 200
         else:
             return jsonify({"error": "Notification not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ==========================================
+# DISBURSEMENT APIs
+# ==========================================
+
+@app.route("/api/disbursements", methods=["POST"])
+def create_disbursement():
+    """Credit a tranche to every household in the background"""
+    data = request.get_json(silent=True) or {}
+    if "tranche" not in data:
+        return jsonify({"error": "Missing field: tranche"}), 400
+    response, status = start_disbursement(data["tranche"])
+    return jsonify(response), status
+
+@app.route("/api/disbursements/<tranche>", methods=["GET"])
+def disbursement_status(tranche):
+    """Progress of a tranche disbursement"""
+    response, status = get_disbursement_status(tranche)
+    return jsonify(response), status
+
+# ==========================================
+# SYSTEM APIs
+# ==========================================
+
+@app.route("/api/system/cache", methods=["GET"])
+def cache_stats():
+    """Storage and response cache hit/miss/reload counters"""
+    return jsonify({
+        "households": household_cache.stats(),
+        "merchants": merchant_cache.stats(),
+        "tokens": token_store.stats(),
+        "responses": response_cache.stats(),
+        "redemption_log": redemption_log.stats()
+    }), 200
+
 # ==========================================
 # ERROR HANDLERS
 # ==========================================
@@ -613,5 +676,8 @@ def server_error(e):
 if __name__ == "__main__":
     print("\n🚀 Starting Flask API Server...")
     print("📍 URL: http://localhost:8000")
-    print("💡 Press Ctrl+C to stop\n")
-    app.run(debug=True, port=8000, host='0.0.0.0')
\ No newline at end of file
+    print("💡 Press Ctrl+C to stop")
+    print("💡 Development server only; see wsgi.py for production\n")
+    # No reloader: it would import this module twice and start the
+    # background jobs and caches in two processes
+    app.run(debug=True, port=8000, host='0.0.0.0', use_reloader=False)
\ No newline at end of file
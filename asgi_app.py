@@ -0,0 +1,189 @@
+"""
+Asynchronous (ASGI) server for the CDC Voucher API
+
+The routes household apps poll - balance, transactions and notifications
+(long-poll and stream) - are served here by async handlers. Their storage
+reads run on a bounded I/O thread pool, and clients waiting for a
+notification sit on the event loop instead of holding a thread each, so one
+process can keep tens of thousands of connections open. Every other route
+is handed to the Flask app in app.py unchanged, and both share the same
+in-memory state.
+
+    uvicorn asgi_app:app --port 8000
+    python asgi_app.py
+
+Needs `starlette`, `uvicorn` and `a2wsgi`. Raise the open-file limit
+(`ulimit -n`) for very large numbers of connections. Running several
+uvicorn workers needs CDC_STORAGE_BACKEND=sqlite, as for wsgi.py.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    app as flask_app,
+    get_cached_balance,
+    response_cache,
+    get_transaction_history,
+    get_unread_notifications,
+    event_bus,
+    STREAM_KEEPALIVE_SECONDS,
+    MAX_WAIT_SECONDS,
+    SHARED_STORAGE,
+    SHARED_POLL_SECONDS
+)
+
+# Threads for blocking storage reads, shared by all async handlers
+IO_THREADS = int(os.environ.get("CDC_IO_THREADS", "32"))
+# Threads for requests passed through to the Flask app
+WSGI_THREADS = int(os.environ.get("CDC_THREADS", "16"))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="cdc-io")
+
+async def run_io(fn, *args):
+    """Run a blocking storage call on the I/O pool"""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, fn, *args)
+
+def json_response(data, status=200):
+    """JSON body in the same form as Flask's jsonify()"""
+    body = json.dumps(data, separators=(",", ":"), sort_keys=True) + "\n"
+    return Response(body, status_code=status, media_type="application/json")
+
+def int_arg(request, name, default):
+    """Integer query parameter, or the default if missing or invalid"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+# ------------------------------
+# HOUSEHOLD POLLING ROUTES
+# ------------------------------
+async def balance_api(request):
+    entry = await run_io(get_cached_balance, request.path_params["household_id"])
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"} if entry.status == 200 else {}
+    if entry.matches(request.headers.get("if-none-match")):
+        response_cache.count_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, status_code=entry.status, media_type="application/json", headers=headers)
+
+async def get_transactions(request):
+    """Get transaction history"""
+    household_id = request.path_params["household_id"]
+    limit = int_arg(request, "limit", 20)
+    transactions = await run_io(get_transaction_history, household_id, limit)
+    return json_response({
+        "household_id": household_id,
+        "transactions": transactions
+    })
+
+async def get_notifications(request):
+    """Get notifications (long-polls up to ?wait=N seconds when there are none)"""
+    household_id = request.path_params["household_id"]
+    wait = min(int_arg(request, "wait", 0), MAX_WAIT_SECONDS)
+    loop = asyncio.get_running_loop()
+
+    # Subscribe before reading so nothing published in between is missed
+    subscription = event_bus.subscribe_async(household_id) if wait > 0 else None
+    try:
+        notifications = await run_io(get_unread_notifications, household_id)
+        deadline = loop.time() + wait
+        while not notifications and subscription is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await subscription.get(min(remaining, SHARED_POLL_SECONDS) if SHARED_STORAGE else remaining)
+            except asyncio.TimeoutError:
+                if not SHARED_STORAGE:
+                    break
+            notifications = await run_io(get_unread_notifications, household_id)
+    finally:
+        if subscription is not None:
+            event_bus.unsubscribe(household_id, subscription)
+
+    notif_list = [n["notification"] for n in notifications]
+    return json_response({
+        "household_id": household_id,
+        "notifications": notif_list,
+        "count": len(notif_list)
+    })
+
+async def stream_notifications(request):
+    """Push new notifications as Server-Sent Events for up to ?timeout=N seconds"""
+    household_id = request.path_params["household_id"]
+    timeout = min(int_arg(request, "timeout", MAX_WAIT_SECONDS), MAX_WAIT_SECONDS)
+    loop = asyncio.get_running_loop()
+    subscription = event_bus.subscribe_async(household_id)
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            # IDs already unread at connect time or sent, when polling storage
+            seen = None
+            if SHARED_STORAGE:
+                unread = await run_io(get_unread_notifications, household_id)
+                seen = {item["notification_id"] for item in unread}
+            deadline = loop.time() + timeout
+            last_sent = loop.time()
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                wait = min(STREAM_KEEPALIVE_SECONDS, remaining)
+                try:
+                    pending = [await subscription.get(min(wait, SHARED_POLL_SECONDS) if seen is not None else wait)]
+                except asyncio.TimeoutError:
+                    pending = []
+
+                if seen is not None:
+                    unread = await run_io(get_unread_notifications, household_id)
+                    stored = [
+                        dict(item["notification"], notification_id=item["notification_id"])
+                        for item in reversed(unread)
+                    ]
+                    fresh = []
+                    for notification in pending + stored:
+                        if notification["notification_id"] not in seen:
+                            seen.add(notification["notification_id"])
+                            fresh.append(notification)
+                    pending = fresh
+
+                for notification in pending:
+                    yield f"event: notification\ndata: {json.dumps(notification)}\n\n"
+                    last_sent = loop.time()
+                if loop.time() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                    yield ": keep-alive\n\n"
+                    last_sent = loop.time()
+        finally:
+            # Also runs when the client disconnects and the stream is cancelled
+            event_bus.unsubscribe(household_id, subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+app = Starlette(routes=[
+    Route("/api/households/{household_id}/balance", balance_api, methods=["GET"]),
+    Route("/api/households/{household_id}/transactions", get_transactions, methods=["GET"]),
+    Route("/api/households/{household_id}/notifications", get_notifications, methods=["GET"]),
+    Route("/api/households/{household_id}/notifications/stream", stream_notifications, methods=["GET"]),
+    # Everything else (including POST/DELETE on the routes above)
+    Mount("/", WSGIMiddleware(flask_app, workers=WSGI_THREADS))
+])
+
+if __name__ == "__main__":
+    import uvicorn
+
+    host = os.environ.get("CDC_HOST", "0.0.0.0")
+    port = int(os.environ.get("CDC_PORT", "8000"))
+    print(f"🚀 Serving on http://{host}:{port} (asyncio, uvicorn)")
+    uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,28 @@
+"""
+gunicorn settings for the CDC Voucher API
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('CDC_HOST', '0.0.0.0')}:{os.environ.get('CDC_PORT', '8000')}"
+workers = int(os.environ.get("CDC_WORKERS", multiprocessing.cpu_count()))
+
+# Worker processes share state through SQLite (see wsgi.py)
+os.environ.setdefault("CDC_STORAGE_BACKEND", "sqlite")
+if os.environ["CDC_STORAGE_BACKEND"].lower() != "sqlite" and workers > 1:
+    raise RuntimeError("Multiple workers need CDC_STORAGE_BACKEND=sqlite; "
+                       "JSON file storage supports one worker (CDC_WORKERS=1)")
+
+# Threads per worker; each open notification stream holds one
+worker_class = "gthread"
+threads = int(os.environ.get("CDC_THREADS", "16"))
+
+# Long-polls and notification streams can stay open for up to 300 seconds
+timeout = 330
+graceful_timeout = 30
+
+# Each worker imports the app itself, so caches, SQLite connections and
+# background threads are never shared across a fork
+preload_app = False
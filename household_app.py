@@ -10,6 +10,7 @@ import re
 from datetime import datetime
 
 from api_client import api_client
+from api_tasks import ApiTaskRunner
 
 def validate_singapore_postal_code(postal_code):
     """Validate Singapore postal code (6 digits)"""
@@ -47,12 +48,21 @@ def main(page: ft.Page):
     # FIXED: selected_vouchers is now a nested dict: { "TrancheName": { "Denom": Count } }
     session = {"user_id": None, "selected_vouchers": {}, "members": []}
 
+    # API calls from event handlers run in the background; views are built
+    # when their data arrives (key="view" keeps only the latest screen)
+    tasks = ApiTaskRunner(page)
+
     def show_snack(text, color="blue"):
         page.snack_bar = ft.SnackBar(ft.Text(text), bgcolor=color)
         page.snack_bar.open = True
         page.update()
 
+    # Bumped on logout, so a listener thread from an earlier login (possibly
+    # still blocked reading its stream) stops delivering notifications
+    listener_state = {"generation": 0}
+
     def logout():
+        listener_state["generation"] += 1
         session.clear()
         session["selected_vouchers"] = {}
         session["members"] = []
@@ -60,6 +70,39 @@ def main(page: ft.Page):
         page.add(login_view())
         page.update()
 
+    def start_notification_listener(uid):
+        """Subscribe once per login; redemptions are pushed instead of polled"""
+        if session.get("listening_for") == uid:
+            return
+        session["listening_for"] = uid
+        generation = listener_state["generation"]
+
+        def current():
+            return listener_state["generation"] == generation and session.get("user_id") == uid
+
+        def show_notification(notification):
+            # Runs on the page's event loop
+            if not current():
+                return
+            amount = notification.get("amount", 0)
+            merchant = notification.get("merchant_name", "Merchant")
+            show_snack(f"✅ ${amount} redeemed at {merchant}!", "green")
+            tasks.run("mark_notifications_read", uid, [notification["notification_id"]])
+
+        def listen():
+            # Only the blocking stream read happens on this thread
+            while current():
+                try:
+                    for notification in api_client.stream_notifications(uid):
+                        if not current():
+                            return
+                        tasks.call_soon(show_notification, notification)
+                except Exception as e:
+                    print(f"⚠️ Notification stream disconnected: {e}")
+                    time.sleep(5)
+
+        threading.Thread(target=listen, name="notification-listener", daemon=True).start()
+
     # LOGIN VIEW
     def login_view():
         user_id_input = ft.TextField(label="Household ID", width=350, prefix_icon="home")
@@ -78,8 +121,10 @@ def main(page: ft.Page):
             user_id_input.error_text = None
             page.update()
 
-            response, status = api_client.get_balance(uid)
-            
+            tasks.run("get_balance", uid, key="view",
+                      on_result=lambda response, status: finish_login(uid, response, status))
+
+        def finish_login(uid, response, status):
             if status == 200:
                 session["user_id"] = uid
                 vouchers = response.get("vouchers", {})
@@ -256,6 +301,10 @@ def main(page: ft.Page):
 
     # CLAIM VOUCHERS VIEW
     def claim_vouchers_view():
+        tasks.run("get_balance", session["user_id"], key="view",
+                  on_result=lambda response, status: show_claim_vouchers(response.get("vouchers", {}) if status == 200 else {}))
+
+    def show_claim_vouchers(existing_vouchers):
         page.controls.clear()
         
         schemes = {
@@ -264,7 +313,10 @@ def main(page: ft.Page):
         }
         
         def claim_scheme(scheme_name, vouchers):
-            response, status = api_client.claim_vouchers(session["user_id"], scheme_name)
+            tasks.run("claim_vouchers", session["user_id"], scheme_name,
+                      on_result=lambda response, status: on_claimed(scheme_name, response, status))
+        
+        def on_claimed(scheme_name, response, status):
             if status == 200:
                 show_snack(f"Successfully claimed {scheme_name}!", "green")
                 claim_vouchers_view()
@@ -275,9 +327,6 @@ def main(page: ft.Page):
                 else:
                     show_snack(f"Error: {error}", "red")
         
-        response, status = api_client.get_balance(session["user_id"])
-        existing_vouchers = response.get("vouchers", {}) if status == 200 else {}
-        
         def scheme_card(name, vouchers_dict):
             total_value = sum(int(denom) * count for denom, count in vouchers_dict.items())
             # FIX 1: Check if tranche has vouchers with count > 0
@@ -336,13 +385,13 @@ def main(page: ft.Page):
 
     # HOUSEHOLD DASHBOARD (FIXED SELECTION LOGIC)
     def household_dashboard():
+        tasks.run("get_balance", session["user_id"], key="view",
+                  on_result=lambda response, status: show_dashboard(response.get("vouchers", {}) if status == 200 else {}))
+
+    def show_dashboard(vouchers):
         page.controls.clear()
         
-        response, status = api_client.get_balance(session["user_id"])
-        vouchers = response.get("vouchers", {}) if status == 200 else {}
-        
-        def check_notifications_once():
-            notif_response, notif_status = api_client.get_notifications(session["user_id"])
+        def show_unread(notif_response, notif_status):
             if notif_status == 200:
                 notifications = notif_response.get("notifications", [])
                 if notifications:
@@ -350,8 +399,13 @@ def main(page: ft.Page):
                     amount = most_recent.get("amount", 0)
                     merchant = most_recent.get("merchant_name", "Merchant")
                     show_snack(f"✅ ${amount} redeemed at {merchant}!", "green")
+                    tasks.run(
+                        "mark_notifications_read",
+                        session["user_id"], [n["notification_id"] for n in notifications]
+                    )
         
-        check_notifications_once()
+        tasks.run("get_notifications", session["user_id"], on_result=show_unread)
+        start_notification_listener(session["user_id"])
         
         vouchers_column = ft.Column(spacing=15, scroll=ft.ScrollMode.AUTO, horizontal_alignment="center")
         summary_text = ft.Text("Total Selected: $0", size=18, weight="bold", color="blue")
@@ -450,16 +504,18 @@ def main(page: ft.Page):
                         show_snack(f"Insufficient ${d} vouchers in {tr}", "red")
                         return
 
-            # API Call - sends the NESTED dict
-            response, status = api_client.generate_token(session["user_id"], selected)
-            
+            # API Call - sends (a copy of) the NESTED dict
+            selected = {tr: dict(denoms) for tr, denoms in selected.items()}
+            tasks.run("generate_token", session["user_id"], selected, on_result=show_code)
+
+        def show_code(response, status):
             if status == 200:
                 token = response["token"]
                 total = response["total"]
                 
                 # Format voucher text to show Tranche info
                 details = []
-                for tr, denoms in selected.items():
+                for tr, denoms in response["vouchers"].items():
                     for d, c in denoms.items():
                         details.append(f"{tr}: ${d}x{c}")
                 voucher_text = "\n".join(details)
@@ -520,9 +576,11 @@ def main(page: ft.Page):
 
         # HISTORY VIEW
         def transaction_history_view():
+            tasks.run("get_transactions", session["user_id"], limit=20, key="view",
+                      on_result=lambda response, status: show_transaction_history(response.get("transactions", []) if status == 200 else []))
+
+        def show_transaction_history(transactions):
             page.controls.clear()
-            response, status = api_client.get_transactions(session["user_id"], limit=20)
-            transactions = response.get("transactions", []) if status == 200 else []
             history_column = ft.Column(spacing=10, scroll=ft.ScrollMode.AUTO)
             
             if not transactions:
@@ -9,6 +9,7 @@ import time
 from datetime import datetime
 
 from api_client import api_client
+from api_tasks import ApiTaskRunner
 
 def validate_uen(uen):
     """
@@ -88,25 +89,6 @@ def validate_account_number(account_number):
     
     return True, ""
 
-def parse_timestamp_to_time(timestamp):
-    """Parse timestamp to time string, handling multiple formats"""
-    try:
-        # Format 1: "2026-02-12-143000" (from CSV)
-        if '-' in timestamp and len(timestamp) >= 17:
-            parts = timestamp.split('-')
-            if len(parts) == 4:
-                time_part = parts[3]  # "143000"
-                return f"{time_part[0:2]}:{time_part[2:4]}:{time_part[4:6]}"
-        
-        # Format 2: "20260212143000" (compact)
-        if len(timestamp) == 14 and timestamp.isdigit():
-            return datetime.strptime(timestamp, "%Y%m%d%H%M%S").strftime("%H:%M:%S")
-        
-        # Fallback: return as-is
-        return timestamp[:8] if len(timestamp) > 8 else timestamp
-    except:
-        return timestamp
-
 def main(page: ft.Page):
     print("="*50)
     print("🚀 Starting Merchant App...")
@@ -150,6 +132,10 @@ def main(page: ft.Page):
     
     session = {"merchant_id": None, "merchant_name": None, "transactions": []}
 
+    # API calls from event handlers run in the background; views are built
+    # when their data arrives (key="view" keeps only the latest screen)
+    tasks = ApiTaskRunner(page)
+
     def show_snack(text, color="blue"):
         page.snack_bar = ft.SnackBar(ft.Text(text), bgcolor=color)
         page.snack_bar.open = True
@@ -172,7 +158,10 @@ def main(page: ft.Page):
                 show_snack("Please enter ID", "red")
                 return
 
-            response, status = api_client.get_merchant(mid)
+            tasks.run("get_merchant", mid, key="view",
+                      on_result=lambda response, status: finish_login(mid, response, status))
+
+        def finish_login(mid, response, status):
             session["merchant_id"] = mid
             session["merchant_name"] = response.get("merchant_name", "Merchant") if status == 200 else "Merchant"
             merchant_terminal()
@@ -324,27 +313,31 @@ def main(page: ft.Page):
                     show_snack(message, "red")
                     return
 
-            # Generate unique merchant ID on frontend with collision check
-            merchant_id = None
-            max_attempts = 10
-            
-            for attempt in range(max_attempts):
-                temp_id = f"M{random.randint(100, 999)}"
-                # Check if ID exists by trying to get merchant
-                check_response, check_status = api_client.get_merchant(temp_id)
-                if check_status == 404:  # ID doesn't exist, it's unique!
-                    merchant_id = temp_id
-                    print(f"✅ Generated unique merchant ID: {merchant_id} (attempt {attempt + 1})")
-                    break
-                else:
-                    print(f"⚠️  ID {temp_id} already exists, retrying... (attempt {attempt + 1})")
-            
-            if not merchant_id:
-                # Fallback: use timestamp-based ID if all random attempts failed
-                import time
-                merchant_id = f"M{int(time.time()) % 1000:03d}"
-                print(f"⚠️  Using timestamp-based ID: {merchant_id}")
-            
+            # Generate unique merchant ID on frontend with collision check;
+            # each check runs in the background and starts the next attempt
+            try_merchant_id(0)
+
+        def try_merchant_id(attempt, max_attempts=10):
+            temp_id = f"M{random.randint(100, 999)}"
+            # Check if ID exists by trying to get merchant
+            tasks.run("get_merchant", temp_id, key="view",
+                      on_result=lambda response, status: check_merchant_id(temp_id, attempt, max_attempts, status))
+
+        def check_merchant_id(temp_id, attempt, max_attempts, check_status):
+            if check_status == 404:  # ID doesn't exist, it's unique!
+                print(f"✅ Generated unique merchant ID: {temp_id} (attempt {attempt + 1})")
+                register_with_id(temp_id)
+                return
+            print(f"⚠️  ID {temp_id} already exists, retrying... (attempt {attempt + 1})")
+            if attempt + 1 < max_attempts:
+                try_merchant_id(attempt + 1, max_attempts)
+                return
+            # Fallback: use timestamp-based ID if all random attempts failed
+            merchant_id = f"M{int(time.time()) % 1000:03d}"
+            print(f"⚠️  Using timestamp-based ID: {merchant_id}")
+            register_with_id(merchant_id)
+
+        def register_with_id(merchant_id):
             merchant_data = {
                 "merchant_id": merchant_id,  # Add generated unique ID
                 "merchant_name": merchant_name_input.value.strip(),
@@ -359,8 +352,11 @@ def main(page: ft.Page):
             print(f"🔍 Registering merchant with ID: {merchant_id}")
             print(f"📝 Data: {merchant_data}")
             
-            response, status = api_client.register_merchant(merchant_data)
-            
+            tasks.run("register_merchant", merchant_data, key="view",
+                      on_result=lambda response, status: show_registration_result(merchant_data, response, status))
+
+        def show_registration_result(merchant_data, response, status):
+            merchant_id = merchant_data["merchant_id"]
             print(f"📬 Response: {response}, Status: {status}")
             
             if status in [200, 201]:
@@ -488,112 +484,36 @@ def main(page: ft.Page):
 
     # ANALYTICS DASHBOARD
     def analytics_dashboard():
+        # Figures are aggregated by the API as redemptions happen
+        tasks.run("get_merchant_analytics", session["merchant_id"], key="view", on_result=show_analytics)
+
+    def show_analytics(response, status):
         page.controls.clear()
         
-        # Read all CSV files from storage/redemptions
-        import csv
-        import os
-        from datetime import datetime
+        if status != 200:
+            show_snack(f"❌ {response.get('error', 'Could not load analytics')}", "red")
+            response = {}
         
-        all_transactions = []
-        merchant_transactions = []
-        
-        redemptions_dir = "storage/redemptions"
-        
-        if os.path.exists(redemptions_dir):
-            csv_files = [f for f in os.listdir(redemptions_dir) if f.endswith('.csv')]
-            
-            for csv_file in csv_files:
-                filepath = os.path.join(redemptions_dir, csv_file)
-                try:
-                    with open(filepath, 'r') as f:
-                        reader = csv.reader(f)
-                        seen_transactions = set()  # Track unique transaction IDs
-                        
-                        for row in reader:
-                            if len(row) >= 7:  # Ensure valid row
-                                transaction_id = row[0]
-                                
-                                # Skip header row
-                                if transaction_id == "Transaction_ID":
-                                    continue
-                                
-                                # Skip duplicate transaction IDs (same transaction, different denomination rows)
-                                if transaction_id in seen_transactions:
-                                    continue
-                                seen_transactions.add(transaction_id)
-                                
-                                household_id = row[1]
-                                merchant_id = row[2]
-                                timestamp = row[3]
-                                voucher_code = row[4]
-                                denomination_used = row[5]
-                                amount_redeemed = row[6]
-                                
-                                # Parse amount: "$30.00" -> 30
-                                try:
-                                    # Remove $ and convert to float then int
-                                    total_amount = int(float(amount_redeemed.replace('$', '').replace(',', '')))
-                                except (ValueError, AttributeError):
-                                    total_amount = 0
-                                
-                                # Skip $0 transactions
-                                if total_amount == 0:
-                                    continue
-                                
-                                all_transactions.append({
-                                    "transaction_id": transaction_id,
-                                    "household_id": household_id,
-                                    "merchant_id": merchant_id,
-                                    "timestamp": timestamp,
-                                    "token": voucher_code,
-                                    "voucher_details": denomination_used,
-                                    "amount": total_amount
-                                })
-                                
-                                # Filter for current merchant
-                                if merchant_id == session["merchant_id"]:
-                                    merchant_transactions.append({
-                                        "transaction_id": transaction_id,
-                                        "household_id": household_id,
-                                        "timestamp": timestamp,
-                                        "token": voucher_code,
-                                        "voucher_details": denomination_used,
-                                        "amount": total_amount,
-                                        "time": parse_timestamp_to_time(timestamp)
-                                    })
-                except Exception as e:
-                    print(f"Error reading {csv_file}: {e}")
-        
-        # Calculate analytics from merchant transactions
-        total_transactions = len(merchant_transactions)
-        total_revenue = sum(txn["amount"] for txn in merchant_transactions)
+        total_transactions = response.get("total_transactions", 0)
+        total_revenue = response.get("total_revenue", 0)
+        total_revenue = int(total_revenue) if total_revenue == int(total_revenue) else total_revenue
         
         # Today's transactions
-        today = datetime.now().strftime("%Y%m%d")  # "20260212"
-        today_with_dash = datetime.now().strftime("%Y-%m-%d")  # "2026-02-12"
-        
-        today_transactions = [
-            txn for txn in merchant_transactions 
-            if txn["timestamp"].startswith(today) or txn["timestamp"].startswith(today_with_dash)
-        ]
-        today_count = len(today_transactions)
-        today_revenue = sum(txn["amount"] for txn in today_transactions)
+        today = response.get("today", {})
+        today_count = today.get("transactions", 0)
+        today_revenue = today.get("revenue", 0)
+        today_revenue = int(today_revenue) if today_revenue == int(today_revenue) else today_revenue
         
         # Average transaction value
-        avg_transaction = total_revenue / total_transactions if total_transactions > 0 else 0
+        avg_transaction = response.get("average_transaction", 0)
         
         # Voucher amount breakdown
-        amount_breakdown = {}
-        for txn in merchant_transactions:
-            amount = txn["amount"]
-            if amount in amount_breakdown:
-                amount_breakdown[amount] += 1
-            else:
-                amount_breakdown[amount] = 1
+        amount_breakdown = {
+            item["amount"]: item["transactions"] for item in response.get("amount_breakdown", [])
+        }
         
         # Recent transactions list (last 10)
-        recent_txns = sorted(merchant_transactions, key=lambda x: x["timestamp"], reverse=True)[:10]
+        recent_txns = response.get("recent_transactions", [])
         
         # Stats cards
         def stat_card(title, value, icon, color, subtitle=""):
@@ -782,8 +702,11 @@ def main(page: ft.Page):
                 show_snack("Enter a token", "red")
                 return
             
-            response, status = api_client.redeem_token(token_val, session["merchant_id"])
-            
+            # A double-tap sends one request: identical calls in flight are shared
+            tasks.run("redeem_token", token_val, session["merchant_id"],
+                      on_result=lambda response, status: show_payment_result(token_val, response, status))
+
+        def show_payment_result(token_val, response, status):
             if status == 200:
                 total_amt = response["amount"]
                 vouchers = response["vouchers"]
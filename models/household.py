@@ -1,32 +1,140 @@
+"""
+Household model
+
+Voucher balances are held compactly. A shared registry numbers each
+(tranche, denomination) pair once, and every household keeps its counts in
+a fixed-width integer array indexed by those numbers, plus a bitmask of the
+pairs it holds. Face values are parsed once, in the registry, so totals are
+plain integer sums. Households still read and serialise as the usual
+{"Jan2026": {"2": 30, "5": 12, "10": 18}} voucher dicts.
+"""
+import threading
+from array import array
+
+class VoucherRegistry:
+    """Numbers every (tranche, denomination) pair; shared by all households"""
+
+    def __init__(self):
+        self.slots = {}           # (tranche, denom) -> slot
+        self.tranches = {}        # tranche -> [(denom, slot)] in first-seen order
+        self.tranche_masks = {}   # tranche -> bitmask of its slots
+        self.values = array("l")  # face value in dollars per slot
+        # (tranche, mask, ((denom, slot), ...)) per tranche; replaced, never
+        # mutated, so readers can iterate it while a slot is being added
+        self.layout = ()
+        self._lock = threading.Lock()
+
+    def slot(self, tranche, denom):
+        """Slot number for a pair, registering it on first use"""
+        slot = self.slots.get((tranche, denom))
+        if slot is None:
+            with self._lock:
+                slot = self.slots.get((tranche, denom))
+                if slot is None:
+                    slot = len(self.values)
+                    self.values.append(int(denom))
+                    self.tranches.setdefault(tranche, []).append((denom, slot))
+                    self.tranche_masks[tranche] = self.tranche_masks.get(tranche, 0) | (1 << slot)
+                    self.layout = tuple(
+                        (name, self.tranche_masks[name], tuple(pairs))
+                        for name, pairs in self.tranches.items()
+                    )
+                    # Published last so readers never see a half-registered slot
+                    self.slots[(tranche, denom)] = slot
+        return slot
+
+# Shared by every Household in the process
+voucher_registry = VoucherRegistry()
+
 class Household:
 
-    TRANCHE_CONFIG = {
-        "Jan2026": {"2": 30, "5": 12, "10": 15},
-        "May2025": {"2": 50, "5": 20, "10": 30}
-    }
+    __slots__ = ("household_id", "members", "postal_code", "counts", "held", "extra_data")
 
-    def __init__(self, household_id, members, postal_code, vouchers = None):
+    FIELDS = ("household_id", "members", "postal_code", "vouchers")
+
+    def __init__(self, household_id, members, postal_code, vouchers=None):
         self.household_id = household_id
         self.members = members
         self.postal_code = postal_code
-        self.vouchers = vouchers if vouchers is not None else {}
-        self.extra_data = {} 
-
-    def claim_tranche(self, tranche_name):
-        if tranche_name not in self.TRANCHE_CONFIG:
-            return False, "Invalid tranche name."
-        if tranche_name in self.vouchers:
-            return False, "Tranche already claimed."
-        
-        self.vouchers[tranche_name] = self.TRANCHE_CONFIG[tranche_name].copy()
-        return True, "Vouchers claimed successfully."
+        self.counts = array("i")   # count per registry slot
+        self.held = 0              # bitmask of slots this household holds
+        self.extra_data = None     # unknown keys from older files, if any
+        if vouchers:
+            self.vouchers = vouchers
+
+    # Voucher balances
+
+    @property
+    def vouchers(self):
+        """Balances as {tranche: {denom: count}} (a new dict on each access)"""
+        return self.vouchers_less()
+
+    @vouchers.setter
+    def vouchers(self, vouchers):
+        self.counts = array("i")
+        self.held = 0
+        for tranche, denoms in vouchers.items():
+            self.set_tranche(tranche, denoms)
+
+    def vouchers_less(self, reserved=None):
+        """
+        Balances as {tranche: {denom: count}}, less any reserved counts
+
+        Args:
+            reserved: Optional {tranche: {denom: count}} to subtract
+        """
+        held, counts = self.held, self.counts
+        result = {}
+        for tranche, mask, pairs in voucher_registry.layout:
+            if not held & mask:
+                continue
+            less = reserved.get(tranche, {}) if reserved else {}
+            result[tranche] = {
+                denom: counts[slot] - less.get(denom, 0)
+                for denom, slot in pairs
+                if held >> slot & 1
+            }
+        return result
+
+    def has_tranche(self, tranche):
+        return bool(self.held & voucher_registry.tranche_masks.get(tranche, 0))
+
+    def count(self, tranche, denom):
+        """Count of one denomination, or None if the household does not hold it"""
+        slot = voucher_registry.slots.get((tranche, str(denom)))
+        if slot is None or not self.held >> slot & 1:
+            return None
+        return self.counts[slot]
+
+    def set_count(self, tranche, denom, count):
+        slot = voucher_registry.slot(tranche, str(denom))
+        if slot >= len(self.counts):
+            self.counts.extend([0] * (slot + 1 - len(self.counts)))
+        self.counts[slot] = int(count)
+        self.held |= 1 << slot
+
+    def set_tranche(self, tranche, denoms):
+        for denom, count in denoms.items():
+            self.set_count(tranche, denom, count)
+
+    def remove_tranche(self, tranche):
+        mask = voucher_registry.tranche_masks.get(tranche, 0)
+        for slot in range(len(self.counts)):
+            if mask >> slot & 1:
+                self.counts[slot] = 0
+        self.held &= ~mask
+
+    def deduct(self, tranche, denom, count):
+        """Subtract from one denomination; returns the remaining count"""
+        slot = voucher_registry.slots[(tranche, str(denom))]
+        self.counts[slot] -= count
+        return self.counts[slot]
 
     def get_total_balance(self):
-        total = 0
-        for tranche in self.vouchers.values():
-            for denomination, count in tranche.items():
-                total += int(denomination) * count
-        return total
+        """Dollar value of all vouchers held"""
+        return sum(c * v for c, v in zip(self.counts, voucher_registry.values))
+
+    # Serialisation (same JSON shape as the stored household dicts)
 
     def to_dict(self):
         base = {
@@ -35,44 +143,54 @@ class Household:
             "postal_code": self.postal_code,
             "vouchers": self.vouchers
         }
-        base.update(self.extra_data)
+        if self.extra_data:
+            base.update(self.extra_data)
         return base
-    
+
     @classmethod
     def from_dict(cls, data):
         h = cls(
             household_id = data.get("household_id"),
-            members = data.get("members"),
-            postal_code = data.get("postal_code"),
-            vouchers = data.get("vouchers", {})
+            members = data.get("members", []),
+            postal_code = data.get("postal_code", ""),
+            vouchers = data.get("vouchers") or {}
         )
-        known_keys = {"household_id", "members", "postal_code", "vouchers"}
         for k, v in data.items():
-            if k not in known_keys:
-                h.extra_data[k] = v
+            if k not in cls.FIELDS:
+                h[k] = v
         return h
 
-    
+    # Dict-style access, so code written against household dicts keeps working
+
     def __getitem__(self, key):
-        if hasattr(self, key):
+        if key in self.FIELDS:
             return getattr(self, key)
-        return self.extra_data.get(key)
+        if self.extra_data and key in self.extra_data:
+            return self.extra_data[key]
+        raise KeyError(key)
 
     def __setitem__(self, key, value):
-        if hasattr(self, key):
+        if key in self.FIELDS:
             setattr(self, key, value)
         else:
+            if self.extra_data is None:
+                self.extra_data = {}
             self.extra_data[key] = value
 
     def get(self, key, default=None):
         try:
             return self[key]
-        except (KeyError, AttributeError):
+        except KeyError:
             return default
 
+    def pop(self, key, default=None):
+        if self.extra_data and key in self.extra_data:
+            return self.extra_data.pop(key)
+        return default
+
     def update(self, other_dict):
         for k, v in other_dict.items():
             self[k] = v
-    
+
     def __contains__(self, key):
-        return hasattr(self, key) or key in self.extra_data
\ No newline at end of file
+        return key in self.FIELDS or bool(self.extra_data and key in self.extra_data)
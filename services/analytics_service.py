@@ -0,0 +1,203 @@
+"""
+Merchant Analytics Service
+Running per-merchant aggregates, updated as redemptions are logged
+
+The redemption history (archive and Redeem files) is read once at
+startup; after that every redemption is folded into the aggregates as it
+is written, so the analytics endpoint never re-reads the redemption
+history. With the SQLite backend, rows are
+instead picked up by row id when analytics are read, so redemptions made
+by other worker processes are counted too.
+"""
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+from services.redemption_log import redemption_log, parse_redemption_row
+from services.redemption_archive import read_redemption_batches
+from services.storage_backend import get_backend
+
+# Bounded history kept per merchant
+RECENT_LIMIT = 10
+HOURLY_WINDOW_HOURS = 48
+DAILY_WINDOW_DAYS = 31
+
+db = get_backend()
+
+# merchant_id -> MerchantAnalytics
+merchant_analytics = {}
+
+# Held while a batch is written to the redemption log and folded into the
+# aggregates, so the startup load never double counts or misses a batch
+analytics_lock = threading.Lock()
+_loaded = False
+
+# SQLite: highest redemptions row id folded into the aggregates
+_last_redemption_id = 0
+
+class MerchantAnalytics:
+    """Running totals for one merchant"""
+
+    def __init__(self, merchant_id):
+        self.merchant_id = merchant_id
+        self.total_transactions = 0
+        self.total_cents = 0
+        self.daily = {}       # "YYYY-MM-DD" -> [transactions, cents]
+        self.hourly = {}      # "YYYY-MM-DD HH:00" -> [transactions, cents]
+        self.amounts = {}     # transaction total in dollars -> transactions
+        self.recent = deque(maxlen=RECENT_LIMIT)
+
+    def add(self, txn):
+        """Fold one transaction (see _group_transactions) into the totals"""
+        cents = txn["total_cents"]
+        self.total_transactions += 1
+        self.total_cents += cents
+
+        amount = cents // 100 if cents % 100 == 0 else cents / 100
+        self.amounts[amount] = self.amounts.get(amount, 0) + 1
+
+        ts = txn["timestamp"]
+        if ts is not None:
+            self._bump(self.daily, ts.strftime("%Y-%m-%d"), cents, DAILY_WINDOW_DAYS)
+            self._bump(self.hourly, ts.strftime("%Y-%m-%d %H:00"), cents, HOURLY_WINDOW_HOURS)
+
+        self.recent.append({
+            "transaction_id": txn["transaction_id"],
+            "household_id": txn["household_id"],
+            "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S") if ts else "",
+            "time": ts.strftime("%H:%M:%S") if ts else "",
+            "token": txn["voucher_code"],
+            "voucher_details": txn["voucher_details"],
+            "amount": amount
+        })
+
+    @staticmethod
+    def _bump(buckets, key, cents, keep):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [0, 0]
+            # Keys sort chronologically; drop the oldest once over the window
+            if len(buckets) > keep:
+                for old_key in sorted(buckets)[:len(buckets) - keep]:
+                    del buckets[old_key]
+        bucket[0] += 1
+        bucket[1] += cents
+
+    def to_dict(self, now=None):
+        now = now or datetime.now()
+        today_key = now.strftime("%Y-%m-%d")
+        today_count, today_cents = self.daily.get(today_key, (0, 0))
+
+        # Last 24 hours, oldest first, including empty hours
+        hourly = []
+        for offset in range(23, -1, -1):
+            key = (now - timedelta(hours=offset)).strftime("%Y-%m-%d %H:00")
+            count, cents = self.hourly.get(key, (0, 0))
+            hourly.append({"hour": key, "transactions": count, "revenue": cents / 100})
+
+        return {
+            "merchant_id": self.merchant_id,
+            "total_transactions": self.total_transactions,
+            "total_revenue": self.total_cents / 100,
+            "average_transaction": round(self.total_cents / 100 / self.total_transactions, 2)
+                if self.total_transactions else 0,
+            "today": {"date": today_key, "transactions": today_count, "revenue": today_cents / 100},
+            "hourly": hourly,
+            "amount_breakdown": [
+                {"amount": amount, "transactions": count}
+                for amount, count in sorted(self.amounts.items(), reverse=True)
+            ],
+            "recent_transactions": list(reversed(self.recent))
+        }
+
+def _group_transactions(records):
+    """
+    Collapse normalized redemption records into one entry per transaction
+
+    Token redemptions log a row per voucher under the same transaction ID.
+    $0 transactions are skipped.
+    """
+    transactions = {}
+    for record in records:
+        key = (record["transaction_id"], record["household_id"], record["merchant_id"])
+        txn = transactions.get(key)
+        if txn is None:
+            txn = transactions[key] = dict(record, voucher_details=record["denomination_used"])
+        elif not record["denomination_used"].startswith("$"):
+            # Direct redemptions carry their own value on each row
+            txn["total_cents"] += record["total_cents"]
+    return [txn for txn in transactions.values() if txn["total_cents"] > 0]
+
+def _parse_rows(rows):
+    return [record for record in map(parse_redemption_row, rows) if record is not None]
+
+def _add_transactions(transactions):
+    for txn in transactions:
+        stats = merchant_analytics.get(txn["merchant_id"])
+        if stats is None:
+            stats = merchant_analytics[txn["merchant_id"]] = MerchantAnalytics(txn["merchant_id"])
+        stats.add(txn)
+
+def load_analytics():
+    """Build the aggregates from the redemption history (once per process)"""
+    global _loaded, _last_redemption_id
+    with analytics_lock:
+        if _loaded:
+            return
+        # Everything queued before this point must be on disk to be counted
+        redemption_log.flush()
+
+        transactions = []
+        if db is not None:
+            rows, _last_redemption_id = db.get_redemptions_since(0)
+            transactions = _group_transactions(_parse_rows(rows))
+        else:
+            # Transaction IDs are only unique within an hourly file
+            for _, records in read_redemption_batches():
+                transactions.extend(_group_transactions(records))
+
+        transactions.sort(key=lambda t: t["timestamp"] or datetime.min)
+        merchant_analytics.clear()
+        _add_transactions(transactions)
+        _loaded = True
+
+    print(f"📊 Loaded analytics for {len(merchant_analytics)} merchants "
+          f"from {len(transactions)} transactions")
+
+def log_redemption_rows(rows, now=None):
+    """
+    Write redemption rows to the log and add them to the aggregates
+
+    Args:
+        rows: Lists in REDEMPTION_COLUMNS order
+        now: Time used to pick the hourly Redeem file (defaults to now)
+    """
+    with analytics_lock:
+        redemption_log.write(rows, now)
+        # SQLite rows are counted by _refresh_from_db() once written
+        if _loaded and db is None:
+            _add_transactions(_group_transactions(_parse_rows(rows)))
+
+def _refresh_from_db():
+    """Fold in redemption rows written since the last refresh, by any worker"""
+    global _last_redemption_id
+    redemption_log.flush()
+    with analytics_lock:
+        # A transaction's rows are inserted together, so a batch never splits one
+        rows, _last_redemption_id = db.get_redemptions_since(_last_redemption_id)
+        _add_transactions(_group_transactions(_parse_rows(rows)))
+
+def get_merchant_analytics(merchant_id):
+    """
+    Get the dashboard figures for a merchant
+
+    Returns:
+        Dict of totals, today's sales, last 24 hourly buckets, amount
+        breakdown and recent transactions (zeros if nothing redeemed yet)
+    """
+    load_analytics()
+    if db is not None:
+        _refresh_from_db()
+    with analytics_lock:
+        stats = merchant_analytics.get(merchant_id) or MerchantAnalytics(merchant_id)
+        return stats.to_dict()
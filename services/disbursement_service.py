@@ -0,0 +1,254 @@
+"""
+Disbursement Service
+Credit a voucher tranche to every household in one background job
+
+Households are processed in household ID order, a chunk at a time. Each
+chunk is credited under its households' locks and persisted with a single
+journal write, then a checkpoint in storage/disbursements/<tranche>.json
+records the last household done. A restarted API resumes unfinished jobs
+from their checkpoint, and households that already hold the tranche are
+skipped, so running a disbursement twice never credits anyone twice. A
+lock file next to the checkpoint keeps a tranche's job to one process when
+several API workers share the storage.
+
+    python -m services.disbursement_service Jan2026
+
+The command line refuses to run while the API is up: its copy of the
+households would overwrite changes the API makes meanwhile. Use
+POST /api/disbursements then.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from services.household_service import (
+    households,
+    household_locks,
+    load_households,
+    record_changes,
+    compact_households_if_needed,
+    STORAGE_DIR
+)
+from services.voucher_service import schemes
+from services.response_cache import response_cache
+from services.storage_backend import get_backend, API_LEADER_LOCK
+from utils.file_utils import atomic_open, try_lock_file
+
+DISBURSEMENTS_DIR = os.path.join(STORAGE_DIR, "disbursements")
+
+# Households credited per journal write, and the pause between chunks that
+# lets redemptions waiting on those households' locks go first
+DISBURSEMENT_CHUNK_SIZE = 500
+CHUNK_PAUSE = 0.01
+
+# With SQLite each credit transaction holds the database's write lock, which
+# every worker's redemptions wait on, so a chunk is credited this many
+# households per transaction
+SHARED_CREDIT_BATCH = 50
+
+db = get_backend()
+
+# tranche -> DisbursementJob
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class DisbursementJob:
+    """Resumable, idempotent credit of one tranche to all households"""
+
+    def __init__(self, tranche, chunk_size=DISBURSEMENT_CHUNK_SIZE, directory=DISBURSEMENTS_DIR):
+        self.tranche = tranche
+        self.chunk_size = chunk_size
+        self.credit_batch = min(chunk_size, SHARED_CREDIT_BATCH) if db is not None else chunk_size
+        self.checkpoint_path = os.path.join(directory, f"{os.path.basename(tranche)}.json")
+        self.progress = self._load_checkpoint()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._process_lock = None
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"tranche": self.tranche, "status": "new"}
+
+    def _save_checkpoint(self):
+        self.progress["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with atomic_open(self.checkpoint_path, "w") as f:
+            json.dump(self.progress, f, indent=2)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Run in a background thread, resuming if the checkpoint is unfinished
+
+        Returns:
+            False if the job was already running (here or in another process)
+        """
+        with self._start_lock:
+            if self.running:
+                return False
+            self._process_lock = try_lock_file(self.checkpoint_path + ".lock")
+            # Another worker may be running or have finished the job
+            self.progress = self._load_checkpoint()
+            if self._process_lock is None:
+                return False
+            if self.progress.get("status") != "running":
+                load_households()
+                # New run (a re-run only credits households added since the last one)
+                self.progress = {
+                    "tranche": self.tranche,
+                    "status": "running",
+                    "total": len(households),
+                    "processed": 0,
+                    "credited": 0,
+                    "skipped": 0,
+                    "last_household_id": None,
+                    "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                self._save_checkpoint()
+            self._thread = threading.Thread(
+                target=self.run, name=f"disbursement-{self.tranche}", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def run(self):
+        try:
+            # Includes households registered through other workers
+            load_households()
+            last = self.progress.get("last_household_id")
+            pending = sorted(hid for hid in list(households) if last is None or hid > last)
+            self.progress["total"] = self.progress["processed"] + len(pending)
+            self._process(pending)
+
+            # Households registered while the job ran may sort before the checkpoint
+            load_households()
+            late = sorted(
+                hid for hid, h in list(households.items())
+                if not h.has_tranche(self.tranche)
+            )
+            self.progress["total"] += len(late)
+            self._process(late)
+
+            self.progress["status"] = "completed"
+            self.progress["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._save_checkpoint()
+            compact_households_if_needed()
+            print(f"✅ Disbursed {self.tranche} to {self.progress['credited']} households "
+                  f"({self.progress['skipped']} already had it)")
+        except Exception as e:
+            # Left as "running" so the next start resumes from the checkpoint
+            self.progress["error"] = str(e)
+            print(f"❌ Disbursement of {self.tranche} stopped: {e}")
+        finally:
+            os.close(self._process_lock)
+            self._process_lock = None
+
+    def _process(self, household_ids):
+        for i in range(0, len(household_ids), self.chunk_size):
+            chunk = household_ids[i:i + self.chunk_size]
+            credited = sum(
+                self._credit_chunk(chunk[j:j + self.credit_batch])
+                for j in range(0, len(chunk), self.credit_batch)
+            )
+
+            self.progress["processed"] += len(chunk)
+            self.progress["credited"] += credited
+            self.progress["skipped"] += len(chunk) - credited
+            if chunk[-1] > (self.progress["last_household_id"] or ""):
+                self.progress["last_household_id"] = chunk[-1]
+            self._save_checkpoint()
+            time.sleep(CHUNK_PAUSE)
+
+    def _credit_chunk(self, chunk):
+        """Credit households under their locks (one write, one transaction)"""
+        vouchers = schemes[self.tranche]
+        with household_locks(chunk):
+            changes = []
+            for hid in chunk:
+                household = households.get(hid)
+                if household is None or household.has_tranche(self.tranche):
+                    continue
+                household.set_tranche(self.tranche, vouchers)
+                changes.append(("claim", hid, {"tranche": self.tranche, "vouchers": vouchers.copy()}))
+
+            # Written before the locks are released so a later deduction
+            # can never be journalled ahead of the credit it depends on
+            if not record_changes(changes, compact=False, sync=True):
+                for _, hid, _ in changes:
+                    households[hid].remove_tranche(self.tranche)
+                raise RuntimeError("could not persist credited households")
+        for _, hid, _ in changes:
+            response_cache.invalidate("balance", hid)
+        return len(changes)
+
+    def status(self):
+        if not self.running:
+            # The job may be running, or have run, in another worker
+            self.progress = self._load_checkpoint()
+        progress = dict(self.progress)
+        total = progress.get("total") or 0
+        progress["percent"] = round(100 * progress.get("processed", 0) / total, 1) if total else 0
+        return progress
+
+def _get_job(tranche):
+    with _jobs_lock:
+        job = _jobs.get(tranche)
+        if job is None:
+            job = _jobs[tranche] = DisbursementJob(tranche)
+        return job
+
+def start_disbursement(tranche):
+    """
+    Start (or resume) crediting a tranche to all households
+
+    Returns:
+        (progress dict, status code): 202 when started, 200 if already running
+    """
+    if tranche not in schemes:
+        return {"error": "Invalid tranche"}, 400
+
+    job = _get_job(tranche)
+    started = job.start()
+    return job.status(), 202 if started else 200
+
+def get_disbursement_status(tranche):
+    if tranche not in schemes:
+        return {"error": "Invalid tranche"}, 400
+    return _get_job(tranche).status(), 200
+
+def resume_disbursements():
+    """Restart jobs whose checkpoint shows they were interrupted"""
+    if not os.path.exists(DISBURSEMENTS_DIR):
+        return
+    for filename in os.listdir(DISBURSEMENTS_DIR):
+        tranche = filename[:-len(".json")] if filename.endswith(".json") else None
+        if tranche in schemes and _get_job(tranche).progress.get("status") == "running":
+            print(f"🔁 Resuming disbursement of {tranche}")
+            _get_job(tranche).start()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in schemes:
+        print(f"Usage: python -m services.disbursement_service <{'|'.join(schemes)}>")
+        sys.exit(1)
+
+    # Held until exit, so an API started meanwhile does not run the job too
+    api_lock = try_lock_file(API_LEADER_LOCK)
+    if api_lock is None:
+        print("❌ The API is running. Stop it first, or start the disbursement with "
+              "POST /api/disbursements")
+        sys.exit(1)
+
+    job = _get_job(sys.argv[1])
+    job.start()
+    while job.running:
+        time.sleep(1)
+        progress = job.status()
+        print(f"⏳ {progress['processed']}/{progress['total']} households ({progress['percent']}%)")
@@ -0,0 +1,114 @@
+"""
+In-process publish/subscribe for pushing events to connected clients
+
+Subscribers are thread queues (Flask handlers) or asyncio queues (the
+async handlers in asgi_app.py); publishers can be on any thread.
+"""
+import asyncio
+import queue
+import threading
+
+# Events buffered per subscriber before new ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class AsyncSubscription:
+    """Subscriber queue owned by an event loop, fed from publishing threads"""
+
+    def __init__(self, loop, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=maxsize)
+
+    def put_nowait(self, event):
+        # Same contract as queue.Queue.put_nowait, callable from any thread
+        if self._queue.full():
+            raise queue.Full
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop already closed
+            raise queue.Full
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout):
+        """
+        Next event
+
+        Raises:
+            asyncio.TimeoutError: If nothing arrives within `timeout` seconds
+        """
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+class EventBus:
+    """Fan-out of events to per-channel subscriber queues"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """
+        Register interest in a channel (e.g. a household ID)
+
+        Returns:
+            Queue that receives every event published to the channel
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return q
+
+    def subscribe_async(self, channel):
+        """
+        Register an asyncio handler's interest in a channel
+
+        Must be called from the event loop that will read the events.
+
+        Returns:
+            AsyncSubscription; pass it to unsubscribe() when done
+        """
+        subscription = AsyncSubscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        """
+        Deliver an event to everyone subscribed to the channel
+
+        Returns:
+            Number of subscribers that received it
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        delivered = 0
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+                delivered += 1
+            except queue.Full:
+                # Slow consumer: it will pick the event up from its inbox later
+                pass
+        return delivered
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._subscribers.get(channel, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+# Shared bus for the API process
+event_bus = EventBus()
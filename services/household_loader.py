@@ -0,0 +1,112 @@
+"""
+Household Loader
+Bulk household registration from CSV or JSON Lines
+
+CSV files need a `members` column (names separated by ";") and a
+`postal_code` column. JSON Lines files hold one object per line with a
+`members` list and a `postal_code`. Rows are read as a stream and
+registered in batches by register_households_bulk().
+
+    python -m services.household_loader households.csv
+
+The command line refuses to run while the API is up: every batch it writes
+makes the API reload all households underneath in-flight requests. Use
+POST /api/households/bulk then.
+"""
+import csv
+import json
+import sys
+
+from services.household_service import register_households_bulk, BULK_BATCH_SIZE
+from services.storage_backend import API_LEADER_LOCK
+from utils.file_utils import try_lock_file
+
+def parse_members(value):
+    """Accept a list of names or a "Tan Ah Kow; Tan Mei Ling" string"""
+    if isinstance(value, list):
+        return value
+    if not value:
+        return []
+    return [m.strip() for m in str(value).split(";") if m.strip()]
+
+def iter_csv_households(lines):
+    """
+    Yield household dicts from CSV lines
+
+    Rows that cannot be read are yielded as {"_error": message} so row
+    numbers in the bulk result still match the input.
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames or "members" not in reader.fieldnames:
+        yield {"_error": "CSV header must include members and postal_code"}
+        return
+    for row in reader:
+        yield {
+            "members": parse_members(row.get("members")),
+            "postal_code": (row.get("postal_code") or "").strip()
+        }
+
+def iter_jsonl_households(lines):
+    """Yield household dicts from JSON Lines, skipping blank lines"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield {"_error": f"Invalid JSON: {e}"}
+            continue
+        if isinstance(data, dict):
+            data["members"] = parse_members(data.get("members"))
+        yield data
+
+def iter_households(lines, fmt):
+    """
+    Args:
+        lines: Iterable of text lines
+        fmt: "csv" or "jsonl"
+    """
+    if fmt == "csv":
+        return iter_csv_households(lines)
+    if fmt == "jsonl":
+        return iter_jsonl_households(lines)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+def load_households_file(path, fmt=None, batch_size=BULK_BATCH_SIZE):
+    """
+    Register every household in a CSV or JSONL file
+
+    Args:
+        path: File to load
+        fmt: "csv" or "jsonl" (defaults to the file extension)
+        batch_size: Households persisted per batch
+
+    Returns:
+        Result of register_households_bulk()
+    """
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return register_households_bulk(iter_households(f, fmt), batch_size)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m services.household_loader <households.csv|households.jsonl>")
+        sys.exit(1)
+
+    # Held until exit, so an API started meanwhile waits for the load
+    api_lock = try_lock_file(API_LEADER_LOCK)
+    if api_lock is None:
+        print("❌ The API is running. Stop it first, or upload the file with "
+              "POST /api/households/bulk")
+        sys.exit(1)
+
+    result = load_households_file(sys.argv[1])
+    print(f"✅ Registered {result['registered']} households in {result['seconds']}s "
+          f"({result['households_per_second']}/s)")
+    if result["errors"]:
+        print(f"❌ {result['failed']} rows rejected:")
+        for error in result["errors"][:20]:
+            print(f"   Row {error['row']}: {error['error']}")
+        if len(result["errors"]) > 20:
+            print(f"   ... and {len(result['errors']) - 20} more")
@@ -1,33 +1,115 @@
+import atexit
 import csv
 import json
 import os
-import random
 import string
+import threading
+import time
+from contextlib import ExitStack, contextmanager
 
-households = {}
+from models.household import Household
+from services.storage_backend import get_backend, STORAGE_DIR
+from services.token_service import token_store
+from services.response_cache import response_cache
+from utils.file_utils import FileCache, atomic_open, locked_file
+from utils.id_generator import generate_household_id, generate_household_ids
 
-# Get the project root directory (parent of services folder)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # This is the services folder
-PROJECT_ROOT = os.path.dirname(BASE_DIR)  # Go up one level to project root
+households = {}
 
-# Storage is at the same level as services
-STORAGE_DIR = os.path.join(PROJECT_ROOT, "storage")
 HOUSEHOLD_FILE_JSON = os.path.join(STORAGE_DIR, "households.json")
 HOUSEHOLD_FILE_CSV = os.path.join(STORAGE_DIR, "households.txt")
+HOUSEHOLD_JOURNAL = os.path.join(STORAGE_DIR, "households.journal")
+# Held across processes while the journal is appended to, replayed or compacted
+HOUSEHOLD_JOURNAL_LOCK = HOUSEHOLD_JOURNAL + ".lock"
+
+# Journal tuning: fsync after this many records or seconds, and fold the
+# journal back into households.json once it grows past JOURNAL_COMPACT_EVERY
+JOURNAL_FSYNC_BATCH = 32
+JOURNAL_FSYNC_INTERVAL = 1.0
+JOURNAL_COMPACT_EVERY = 5000
+
+# Bulk registration: households validated, allocated and persisted together
+BULK_BATCH_SIZE = 1000
+MAX_MEMBERS = 10
 
 print(f"[INIT] Looking for households.json at: {HOUSEHOLD_FILE_JSON}")
 
-def load_households():
-    global households
+# SQLite backend, or None when households live in the JSON files
+db = get_backend()
+
+# Skips re-parsing the household files when they have not changed on disk
+if db is not None:
+    household_cache = FileCache(signature=lambda: db.table_version("households"))
+else:
+    household_cache = FileCache(HOUSEHOLD_FILE_JSON, HOUSEHOLD_FILE_CSV, HOUSEHOLD_JOURNAL)
+
+# Per-household locks: redemptions for different households never contend
+_household_locks = {}
+_household_locks_guard = threading.Lock()
+
+# Highest SQLite change sequence loaded; later rows are read incrementally
+_loaded_seq = 0
+
+# Journal state
+_storage_lock = threading.RLock()
+_journal_file = None
+_journal_pending = 0
+_journal_last_sync = 0.0
+_journal_records = 0
+
+def load_households(force=False):
+    """Load households from disk, unless the cached copy is still current"""
+    # Held while writing too, so our own in-flight writes never look like
+    # an external change
+    with _storage_lock:
+        if not force and household_cache.is_fresh():
+            return
+        if db is not None:
+            _read_household_rows(full=force or _loaded_seq == 0)
+            return
+        _read_households()
+
+def _read_household_rows(full):
+    """
+    Load households from SQLite: everything, or only rows changed since the
+    last load (including rows written by other worker processes)
+    """
+    global _loaded_seq
+    # Marked before reading, so a write landing mid-read triggers another load
+    household_cache.mark_loaded()
+    if full:
+        households.clear()
+        _loaded_seq = 0
+
+    records, _loaded_seq = db.load_households_since(_loaded_seq)
+    for hid, h_data in records.items():
+        # A household being changed under its lock is left to that writer
+        with _thread_lock(hid):
+            households[hid] = Household.from_dict(h_data)
+        response_cache.invalidate("balance", hid)
+
+    if full:
+        response_cache.invalidate_kind("balance")
+        _drop_legacy_tokens()
+        print(f"✅ Loaded {len(households)} households from SQLite")
+
+def _read_households():
+    # No other process can compact (or append) between reading the snapshot
+    # and the journal, so no record is missed or applied to the wrong base
+    with locked_file(HOUSEHOLD_JOURNAL_LOCK):
+        _read_households_locked()
+
+def _read_households_locked():
     households.clear()
+    household_cache.mark_loaded()
 
     if os.path.exists(HOUSEHOLD_FILE_JSON):
         try:
             with open(HOUSEHOLD_FILE_JSON, "r") as f:
                 data = json.load(f)
-                # Load as dictionaries directly
+                # Vouchers are packed into Household arrays as they load
                 for hid, h_data in data.items():
-                    households[hid] = h_data
+                    households[hid] = Household.from_dict(h_data)
             print(f"✅ Loaded {len(households)} households from {HOUSEHOLD_FILE_JSON}")
         except Exception as e:
             print(f"❌ Error loading JSON: {e}")
@@ -44,36 +126,303 @@ def load_households():
                         if hid not in households:
                             members = row[1].split(";")
                             postal = row[2]
-                            households[hid] = {
-                                "household_id": hid,
-                                "members": members,
-                                "postal_code": postal,
-                                "vouchers": {}
-                            }
+                            households[hid] = Household(hid, members, postal)
         except Exception as e:
             print(f"❌ Error loading CSV: {e}")
 
+    replay_journal()
+    _drop_legacy_tokens()
+    response_cache.invalidate_kind("balance")
+
+    if _journal_records >= JOURNAL_COMPACT_EVERY:
+        _compact_locked()
+
+def _apply_change(record):
+    """Apply one journal record to the in-memory households"""
+    op = record.get("op")
+    hid = record.get("hid")
+
+    if op == "register":
+        households[hid] = Household.from_dict(record["household"])
+        return
+
+    household = households.get(hid)
+    if household is None:
+        return
+
+    if op == "claim":
+        household.set_tranche(record["tranche"], record["vouchers"])
+    elif op == "deduct":
+        if household.has_tranche(record["tranche"]):
+            household.set_count(record["tranche"], record["denom"], record["remaining"])
+    # token_set / token_clear records from older journals are ignored:
+    # tokens now live in services/token_service.py
+
+def replay_journal():
+    """Re-apply journalled changes made since the last households.json snapshot"""
+    global _journal_records
+    _journal_records = 0
+
+    if not os.path.exists(HOUSEHOLD_JOURNAL):
+        return
+
+    try:
+        with open(HOUSEHOLD_JOURNAL, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    continue
+                _apply_change(record)
+                _journal_records += 1
+        if _journal_records:
+            print(f"✅ Replayed {_journal_records} journal records")
+    except Exception as e:
+        print(f"❌ Error replaying journal: {e}")
+
+def _sync_journal():
+    global _journal_pending, _journal_last_sync
+    if _journal_file is None:
+        return
+    _journal_file.flush()
+    os.fsync(_journal_file.fileno())
+    _journal_pending = 0
+    _journal_last_sync = time.monotonic()
+
+def record_change(op, household_id, **fields):
+    """
+    Append one household mutation to the journal
+
+    Records hold absolute values (e.g. the remaining count after a deduction)
+    so replaying a record twice is harmless.
+
+    Args:
+        op: register, claim or deduct
+        household_id: Household the change applies to
+        fields: Op-specific values
+    """
+    record_changes([(op, household_id, fields)])
+
+def record_changes(changes, compact=True, sync=False):
+    """
+    Append several household mutations with a single write
+
+    Args:
+        changes: (op, household_id, fields) tuples, as for record_change
+        compact: Fold the journal into households.json if it grew too large
+        sync: fsync the journal before returning
+
+    Returns:
+        True if the changes were written
+    """
+    global _journal_file, _journal_pending, _journal_records
+    if not changes:
+        return True
+    if db is not None:
+        # SQLite writes the household rows transactionally instead. The cache
+        # is not marked loaded: other workers may have written since our last
+        # load, and the next load_households() picks up both by sequence.
+        try:
+            db.upsert_households([households[hid].to_dict() for hid in {hid: None for _, hid, _ in changes}])
+        except Exception as e:
+            print(f"❌ Error writing {len(changes)} household changes: {e}")
+            return False
+        return True
+
+    now = time.time()
+    lines = []
+    for op, household_id, fields in changes:
+        record = {"op": op, "hid": household_id, "ts": now}
+        record.update(fields)
+        lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+
+    with _storage_lock, locked_file(HOUSEHOLD_JOURNAL_LOCK):
+        try:
+            # Records other processes appended since our last load have not
+            # been replayed here; the cache stays stale so the next
+            # load_households() picks them up along with ours
+            current = household_cache.unchanged()
+            if _journal_file is None:
+                os.makedirs(STORAGE_DIR, exist_ok=True)
+                _journal_file = open(HOUSEHOLD_JOURNAL, "a")
+            _journal_file.write("".join(lines))
+            _journal_file.flush()
+            _journal_pending += len(lines)
+            _journal_records += len(lines)
+
+            if (sync or _journal_pending >= JOURNAL_FSYNC_BATCH or
+                    time.monotonic() - _journal_last_sync >= JOURNAL_FSYNC_INTERVAL):
+                _sync_journal()
+            if current:
+                household_cache.mark_loaded()
+        except Exception as e:
+            print(f"❌ Error writing journal: {e}")
+            return False
+
+    if compact:
+        compact_households_if_needed()
+    return True
+
+def compact_households_if_needed():
+    """Compact once the journal has grown past JOURNAL_COMPACT_EVERY records"""
+    if _journal_records >= JOURNAL_COMPACT_EVERY:
+        compact_households()
+
+def compact_households():
+    """Write a full households.json snapshot and truncate the journal"""
+    if db is not None:
+        return
+
+    with _storage_lock, locked_file(HOUSEHOLD_JOURNAL_LOCK):
+        if not household_cache.unchanged():
+            # Another process wrote since our last load, so a snapshot of our
+            # copy would drop its records; load_households() replays them
+            # and compacts then
+            return
+        _compact_locked()
+
+def _compact_locked():
+    """compact_households() body; hold _storage_lock and the journal lock"""
+    global _journal_file, _journal_records
+    if not save_households():
+        # The journal is all that holds changes since the last snapshot
+        return
+
+    if _journal_file is not None:
+        _journal_file.close()
+        _journal_file = None
+    try:
+        open(HOUSEHOLD_JOURNAL, "w").close()
+        _journal_records = 0
+        household_cache.mark_loaded()
+    except Exception as e:
+        print(f"❌ Error truncating journal: {e}")
+
+@atexit.register
+def _close_journal():
+    global _journal_file
+    with _storage_lock:
+        if _journal_file is not None:
+            _sync_journal()
+            _journal_file.close()
+            _journal_file = None
+
+def _thread_lock(household_id):
+    lock = _household_locks.get(household_id)
+    if lock is None:
+        with _household_locks_guard:
+            lock = _household_locks.setdefault(household_id, threading.Lock())
+    return lock
+
+@contextmanager
+def _thread_locks(household_ids):
+    with ExitStack() as stack:
+        for household_id in household_ids:
+            stack.enter_context(_thread_lock(household_id))
+        yield
+
+@contextmanager
+def _shared_household_locks(household_ids):
+    """
+    Lock households across worker processes (SQLite backend)
+
+    Their thread locks come first, so this worker's threads queue per
+    household without holding anything shared. Then SQLite's write lock
+    is taken (BEGIN IMMEDIATE) and the households' latest committed rows
+    replace the in-memory copies. That write lock is shared by every
+    household in every worker, so callers hold these locks only for the
+    reload-modify-write itself; writes made under them commit when the
+    locks are released.
+    """
+    with _thread_locks(household_ids), db.transaction():
+        for household_id, data in db.load_households_by_id(household_ids).items():
+            households[household_id] = Household.from_dict(data)
+        yield
+
+def household_lock(household_id):
+    """Return the lock guarding one household's vouchers"""
+    if db is not None:
+        return _shared_household_locks([household_id])
+    return _thread_lock(household_id)
+
+def household_locks(household_ids):
+    """
+    Return one lock guarding several households' vouchers
+
+    Taken in household ID order, so holders of overlapping sets never
+    deadlock; all thread locks are held before SQLite's write lock.
+    """
+    household_ids = sorted(set(household_ids))
+    if db is not None:
+        return _shared_household_locks(household_ids)
+    return _thread_locks(household_ids)
+
+def _drop_legacy_tokens():
+    """Strip tokens saved inside household records by older versions"""
+    for household in households.values():
+        for key in ("active_token", "token_data", "token_expires_at"):
+            household.pop(key, None)
+
+def deduct_vouchers(household_id, tranche, denom, count):
+    """
+    Deduct vouchers of one denomination from a household tranche
+
+    Callers check the balance (or hold a token reservation) first under the
+    household lock; the deduction itself is not clamped.
+
+    Returns:
+        Remaining count for that denomination
+    """
+    remaining = households[household_id].deduct(tranche, denom, count)
+    record_change("deduct", household_id, tranche=tranche, denom=denom, remaining=remaining)
+    response_cache.invalidate("balance", household_id)
+    return remaining
+
+def deduct_selection(household_id, vouchers):
+    """
+    Deduct a {tranche: {denom: count}} selection with a single write
+
+    Same contract as deduct_vouchers (hold the household lock, balance
+    already checked or reserved).
+    """
+    household = households[household_id]
+    changes = []
+    for tranche, denoms in vouchers.items():
+        for denom, count in denoms.items():
+            remaining = household.deduct(tranche, denom, count)
+            changes.append(("deduct", household_id, {"tranche": tranche, "denom": denom, "remaining": remaining}))
+    record_changes(changes)
+    response_cache.invalidate("balance", household_id)
+
 def save_households():
+    """
+    Write every household (a full households.json snapshot for file storage)
+
+    Returns:
+        True if the households were written
+    """
+    if db is not None:
+        db.upsert_households([h.to_dict() for h in households.values()])
+        household_cache.mark_loaded()
+        print(f"✅ Saved {len(households)} households to SQLite")
+        return True
+
     os.makedirs(STORAGE_DIR, exist_ok=True)
     
     try:
-        with open(HOUSEHOLD_FILE_JSON, "w") as f:
-            json.dump(households, f, indent=2)
+        with atomic_open(HOUSEHOLD_FILE_JSON) as f:
+            json.dump({hid: h.to_dict() for hid, h in households.items()}, f, indent=2)
+        household_cache.mark_loaded()
         print(f"✅ Saved {len(households)} households to {HOUSEHOLD_FILE_JSON}")
+        return True
     except Exception as e:
         print(f"❌ Error saving households: {e}")
+        return False
 
 def register_household(data):
-    # Generate unique household ID with collision check
-    max_attempts = 100
-    for attempt in range(max_attempts):
-        hid = "H" + "".join(str(random.randint(0, 9)) for _ in range(11))
-        if hid not in households:
-            break
-    else:
-        # If we couldn't find a unique ID after max_attempts, use timestamp
-        import time
-        hid = f"H{int(time.time() * 1000) % 100000000000:011d}"
+    # Sequence-based ID, unique across processes (skips legacy random IDs)
+    hid = generate_household_id(households)
     
     print(f"🆔 Generated unique household ID: {hid}")
 
@@ -84,8 +433,8 @@ def register_household(data):
         "vouchers": {}
     }
     
-    households[hid] = new_household
-    save_households()
+    households[hid] = Household.from_dict(new_household)
+    record_change("register", hid, household=new_household)
     
     return {
         "household_id": hid, 
@@ -93,17 +442,123 @@ def register_household(data):
         "claim_link": f"/ui/claim/{hid}"
     }, 200
 
+def validate_household(data):
+    """
+    Check one household record for bulk registration
+
+    Returns:
+        Error message, or None if the record is valid
+    """
+    if not isinstance(data, dict):
+        return "Household must be an object"
+
+    members = data.get("members")
+    if not isinstance(members, list) or not members:
+        return "At least one member is required"
+    if len(members) > MAX_MEMBERS:
+        return f"At most {MAX_MEMBERS} members allowed"
+    if any(not isinstance(m, str) or not m.strip() for m in members):
+        return "Member names must be non-empty"
+
+    postal_code = str(data.get("postal_code") or "").strip()
+    if len(postal_code) != 6 or not postal_code.isdigit():
+        return "Postal code must be exactly 6 digits"
+    if not 10000 <= int(postal_code) <= 829999:
+        return "Invalid Singapore postal code range"
+    return None
+
+def _register_batch(batch, result):
+    """Allocate IDs for a validated batch and persist it with one journal write"""
+    with _storage_lock:
+        ids = generate_household_ids(len(batch), households)
+        changes = []
+        for (row_number, data), hid in zip(batch, ids):
+            new_household = {
+                "household_id": hid,
+                "members": [m.strip() for m in data["members"]],
+                "postal_code": str(data["postal_code"]).strip(),
+                "vouchers": {}
+            }
+            households[hid] = Household.from_dict(new_household)
+            changes.append(("register", hid, {"household": new_household}))
+            result["households"].append({"row": row_number, "household_id": hid})
+        # Bulk loads are compacted once at the end rather than per batch
+        record_changes(changes, compact=False)
+    result["registered"] += len(batch)
+
+def register_households_bulk(rows, batch_size=BULK_BATCH_SIZE):
+    """
+    Register many households, persisting once per batch
+
+    Args:
+        rows: Iterable of household dicts (members, postal_code); may be a
+              stream, it is consumed batch by batch
+        batch_size: Households allocated and written together
+
+    Returns:
+        Dict with registered/failed counts, household IDs and errors by row
+        number (1-based), elapsed seconds and households per second
+    """
+    started = time.perf_counter()
+    result = {"registered": 0, "failed": 0, "households": [], "errors": []}
+
+    batch = []
+    for row_number, data in enumerate(rows, start=1):
+        error = data.get("_error") if isinstance(data, dict) else None
+        error = error or validate_household(data)
+        if error:
+            result["failed"] += 1
+            result["errors"].append({"row": row_number, "error": error})
+            continue
+        batch.append((row_number, data))
+        if len(batch) >= batch_size:
+            _register_batch(batch, result)
+            batch = []
+    if batch:
+        _register_batch(batch, result)
+
+    compact_households_if_needed()
+
+    elapsed = time.perf_counter() - started
+    result["seconds"] = round(elapsed, 3)
+    result["households_per_second"] = round(result["registered"] / elapsed, 1) if elapsed > 0 else 0
+    print(f"🆔 Bulk registered {result['registered']} households "
+          f"({result['failed']} rejected) in {result['seconds']}s")
+    return result
+
 def get_redemption_balance(household_id):
+    # Picks up changes made by other API workers
+    load_households()
     if household_id not in households:
         return {"error": "Household not found"}, 404
     
     household = households[household_id]
+    reserved = token_store.reserved(household_id)
     
-    # Return the vouchers structure
+    # Vouchers held by live tokens are shown separately, not as spendable
     return {
         "household_id": household_id,
-        "vouchers": household.get("vouchers", {})
+        "vouchers": household.vouchers_less(reserved),
+        "reserved": reserved
     }, 200
 
+def get_cached_balance(household_id):
+    """
+    get_redemption_balance() through the response cache
+
+    Returns:
+        CachedResponse; it expires with the household's earliest token,
+        whose reservation is part of the balance
+    """
+    # Picks up (and invalidates) other workers' changes before the lookup
+    load_households()
+
+    def build():
+        response, status = get_redemption_balance(household_id)
+        expiries = [entry["expires_at"] for entry in token_store.tokens_for(household_id)]
+        return response, status, min(expiries, default=None)
+
+    return response_cache.fetch(("balance", household_id), build)
+
 # Initialize on import
 load_households()
\ No newline at end of file
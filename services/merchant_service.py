@@ -1,14 +1,14 @@
 import csv
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
 
-# Get the project root directory (parent of services folder)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # This is the services folder
-PROJECT_ROOT = os.path.dirname(BASE_DIR)  # Go up one level to project root
+from services.storage_backend import get_backend, STORAGE_DIR
+from services.response_cache import response_cache
+from utils.file_utils import FileCache, atomic_open
 
-# Storage is at the same level as services
-STORAGE_DIR = os.path.join(PROJECT_ROOT, "storage")
 MERCHANT_FILE_TXT = os.path.join(STORAGE_DIR, "merchants.txt")
 MERCHANT_FILE_JSON = os.path.join(STORAGE_DIR, "merchants.json")
 
@@ -16,11 +16,31 @@ print(f"[INIT] Looking for merchants at: {STORAGE_DIR}")
 
 # Merchants dictionary
 merchants = {}
+_merchants_lock = threading.Lock()
 
-def load_merchants():
-    """Load merchants from text or JSON file"""
+# SQLite backend, or None when merchants live in the JSON/TXT files
+db = get_backend()
+
+# Skips re-parsing the merchant files when they have not changed on disk
+if db is not None:
+    merchant_cache = FileCache(signature=lambda: db.table_version("merchants"))
+else:
+    merchant_cache = FileCache(MERCHANT_FILE_JSON, MERCHANT_FILE_TXT)
+
+def load_merchants(force=False):
+    """Load merchants from text or JSON file, unless the cached copy is still current"""
     global merchants
+    if not force and merchant_cache.is_fresh():
+        return
+
     merchants.clear()
+    merchant_cache.mark_loaded()
+    response_cache.invalidate_kind("merchant")
+
+    if db is not None:
+        merchants.update(db.load_merchants())
+        print(f"✅ Loaded {len(merchants)} merchants from SQLite")
+        return
     
     # Try JSON first
     if os.path.exists(MERCHANT_FILE_JSON):
@@ -59,11 +79,18 @@ def load_merchants():
 
 def save_merchants():
     """Save merchants to both JSON and TXT"""
+    if db is not None:
+        # Not marked loaded: other workers may have written merchants
+        # this one has not read yet
+        db.upsert_merchants(merchants)
+        print(f"✅ Saved {len(merchants)} merchants to SQLite")
+        return
+
     os.makedirs(STORAGE_DIR, exist_ok=True)
     
     # Save as JSON
     try:
-        with open(MERCHANT_FILE_JSON, "w") as f:
+        with atomic_open(MERCHANT_FILE_JSON) as f:
             json.dump(merchants, f, indent=2)
         print(f"✅ Saved {len(merchants)} merchants to JSON")
     except Exception as e:
@@ -71,7 +98,7 @@ def save_merchants():
     
     # Save as TXT (CSV format)
     try:
-        with open(MERCHANT_FILE_TXT, "w", newline="") as f:
+        with atomic_open(MERCHANT_FILE_TXT, newline="") as f:
             writer = csv.writer(f)
             for mid, data in merchants.items():
                 writer.writerow([
@@ -90,6 +117,8 @@ def save_merchants():
     except Exception as e:
         print(f"❌ Error saving TXT: {e}")
 
+    merchant_cache.mark_loaded()
+
 def register_merchant(data):
     """Register a new merchant"""
     if not data:
@@ -99,6 +128,12 @@ def register_merchant(data):
     if not mid:
         return {"error": "Merchant ID required"}, 400
     
+    with _merchants_lock:
+        return _register_merchant_locked(mid, data)
+
+def _register_merchant_locked(mid, data):
+    # Pick up merchants registered by other workers before the duplicate check
+    load_merchants()
     if mid in merchants:
         return {"error": "Merchant ID already exists"}, 400
     
@@ -109,13 +144,39 @@ def register_merchant(data):
     if "status" not in data:
         data["status"] = "Active"
     
-    # Save to dictionary
-    merchants[mid] = data
-    
-    # Persist to files
-    save_merchants()
+    # Persist to files (or just this row in SQLite)
+    if db is not None:
+        try:
+            db.insert_merchant(mid, data)
+        except sqlite3.IntegrityError:
+            # Registered by another worker since load_merchants()
+            return {"error": "Merchant ID already exists"}, 400
+        # Not marked loaded, like record_changes() for households: the
+        # next load_merchants() also picks up other workers' merchants
+        merchants[mid] = data
+    else:
+        merchants[mid] = data
+        save_merchants()
+    response_cache.invalidate("merchant", mid)
     
     return {"message": "Merchant registered successfully", "merchant_id": mid}, 201
 
+def get_cached_merchant(merchant_id):
+    """
+    Merchant details through the response cache
+
+    Returns:
+        CachedResponse (404 body if the merchant is unknown)
+    """
+    load_merchants()
+
+    def build():
+        merchant = merchants.get(merchant_id)
+        if merchant is None:
+            return {"error": "Merchant not found"}, 404, None
+        return merchant, 200, None
+
+    return response_cache.fetch(("merchant", merchant_id), build)
+
 # Initialize on import
 load_merchants()
\ No newline at end of file
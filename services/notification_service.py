@@ -1,18 +1,132 @@
 """
 Notification Service for Real-time Updates
 Allows merchant app to send notifications to household app
+
+Notification files and <household_id>_transactions.json histories from
+older versions are converted once, with the API stopped:
+
+    python -m services.notification_service migrate
 """
 import json
 import os
+import struct
+import sys
+import threading
 import time
+import uuid
 from datetime import datetime
 
+from services.event_bus import event_bus
+from services.storage_backend import get_backend, API_LEADER_LOCK, STORAGE_DIR
+from utils.file_utils import atomic_open, try_lock_file
+
 # Create directories
-NOTIFICATIONS_DIR = "storage/notifications"
-TRANSACTIONS_DIR = "storage/transactions"
+NOTIFICATIONS_DIR = os.path.join(STORAGE_DIR, "notifications")
+INBOX_DIR = os.path.join(NOTIFICATIONS_DIR, "inbox")
+TRANSACTIONS_DIR = os.path.join(STORAGE_DIR, "transactions")
+# Old one-file-per-event files are moved here once converted
+MIGRATED_DIR_NAME = "migrated"
 os.makedirs(NOTIFICATIONS_DIR, exist_ok=True)
+os.makedirs(INBOX_DIR, exist_ok=True)
 os.makedirs(TRANSACTIONS_DIR, exist_ok=True)
 
+# SQLite backend, or None when notifications and history live in JSON files
+db = get_backend()
+
+# Transaction history: <household_id>.log holds one JSON record per line and
+# <household_id>.idx the byte offset of each record, so reads seek to the tail
+INDEX_ENTRY = struct.Struct("<Q")
+_history_lock = threading.Lock()
+# Households whose index has been checked against their log this process
+_checked_indexes = set()
+
+# Records kept per household (0 keeps everything); trimmed in the background
+TRANSACTION_RETENTION = int(os.environ.get("CDC_TRANSACTION_RETENTION", "0"))
+HISTORY_COMPACT_INTERVAL = 300
+_over_retention = set()
+_compactor_thread = None
+
+# Unread notifications per household: household_id -> {notification_id: notification}
+# Loaded from storage/notifications/inbox/<household_id>.json on first use
+_inboxes = {}
+_inbox_lock = threading.Lock()
+
+def _history_paths(household_id):
+    name = os.path.basename(household_id)
+    return (os.path.join(TRANSACTIONS_DIR, f"{name}.log"),
+            os.path.join(TRANSACTIONS_DIR, f"{name}.idx"))
+
+def _index_matches_log(log_path, idx_path):
+    """
+    True if the index's last offset starts the log's last record
+
+    The log and index are replaced separately by compaction (and appended
+    separately), so a crash in between can leave an index that belongs to
+    another version of the log, or misses the last records.
+    """
+    try:
+        log_size = os.path.getsize(log_path)
+    except OSError:
+        log_size = 0
+    try:
+        idx_size = os.path.getsize(idx_path)
+    except OSError:
+        idx_size = 0
+    if idx_size % INDEX_ENTRY.size:
+        return False
+    if not idx_size or not log_size:
+        return idx_size == log_size == 0
+
+    with open(idx_path, "rb") as idx:
+        idx.seek(idx_size - INDEX_ENTRY.size)
+        last = INDEX_ENTRY.unpack(idx.read(INDEX_ENTRY.size))[0]
+    if last >= log_size:
+        return False
+    with open(log_path, "rb") as log:
+        if last > 0:
+            log.seek(last - 1)
+            if log.read(1) != b"\n":
+                return False
+        else:
+            log.seek(0)
+        log.readline()
+        return log.tell() == log_size
+
+def _rebuild_index(log_path, idx_path):
+    """Rewrite a household's index from the line starts in its log"""
+    offset = 0
+    count = 0
+    with open(log_path, "rb") as log, atomic_open(idx_path, "wb") as idx:
+        for line in log:
+            idx.write(INDEX_ENTRY.pack(offset))
+            offset += len(line)
+            count += 1
+    print(f"🔧 Rebuilt transaction index {os.path.basename(idx_path)} ({count} records)")
+
+def _check_index(household_id):
+    """Rebuild the household's index if it does not match its log (hold _history_lock)"""
+    if household_id in _checked_indexes:
+        return
+    log_path, idx_path = _history_paths(household_id)
+    if not _index_matches_log(log_path, idx_path):
+        if os.path.exists(log_path):
+            _rebuild_index(log_path, idx_path)
+        elif os.path.exists(idx_path):
+            os.remove(idx_path)
+    _checked_indexes.add(household_id)
+
+def _append_history(household_id, transactions):
+    """Append records to a household's log and their offsets to its index (hold _history_lock)"""
+    _check_index(household_id)
+    log_path, idx_path = _history_paths(household_id)
+    with open(log_path, "ab") as log, open(idx_path, "ab") as idx:
+        log.seek(0, os.SEEK_END)
+        for transaction in transactions:
+            offset = log.tell()
+            log.write(json.dumps(transaction, separators=(",", ":")).encode("utf-8") + b"\n")
+            idx.write(INDEX_ENTRY.pack(offset))
+        return idx.tell() // INDEX_ENTRY.size
+
 def log_transaction(household_id, amount, vouchers, merchant_name="Merchant"):
     """
     Log a transaction to the household's transaction history
@@ -33,28 +147,18 @@ def log_transaction(household_id, amount, vouchers, merchant_name="Merchant"):
         "type": "redemption"
     }
     
-    # Load existing transactions
-    transactions_file = os.path.join(TRANSACTIONS_DIR, f"{household_id}_transactions.json")
-    transactions = []
-    
-    if os.path.exists(transactions_file):
-        try:
-            with open(transactions_file, 'r') as f:
-                transactions = json.load(f)
-        except Exception as e:
-            print(f"Error loading transactions: {e}")
-            transactions = []
-    
-    # Add new transaction at the beginning (most recent first)
-    transactions.insert(0, transaction)
-    
-    # Keep only last 50 transactions
-    transactions = transactions[:50]
-    
-    # Save
     try:
-        with open(transactions_file, 'w') as f:
-            json.dump(transactions, f, indent=2)
+        if db is not None:
+            db.log_transaction(transaction)
+            count = None
+        else:
+            # Append-only: one line in the log plus one offset in the index
+            with _history_lock:
+                count = _append_history(household_id, [transaction])
+
+        # Trimming is left to the background compactor
+        if TRANSACTION_RETENTION and (count is None or count > TRANSACTION_RETENTION):
+            _over_retention.add(household_id)
         print(f"📝 Transaction logged for {household_id}")
     except Exception as e:
         print(f"Error saving transaction: {e}")
@@ -63,26 +167,141 @@ def get_transaction_history(household_id, limit=10):
     """
     Get transaction history for a household
     
+    Only the last `limit` records are read, located through the offset index.
+    
     Args:
         household_id: Household ID
-        limit: Number of transactions to return
+        limit: Number of transactions to return (None for all)
         
     Returns:
-        List of transaction objects
+        List of transaction objects (most recent first)
     """
-    transactions_file = os.path.join(TRANSACTIONS_DIR, f"{household_id}_transactions.json")
-    
-    if not os.path.exists(transactions_file):
+    if db is not None:
+        return db.get_transactions(household_id, -1 if limit is None else limit)
+
+    if limit is not None and limit <= 0:
         return []
-    
+
+    with _history_lock:
+        return _read_history(household_id, limit)
+
+def _read_history(household_id, limit):
+    """Read the last `limit` records, newest first (hold _history_lock)"""
+    log_path, idx_path = _history_paths(household_id)
+    if not os.path.exists(log_path):
+        return []
+
     try:
-        with open(transactions_file, 'r') as f:
-            transactions = json.load(f)
-        return transactions[:limit]
+        _check_index(household_id)
+        with open(idx_path, "rb") as idx:
+            count = os.fstat(idx.fileno()).st_size // INDEX_ENTRY.size
+            start = 0 if limit is None else max(0, count - limit)
+            idx.seek(start * INDEX_ENTRY.size)
+            first = idx.read(INDEX_ENTRY.size)
+        offset = INDEX_ENTRY.unpack(first)[0] if len(first) == INDEX_ENTRY.size else 0
+
+        with open(log_path, "rb") as log:
+            log.seek(offset)
+            lines = log.read().splitlines()
+
+        transactions = []
+        for line in lines:
+            try:
+                transactions.append(json.loads(line))
+            except ValueError:
+                continue
+        transactions.reverse()
+        return transactions if limit is None else transactions[:limit]
     except Exception as e:
         print(f"Error loading transactions: {e}")
         return []
 
+def compact_transaction_history(household_id, keep=None):
+    """
+    Trim a household's history to its most recent `keep` records
+    
+    Args:
+        household_id: Household ID
+        keep: Records to keep (defaults to TRANSACTION_RETENTION)
+    """
+    keep = keep or TRANSACTION_RETENTION
+    if not keep:
+        return
+
+    if db is not None:
+        db.trim_transactions(household_id, keep)
+        return
+
+    log_path, idx_path = _history_paths(household_id)
+    with _history_lock:
+        recent = _read_history(household_id, keep)
+        recent.reverse()
+        try:
+            with atomic_open(log_path, "wb") as log, atomic_open(idx_path, "wb") as idx:
+                for transaction in recent:
+                    idx.write(INDEX_ENTRY.pack(log.tell()))
+                    log.write(json.dumps(transaction, separators=(",", ":")).encode("utf-8") + b"\n")
+        finally:
+            # The two files are replaced one after the other; if only one
+            # made it, the next read or append rebuilds the index
+            _checked_indexes.discard(household_id)
+
+def _run_history_compactor(interval):
+    while True:
+        time.sleep(interval)
+        while _over_retention:
+            household_id = _over_retention.pop()
+            try:
+                compact_transaction_history(household_id)
+            except Exception as e:
+                print(f"Error compacting history for {household_id}: {e}")
+
+def start_history_compactor(interval=HISTORY_COMPACT_INTERVAL):
+    """Start the background thread that applies TRANSACTION_RETENTION"""
+    global _compactor_thread
+    if not TRANSACTION_RETENTION or _compactor_thread is not None:
+        return
+    _compactor_thread = threading.Thread(
+        target=_run_history_compactor, args=(interval,), name="history-compactor", daemon=True
+    )
+    _compactor_thread.start()
+
+def _legacy_transaction_files():
+    return [f for f in os.listdir(TRANSACTIONS_DIR) if f.endswith("_transactions.json")]
+
+def _legacy_notification_files():
+    if not os.path.exists(NOTIFICATIONS_DIR):
+        return []
+    return [f for f in os.listdir(NOTIFICATIONS_DIR) if f.endswith(".json")]
+
+def legacy_files_pending():
+    """Number of old-format notification and transaction files not converted yet"""
+    return len(_legacy_notification_files()) + len(_legacy_transaction_files())
+
+def _set_aside(directory, filename):
+    """Move a converted legacy file into <directory>/migrated/"""
+    done_dir = os.path.join(directory, MIGRATED_DIR_NAME)
+    os.makedirs(done_dir, exist_ok=True)
+    os.replace(os.path.join(directory, filename), os.path.join(done_dir, filename))
+
+def migrate_legacy_transactions():
+    """Convert <household_id>_transactions.json lists into append-only logs"""
+    legacy_files = _legacy_transaction_files()
+    for filename in legacy_files:
+        household_id = filename[:-len("_transactions.json")]
+        filepath = os.path.join(TRANSACTIONS_DIR, filename)
+        try:
+            with open(filepath, 'r') as f:
+                transactions = json.load(f)
+            # Legacy files are newest first; the log is oldest first
+            with _history_lock:
+                _append_history(household_id, list(reversed(transactions)))
+            _set_aside(TRANSACTIONS_DIR, filename)
+        except Exception as e:
+            print(f"Error migrating {filename}: {e}")
+    if legacy_files:
+        print(f"📝 Moved {len(legacy_files)} transaction files into append-only logs")
+
 def create_redemption_notification(household_id, amount, vouchers, merchant_name="Merchant"):
     """
     Create a notification for successful redemption AND log the transaction
@@ -107,16 +326,97 @@ def create_redemption_notification(household_id, amount, vouchers, merchant_name
         "read": False
     }
     
-    # Save notification file
-    filename = f"{household_id}_{int(time.time())}.json"
-    filepath = os.path.join(NOTIFICATIONS_DIR, filename)
+    notification_id = new_notification_id(household_id)
+
+    if db is not None:
+        db.add_notification(notification_id, notification)
+    else:
+        with _inbox_lock:
+            inbox = _get_inbox(household_id)
+            inbox[notification_id] = notification
+            _save_inbox(household_id, inbox)
     
-    with open(filepath, 'w') as f:
-        json.dump(notification, f, indent=2)
+    # Push to any household app listening on the notification stream
+    event_bus.publish(household_id, dict(notification, notification_id=notification_id))
     
-    print(f"📬 Created notification: {filename}")
+    print(f"📬 Created notification: {notification_id}")
     return notification
 
+def new_notification_id(household_id):
+    """Unique notification ID, prefixed with the household it belongs to"""
+    return f"{household_id}_{uuid.uuid4().hex[:12]}"
+
+def _household_from_notification_id(notification_id):
+    return notification_id.split("_", 1)[0]
+
+def _inbox_path(household_id):
+    return os.path.join(INBOX_DIR, f"{os.path.basename(household_id)}.json")
+
+def _get_inbox(household_id):
+    """Return a household's unread notifications, oldest first (hold _inbox_lock)"""
+    inbox = _inboxes.get(household_id)
+    if inbox is None:
+        inbox = {}
+        path = _inbox_path(household_id)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    inbox = json.load(f)
+            except Exception as e:
+                print(f"Error reading inbox for {household_id}: {e}")
+        _inboxes[household_id] = inbox
+    return inbox
+
+def _save_inbox(household_id, inbox):
+    """Persist a household's inbox (hold _inbox_lock)"""
+    path = _inbox_path(household_id)
+    try:
+        if inbox:
+            with atomic_open(path) as f:
+                json.dump(inbox, f, indent=2)
+        elif os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        print(f"Error saving inbox for {household_id}: {e}")
+
+def migrate_legacy_notifications():
+    """
+    Move one-file-per-event notifications into the per-household inboxes
+
+    The converted files are moved into storage/notifications/migrated/.
+    """
+    legacy_files = _legacy_notification_files()
+    if not legacy_files:
+        return
+
+    moved = {}
+    for filename in legacy_files:
+        filepath = os.path.join(NOTIFICATIONS_DIR, filename)
+        try:
+            with open(filepath, 'r') as f:
+                notification = json.load(f)
+        except Exception as e:
+            print(f"Error reading notification {filename}: {e}")
+            continue
+        if not notification.get("read", False):
+            notification_id = filename[:-len(".json")]
+            moved.setdefault(notification["household_id"], []).append((notification_id, notification))
+
+    with _inbox_lock:
+        for household_id, items in moved.items():
+            inbox = _get_inbox(household_id)
+            for notification_id, notification in sorted(items, key=lambda x: x[1].get("timestamp", 0)):
+                inbox[notification_id] = notification
+            _save_inbox(household_id, inbox)
+
+    for filename in legacy_files:
+        try:
+            _set_aside(NOTIFICATIONS_DIR, filename)
+        except Exception as e:
+            print(f"Error moving {filename}: {e}")
+
+    print(f"📬 Moved {len(legacy_files)} notification files into household inboxes")
+
 def get_unread_notifications(household_id):
     """
     Get all unread notifications for a household
@@ -125,49 +425,83 @@ def get_unread_notifications(household_id):
         household_id: Household ID to check
         
     Returns:
-        List of notification objects
+        List of notification objects (newest first)
     """
     notifications = []
+
+    if db is not None:
+        unread = db.get_unread_notifications(household_id)
+    else:
+        with _inbox_lock:
+            unread = list(reversed(_get_inbox(household_id).items()))
+
+    for notification_id, notification in unread:
+        notification = dict(notification, notification_id=notification_id)
+        notifications.append({
+            "notification": notification,
+            "notification_id": notification_id
+        })
     
-    if not os.path.exists(NOTIFICATIONS_DIR):
-        return notifications
+    return notifications
+
+def mark_notifications_read(household_id, notification_ids=None):
+    """
+    Mark several notifications as read in one operation
     
-    for filename in os.listdir(NOTIFICATIONS_DIR):
-        if not filename.startswith(household_id):
-            continue
-            
-        filepath = os.path.join(NOTIFICATIONS_DIR, filename)
+    Args:
+        household_id: Household ID
+        notification_ids: IDs to mark, or None for all unread
         
-        try:
-            with open(filepath, 'r') as f:
-                notification = json.load(f)
-            
-            # Only return unread notifications
-            if not notification.get("read", False):
-                notifications.append({
-                    "notification": notification,
-                    "filepath": filepath
-                })
-        except Exception as e:
-            print(f"Error reading notification {filename}: {e}")
-    
-    # Sort by timestamp (newest first)
-    notifications.sort(key=lambda x: x["notification"]["timestamp"], reverse=True)
-    
-    return notifications
+    Returns:
+        Number of notifications marked
+    """
+    if db is not None:
+        return db.mark_notifications_read(household_id, notification_ids)
 
-def mark_notification_as_read(filepath):
+    with _inbox_lock:
+        inbox = _get_inbox(household_id)
+        if notification_ids is None:
+            count = len(inbox)
+            inbox.clear()
+        else:
+            count = sum(1 for nid in notification_ids if inbox.pop(nid, None) is not None)
+        if count:
+            _save_inbox(household_id, inbox)
+    return count
+
+def mark_notification_as_read(notification_id):
     """
     Mark a notification as read and delete it
     
     Args:
-        filepath: Path to notification file
+        notification_id: ID returned with the notification
     """
-    try:
-        os.remove(filepath)
+    if delete_notification(notification_id):
         print(f"✅ Notification marked as read and deleted")
-    except Exception as e:
-        print(f"Error deleting notification: {e}")
+
+def delete_notification(notification_id):
+    """
+    Delete a single notification by ID
+    
+    Args:
+        notification_id: ID returned with the notification
+        
+    Returns:
+        True if a notification was deleted
+    """
+    if notification_id.endswith(".json"):
+        notification_id = notification_id[:-len(".json")]
+
+    if db is not None:
+        return db.delete_notification(notification_id)
+
+    household_id = _household_from_notification_id(notification_id)
+    with _inbox_lock:
+        inbox = _get_inbox(household_id)
+        if inbox.pop(notification_id, None) is None:
+            return False
+        _save_inbox(household_id, inbox)
+    return True
 
 def clear_all_notifications(household_id):
     """
@@ -175,18 +509,33 @@ def clear_all_notifications(household_id):
     
     Args:
         household_id: Household ID
+        
+    Returns:
+        Number of notifications cleared
     """
-    if not os.path.exists(NOTIFICATIONS_DIR):
-        return
-    
-    count = 0
-    for filename in os.listdir(NOTIFICATIONS_DIR):
-        if filename.startswith(household_id):
-            filepath = os.path.join(NOTIFICATIONS_DIR, filename)
-            try:
-                os.remove(filepath)
-                count += 1
-            except Exception as e:
-                print(f"Error deleting {filename}: {e}")
+    if db is not None:
+        count = db.clear_notifications(household_id)
+    else:
+        with _inbox_lock:
+            inbox = _get_inbox(household_id)
+            count = len(inbox)
+            inbox.clear()
+            _save_inbox(household_id, inbox)
     
-    print(f"🗑️ Cleared {count} notifications for {household_id}")
\ No newline at end of file
+    print(f"🗑️ Cleared {count} notifications for {household_id}")
+    return count
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python -m services.notification_service migrate")
+        sys.exit(1)
+
+    # The API keeps inboxes in memory and would overwrite the converted ones
+    api_lock = try_lock_file(API_LEADER_LOCK)
+    if api_lock is None:
+        print("❌ The API is running. Stop it first")
+        sys.exit(1)
+
+    migrate_legacy_notifications()
+    migrate_legacy_transactions()
+    print("✅ No old notification or transaction files left")
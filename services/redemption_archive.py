@@ -0,0 +1,532 @@
+"""
+Redemption Archive
+Typed, columnar copies of closed hourly Redeem files, partitioned by date
+
+A background job converts every Redeem CSV whose hour has passed into a
+segment file under storage/redemption_archive/date=YYYY-MM-DD/ and moves
+the CSV into storage/redemptions/archived/. Segments hold one array per
+column: amounts as integer cents, times as epoch seconds and IDs/text as
+indexes into a per-segment dictionary. Readers only open the partitions
+and segments that can match the requested merchant, household and time
+range, and only decode the requested columns.
+
+    python -m services.redemption_archive compact
+
+Like the API's own compaction job, the command line only runs while the
+API is stopped.
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from services.redemption_log import (
+    REDEMPTIONS_DIR,
+    redemption_log,
+    parse_redemption_row,
+    read_redemption_file
+)
+from services.storage_backend import get_backend, STORAGE_DIR, API_LEADER_LOCK
+from utils.file_utils import atomic_open, try_lock_file
+
+ARCHIVE_DIR = os.path.join(STORAGE_DIR, "redemption_archive")
+# Archived CSVs are kept in this folder of the Redeem directory
+ARCHIVED_CSV_DIR_NAME = "archived"
+
+# Compaction schedule; CSVs touched more recently than the grace period are left alone
+ARCHIVE_COMPACT_INTERVAL = 600
+CLOSE_GRACE_SECONDS = 60
+
+SEGMENT_MAGIC = b"CDCRA1\n"
+HEADER_LENGTH = struct.Struct("<I")
+
+# Columns of a normalized redemption record (see parse_redemption_row)
+DICTIONARY_COLUMNS = [
+    "transaction_id", "household_id", "merchant_id", "voucher_code",
+    "denomination_used", "payment_status", "remarks"
+]
+INTEGER_COLUMNS = [
+    "timestamp", "denomination_cents", "voucher_count", "value_cents", "total_cents"
+]
+COLUMNS = DICTIONARY_COLUMNS + INTEGER_COLUMNS
+
+# 4-byte dictionary codes, 8-byte integers, stored little-endian
+CODE_TYPE = "I" if array("I").itemsize == 4 else "L"
+INT_TYPE = "q"
+
+EPOCH = datetime(1970, 1, 1)
+SOURCE_PATTERN = re.compile(r"^Redeem(\d{4})(\d{2})(\d{2})(\d{2})\.csv$")
+
+db = get_backend()
+
+# Held while a CSV is swapped for its segment, and while both are read
+archive_lock = threading.RLock()
+_compactor_thread = None
+
+def to_epoch(dt):
+    """Seconds since 1970-01-01 for a naive local datetime (as stored in segments)"""
+    return int((dt - EPOCH).total_seconds())
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+def _source_date(filename):
+    """Date of an hourly Redeem file from its name, or None"""
+    match = SOURCE_PATTERN.match(filename)
+    if not match:
+        return None
+    year, month, day, _ = (int(g) for g in match.groups())
+    return datetime(year, month, day)
+
+def _date_in_range(day, start, end):
+    """Partition pruning; one day of slack for rows written late into a file"""
+    if day is None:
+        return True
+    if start is not None and day + timedelta(days=2) <= start:
+        return False
+    if end is not None and day - timedelta(days=1) > end:
+        return False
+    return True
+
+def _record_matches(record, merchant_id, household_id, start, end):
+    if merchant_id is not None and record["merchant_id"] != merchant_id:
+        return False
+    if household_id is not None and record["household_id"] != household_id:
+        return False
+    ts = record["timestamp"]
+    if start is not None and (ts is None or ts < start):
+        return False
+    if end is not None and (ts is None or ts >= end):
+        return False
+    return True
+
+# ==================
+# SEGMENT FILES
+# ==================
+
+def write_segment(path, records, source, source_bytes=0, source_digest=None, source_offset=0):
+    """
+    Write normalized redemption records as one columnar segment
+
+    Args:
+        path: Segment file to create (replaced atomically)
+        records: Dicts as returned by parse_redemption_row
+        source: Name of the CSV the records came from
+        source_bytes: Size of that CSV, to recognise it if it is seen again
+        source_digest: source_digest() of those bytes
+        source_offset: Where in the CSV the records start (earlier rows
+            are in another segment of the same CSV)
+    """
+    blocks = []
+    columns = {}
+    offset = 0
+
+    for name in COLUMNS:
+        if name in DICTIONARY_COLUMNS:
+            values, codes = [], {}
+            data = array(CODE_TYPE)
+            for record in records:
+                value = str(record[name])
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(values)
+                    values.append(value)
+                data.append(code)
+            meta = {"typecode": CODE_TYPE, "values": values}
+        elif name == "timestamp":
+            # 0 marks an unparseable time
+            data = array(INT_TYPE, (to_epoch(r["timestamp"]) if r["timestamp"] else 0 for r in records))
+            meta = {"typecode": INT_TYPE}
+        else:
+            data = array(INT_TYPE, (int(r[name]) for r in records))
+            meta = {"typecode": INT_TYPE}
+
+        if sys.byteorder == "big":
+            data.byteswap()
+        raw = data.tobytes()
+        meta.update(offset=offset, itemsize=data.itemsize)
+        columns[name] = meta
+        blocks.append(raw)
+        offset += len(raw)
+
+    known = [to_epoch(r["timestamp"]) for r in records if r["timestamp"]]
+    header = json.dumps({
+        "source": source,
+        "source_bytes": source_bytes,
+        "source_digest": source_digest,
+        "source_offset": source_offset,
+        "rows": len(records),
+        "min_ts": min(known) if known else None,
+        "max_ts": max(known) if known else None,
+        "columns": columns
+    }).encode("utf-8")
+
+    with atomic_open(path, "wb") as f:
+        f.write(SEGMENT_MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for raw in blocks:
+            f.write(raw)
+
+class ArchiveSegment:
+    """One archived hourly file; columns are read lazily"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"Not a redemption archive segment: {path}")
+            (length,) = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+            self.header = json.loads(f.read(length).decode("utf-8"))
+            self._data_start = f.tell()
+        self.rows = self.header["rows"]
+        self.source = self.header["source"]
+        self._columns = {}
+
+    def dictionary(self, name):
+        """Distinct values of a dictionary-encoded column"""
+        return self.header["columns"][name]["values"]
+
+    def column(self, name):
+        """Raw column array (dictionary codes or integers)"""
+        data = self._columns.get(name)
+        if data is None:
+            meta = self.header["columns"][name]
+            data = array(meta["typecode"])
+            with open(self.path, "rb") as f:
+                f.seek(self._data_start + meta["offset"])
+                data.frombytes(f.read(self.rows * meta["itemsize"]))
+            if sys.byteorder == "big":
+                data.byteswap()
+            self._columns[name] = data
+        return data
+
+    def may_match(self, merchant_id=None, household_id=None, start=None, end=None):
+        """Header-only check whether any row can satisfy the predicates"""
+        if merchant_id is not None and merchant_id not in self.dictionary("merchant_id"):
+            return False
+        if household_id is not None and household_id not in self.dictionary("household_id"):
+            return False
+        min_ts, max_ts = self.header["min_ts"], self.header["max_ts"]
+        if start is not None and (max_ts is None or max_ts < to_epoch(start)):
+            return False
+        if end is not None and (min_ts is None or min_ts >= to_epoch(end)):
+            return False
+        return True
+
+    def matching_rows(self, merchant_id=None, household_id=None, start=None, end=None):
+        """Row numbers satisfying the predicates, compared on codes and integers"""
+        selected = range(self.rows)
+        for name, value in (("merchant_id", merchant_id), ("household_id", household_id)):
+            if value is not None:
+                code = self.dictionary(name).index(value)
+                data = self.column(name)
+                selected = [i for i in selected if data[i] == code]
+        if start is not None or end is not None:
+            low = to_epoch(start) if start is not None else None
+            high = to_epoch(end) if end is not None else None
+            ts = self.column("timestamp")
+            selected = [
+                i for i in selected
+                if ts[i] and (low is None or ts[i] >= low) and (high is None or ts[i] < high)
+            ]
+        return selected
+
+    def read(self, columns=None, merchant_id=None, household_id=None, start=None, end=None):
+        """
+        Decode the requested columns for matching rows
+
+        Returns:
+            Dict of column name -> list of values
+        """
+        columns = columns or COLUMNS
+        if not self.may_match(merchant_id, household_id, start, end):
+            return {name: [] for name in columns}
+
+        selected = self.matching_rows(merchant_id, household_id, start, end)
+        result = {}
+        for name in columns:
+            data = self.column(name)
+            if name in DICTIONARY_COLUMNS:
+                values = self.dictionary(name)
+                result[name] = [values[data[i]] for i in selected]
+            elif name == "timestamp":
+                result[name] = [from_epoch(data[i]) if data[i] else None for i in selected]
+            else:
+                result[name] = [data[i] for i in selected]
+        return result
+
+def source_digest(path, size):
+    """Digest of the first `size` bytes of a CSV"""
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = size
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+def archived_prefix(segments, csv_path, size):
+    """
+    Bytes at the start of a CSV that are already in its archive segments
+
+    A CSV that is kept (or written to again) after archiving only grows,
+    so a segment whose digest matches the CSV's first source_bytes holds
+    that prefix. A CSV re-created under the same name matches none of
+    them and is read in full.
+
+    Args:
+        segments: ArchiveSegments whose source is this CSV
+        csv_path: The CSV
+        size: Its current size
+    """
+    prefix = 0
+    for segment in segments:
+        archived = segment.header.get("source_bytes") or 0
+        if archived <= prefix or archived > size:
+            continue
+        digest = segment.header.get("source_digest")
+        if digest is None:
+            # Segments written before digests were kept: exact size match only
+            if archived != size:
+                continue
+        elif digest != source_digest(csv_path, archived):
+            continue
+        prefix = archived
+    return prefix
+
+# ==================
+# READERS
+# ==================
+
+def iter_segments(merchant_id=None, household_id=None, start=None, end=None, directory=ARCHIVE_DIR):
+    """
+    Yield the archive segments that can contain matching rows
+
+    Partitions outside the time range are skipped without being opened;
+    segments are then pruned on their header (dictionaries and time span).
+    """
+    if not os.path.exists(directory):
+        return
+    for partition in sorted(os.listdir(directory)):
+        if not partition.startswith("date="):
+            continue
+        try:
+            day = datetime.strptime(partition[5:], "%Y-%m-%d")
+        except ValueError:
+            day = None
+        if not _date_in_range(day, start, end):
+            continue
+
+        partition_dir = os.path.join(directory, partition)
+        for filename in sorted(os.listdir(partition_dir)):
+            if not filename.endswith(".cols"):
+                continue
+            try:
+                segment = ArchiveSegment(os.path.join(partition_dir, filename))
+            except (OSError, ValueError) as e:
+                print(f"❌ Error reading archive segment {filename}: {e}")
+                continue
+            if segment.may_match(merchant_id, household_id, start, end):
+                yield segment
+
+def read_archive(columns=None, merchant_id=None, household_id=None, start=None, end=None):
+    """
+    Yield archived redemption records as dicts
+
+    Args:
+        columns: Columns to decode (defaults to all of COLUMNS)
+        merchant_id, household_id: Only rows for this merchant / household
+        start, end: Only rows with start <= timestamp < end (datetimes)
+    """
+    columns = columns or COLUMNS
+    for segment in iter_segments(merchant_id, household_id, start, end):
+        data = segment.read(columns, merchant_id, household_id, start, end)
+        for values in zip(*(data[name] for name in columns)):
+            yield dict(zip(columns, values))
+
+def read_redemption_batches(merchant_id=None, household_id=None, start=None, end=None,
+                            include_archive=True):
+    """
+    Yield (source_file, records) over the archive and the CSVs not yet archived
+
+    Records are normalized dicts (see parse_redemption_row) filtered by the
+    same predicates as read_archive. One batch per original hourly file.
+    With include_archive=False only the CSVs not yet archived are read.
+    """
+    with archive_lock:
+        # Segments that cannot match are pruned here; rows of theirs still
+        # in a CSV are then dropped by the same predicates below
+        archived = {}
+        for segment in iter_segments(merchant_id, household_id, start, end):
+            archived.setdefault(segment.source, []).append(segment)
+            if not include_archive:
+                continue
+            data = segment.read(COLUMNS, merchant_id, household_id, start, end)
+            records = [dict(zip(COLUMNS, values)) for values in zip(*(data[name] for name in COLUMNS))]
+            if records:
+                yield segment.source, records
+
+        redemption_log.flush()
+        directory = redemption_log.directory
+        filenames = sorted(os.listdir(directory)) if os.path.exists(directory) else []
+        for filename in filenames:
+            if not filename.endswith(".csv"):
+                continue
+            if not _date_in_range(_source_date(filename), start, end):
+                continue
+            csv_path = os.path.join(directory, filename)
+            try:
+                # Only the rows after the part already archived
+                offset = 0
+                if filename in archived:
+                    size = os.path.getsize(csv_path)
+                    offset = archived_prefix(archived[filename], csv_path, size)
+                    if offset == size:
+                        continue
+                records = [
+                    record for record in map(parse_redemption_row, read_redemption_file(csv_path, offset))
+                    if record is not None and _record_matches(record, merchant_id, household_id, start, end)
+                ]
+            except OSError as e:
+                print(f"❌ Error reading {filename}: {e}")
+                continue
+            if records:
+                yield filename, records
+
+# ==================
+# COMPACTION
+# ==================
+
+def _segment_path(filename, csv_path, source_bytes, archive_dir):
+    """
+    Next segment path for a CSV, and how much of the CSV is already archived
+
+    A CSV re-created after archiving, or grown since, gets a new suffix.
+
+    Returns:
+        (path, bytes of the CSV already held by earlier segments)
+    """
+    day = _source_date(filename)
+    partition = f"date={day.strftime('%Y-%m-%d')}" if day else "date=unknown"
+    stem = filename[:-len(".csv")]
+
+    segments = []
+    suffix = 0
+    while True:
+        name = f"{stem}.cols" if suffix == 0 else f"{stem}-{suffix}.cols"
+        path = os.path.join(archive_dir, partition, name)
+        if not os.path.exists(path):
+            return path, archived_prefix(segments, csv_path, source_bytes)
+        try:
+            segments.append(ArchiveSegment(path))
+        except (OSError, ValueError):
+            pass
+        suffix += 1
+
+def _set_csv_aside(csv_path, segment_path):
+    """Move an archived CSV into the archived/ folder, named after its segment"""
+    done_dir = os.path.join(os.path.dirname(csv_path), ARCHIVED_CSV_DIR_NAME)
+    os.makedirs(done_dir, exist_ok=True)
+    stem = os.path.basename(segment_path)[:-len(".cols")]
+    target = os.path.join(done_dir, f"{stem}.csv")
+    suffix = 0
+    while os.path.exists(target):
+        suffix += 1
+        target = os.path.join(done_dir, f"{stem}.{suffix}.csv")
+    os.replace(csv_path, target)
+
+def compact_redemption_logs(directory=REDEMPTIONS_DIR, archive_dir=ARCHIVE_DIR, keep_csv=False, now=None):
+    """
+    Convert closed hourly Redeem CSVs into archive segments
+
+    A file is closed once its hour has passed, the writer no longer has it
+    open and it has not been modified for CLOSE_GRACE_SECONDS. Archived
+    CSVs are moved into the archived/ folder unless keep_csv is set.
+
+    Returns:
+        Dict with the number of files and rows archived
+    """
+    if db is not None or not os.path.exists(directory):
+        return {"files": 0, "rows": 0}
+
+    now = now or datetime.now()
+    current_hour = now.strftime("%Y%m%d%H")
+    archived_files = archived_rows = 0
+
+    for filename in sorted(os.listdir(directory)):
+        match = SOURCE_PATTERN.match(filename)
+        if not match or "".join(match.groups()) >= current_hour:
+            continue
+        if redemption_log.stats()["current_file"] == filename:
+            continue
+
+        csv_path = os.path.join(directory, filename)
+        try:
+            st = os.stat(csv_path)
+        except OSError:
+            continue
+        if time.time() - st.st_mtime < CLOSE_GRACE_SECONDS:
+            continue
+
+        with archive_lock:
+            path, offset = _segment_path(filename, csv_path, st.st_size, archive_dir)
+            records = []
+            # offset == size: already archived, only moving the CSV was interrupted
+            if offset < st.st_size:
+                for row in read_redemption_file(csv_path, offset):
+                    record = parse_redemption_row(row)
+                    if record is not None:
+                        records.append(record)
+                write_segment(path, records, filename, st.st_size,
+                              source_digest(csv_path, st.st_size), offset)
+            if not keep_csv:
+                _set_csv_aside(csv_path, path)
+
+        archived_files += 1
+        archived_rows += len(records)
+
+    if archived_files:
+        print(f"🗄️ Archived {archived_rows} redemption rows from {archived_files} files")
+    return {"files": archived_files, "rows": archived_rows}
+
+def _run_archive_compactor(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            compact_redemption_logs()
+        except Exception as e:
+            print(f"❌ Redemption archive compaction failed: {e}")
+
+def start_archive_compactor(interval=ARCHIVE_COMPACT_INTERVAL):
+    """Start the background thread that archives closed Redeem files (file storage only)"""
+    global _compactor_thread
+    if db is not None or _compactor_thread is not None:
+        return
+    _compactor_thread = threading.Thread(
+        target=_run_archive_compactor, args=(interval,), name="archive-compactor", daemon=True
+    )
+    _compactor_thread.start()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("Usage: python -m services.redemption_archive compact [--keep-csv]")
+        sys.exit(1)
+
+    # Held until exit, so an API started meanwhile does not compact too
+    api_lock = try_lock_file(API_LEADER_LOCK)
+    if api_lock is None:
+        print("❌ The API is running and compacts the Redeem files itself. Stop it first")
+        sys.exit(1)
+
+    result = compact_redemption_logs(keep_csv="--keep-csv" in sys.argv)
+    print(f"✅ Archived {result['rows']} rows from {result['files']} files into {ARCHIVE_DIR}")
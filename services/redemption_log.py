@@ -0,0 +1,331 @@
+"""
+Redemption Log Writer
+Batches redemption rows from request threads into the hourly Redeem CSV files
+"""
+import atexit
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from services.storage_backend import get_backend, REDEMPTION_COLUMNS, STORAGE_DIR
+
+REDEMPTIONS_DIR = os.path.join(STORAGE_DIR, "redemptions")
+
+# Flush once this many rows are queued, or after this many seconds
+FLUSH_BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+
+# Rows that fail to write are kept and retried, waiting this long at first
+# and doubling up to RETRY_MAX_INTERVAL while the failures continue
+RETRY_INTERVAL = 0.5
+RETRY_MAX_INTERVAL = 30.0
+
+# Transaction_Date_Time layouts found in the Redeem files
+TIMESTAMP_FORMATS = ("%Y%m%d%H%M%S", "%Y-%m-%d-%H%M%S")
+
+def parse_money_cents(value):
+    """Parse "$2.00", "$6", "10" or 5 into integer cents (0 if unparseable)"""
+    try:
+        return int(round(float(str(value).replace("$", "").replace(",", "").strip()) * 100))
+    except ValueError:
+        return 0
+
+def parse_redemption_time(value):
+    """Parse a Transaction_Date_Time value, or None if it matches no known layout"""
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def parse_redemption_row(row):
+    """
+    Normalize a row from either redemption log layout
+
+    Token redemptions write one row per voucher with "$2.00" style
+    denominations and the transaction total in Amount_Redeemed. Direct
+    voucher redemptions write the tranche, a bare denomination and the
+    number of vouchers used.
+
+    Args:
+        row: List in REDEMPTION_COLUMNS order
+
+    Returns:
+        Dict with transaction_id, household_id, merchant_id, timestamp
+        (datetime or None), voucher_code, denomination_used (as written),
+        payment_status, remarks, denomination_cents, voucher_count,
+        value_cents (this row) and total_cents (whole transaction),
+        or None for headers and short rows
+    """
+    if len(row) < 7 or row[0] == "Transaction_ID":
+        return None
+
+    denomination = str(row[5])
+    denomination_cents = parse_money_cents(denomination)
+    if denomination.startswith("$"):
+        voucher_count = 1
+        value_cents = denomination_cents
+        total_cents = parse_money_cents(row[6])
+    else:
+        try:
+            voucher_count = int(row[6])
+        except ValueError:
+            voucher_count = 0
+        value_cents = total_cents = denomination_cents * voucher_count
+
+    return {
+        "transaction_id": row[0],
+        "household_id": row[1],
+        "merchant_id": row[2],
+        "timestamp": parse_redemption_time(str(row[3])),
+        "voucher_code": row[4],
+        "denomination_used": denomination,
+        "payment_status": row[7] if len(row) > 7 else "",
+        "remarks": row[8] if len(row) > 8 else "",
+        "denomination_cents": denomination_cents,
+        "voucher_count": voucher_count,
+        "value_cents": value_cents,
+        "total_cents": total_cents
+    }
+
+def format_redemption_row(record):
+    """Rebuild a row in REDEMPTION_COLUMNS order from a parse_redemption_row record"""
+    token_layout = record["denomination_used"].startswith("$")
+    ts = record["timestamp"]
+    if ts is None:
+        time_str = ""
+    else:
+        time_str = ts.strftime(TIMESTAMP_FORMATS[1] if token_layout else TIMESTAMP_FORMATS[0])
+    amount = f"${record['total_cents'] / 100:.2f}" if token_layout else str(record["voucher_count"])
+    return [
+        record["transaction_id"], record["household_id"], record["merchant_id"],
+        time_str, record["voucher_code"], record["denomination_used"],
+        amount, record["payment_status"], record["remarks"]
+    ]
+
+def read_redemption_file(path, offset=0):
+    """Yield the rows of one Redeem file, starting at a byte offset (a row start)"""
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        if offset:
+            f.seek(offset)
+        yield from csv.reader(f)
+
+def read_redemption_files(directory=REDEMPTIONS_DIR):
+    """
+    Yield (filename, row) for every row of every Redeem file, oldest file first
+    """
+    if not os.path.exists(directory):
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".csv"):
+            continue
+        try:
+            for row in read_redemption_file(os.path.join(directory, filename)):
+                yield filename, row
+        except OSError as e:
+            print(f"❌ Error reading {filename}: {e}")
+
+class RedemptionLogWriter:
+    """
+    Background writer for the hourly redemption log
+
+    Request threads only enqueue rows. A single writer thread keeps the
+    current hour's file open, writes rows in batches and rolls over to a
+    new Redeem file when the hour changes. Rows whose write fails stay at
+    the front of the queue and are retried with backoff: analytics has
+    already counted them and the vouchers are already deducted, so they
+    must reach the file that settlement pays from.
+    """
+
+    def __init__(self, directory=REDEMPTIONS_DIR, batch_size=FLUSH_BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, backend=None):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backend = backend
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._file_hour = None
+        # (hour, row) pairs taken off the queue but not yet written
+        self._pending = []
+        self._retry_delay = 0
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_writes = 0
+        self.last_error = None
+
+    def write(self, rows, now=None):
+        """
+        Queue redemption rows for the hour they happened in
+
+        Args:
+            rows: Lists in REDEMPTION_COLUMNS order
+            now: Time used to pick the hourly Redeem file (defaults to now)
+        """
+        now = now or datetime.now()
+        self._ensure_started()
+        self._queue.put((now.strftime("%Y%m%d%H"), rows, None))
+
+    def flush(self, timeout=5):
+        """
+        Block until everything queued so far is on disk
+
+        Returns:
+            False if that did not happen within timeout, or straight away
+            while writes are failing and rows are waiting to be retried
+        """
+        if self._thread is None:
+            return True
+        if self._retry_delay:
+            return False
+        done = threading.Event()
+        self._queue.put((None, None, done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Flush pending rows and close the open file"""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_hour = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "pending": len(self._pending),
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "failed_writes": self.failed_writes,
+            "retrying": bool(self._retry_delay),
+            "last_error": self.last_error,
+            "current_file": f"Redeem{self._file_hour}.csv" if self._file_hour else None
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="redemption-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        waiters = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                hour, rows, done = self._queue.get(timeout=timeout)
+                if done is not None:
+                    waiters.append(done)
+                else:
+                    # Behind any rows kept from a failed write
+                    self._pending.extend((hour, row) for row in rows)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            due = deadline is not None and time.monotonic() >= deadline
+            # While retrying, only the backoff deadline triggers a write
+            if due or (not self._retry_delay and (waiters or len(self._pending) >= self.batch_size)):
+                if self._pending:
+                    self._pending = self._write_batch(self._pending)
+                if self._pending:
+                    self._retry_delay = min(max(self._retry_delay * 2, RETRY_INTERVAL), RETRY_MAX_INTERVAL)
+                    deadline = time.monotonic() + self._retry_delay
+                    continue
+                self._retry_delay = 0
+                deadline = None
+                for done in waiters:
+                    done.set()
+                waiters = []
+
+    def _write_batch(self, pending):
+        """
+        Write queued rows, one hour's file (or insert) at a time
+
+        Returns:
+            The (hour, row) pairs that could not be written, in order
+        """
+        by_hour = {}
+        for hour, row in pending:
+            by_hour.setdefault(hour, []).append(row)
+
+        failed = []
+        for hour, rows in by_hour.items():
+            try:
+                if self.backend is not None:
+                    self.backend.append_redemptions(rows, source_file=f"Redeem{hour}.csv")
+                else:
+                    self._write_rows(hour, rows)
+            except Exception as e:
+                self.failed_writes += 1
+                self.last_error = str(e)
+                print(f"❌ Redemption log write failed, keeping {len(rows)} rows "
+                      f"for Redeem{hour}.csv to retry: {e}")
+                failed.extend((hour, row) for row in rows)
+                continue
+            self.rows_written += len(rows)
+
+        if len(failed) < len(pending):
+            self.batches_written += 1
+        return failed
+
+    def _write_rows(self, hour, rows):
+        """Append one hour's rows to its Redeem file, all or none of them"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+
+        f = self._open_hour(hour)
+        start = os.fstat(f.fileno()).st_size
+        try:
+            f.write(buffer.getvalue())
+            f.flush()
+        except Exception:
+            # Cut off any part of the rows that reached the file, so the
+            # retry cannot log them twice
+            self._file = None
+            self._file_hour = None
+            try:
+                f.close()
+            except Exception:
+                pass
+            try:
+                os.truncate(f.name, start)
+            except OSError:
+                pass
+            raise
+
+    def _open_hour(self, hour):
+        """Switch the open file to the given hour, writing a header if it is new"""
+        if hour == self._file_hour and self._file is not None:
+            return self._file
+
+        if self._file is not None:
+            self._file.close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        csv_path = os.path.join(self.directory, f"Redeem{hour}.csv")
+        file_exists = os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
+
+        self._file = open(csv_path, mode="a", newline="", encoding="utf-8")
+        self._file_hour = hour
+        if not file_exists:
+            csv.writer(self._file).writerow(REDEMPTION_COLUMNS)
+            self._file.flush()
+        return self._file
+
+# Shared writer for the API process
+redemption_log = RedemptionLogWriter(backend=get_backend())
+atexit.register(redemption_log.close)
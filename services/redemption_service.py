@@ -1,7 +1,155 @@
-import csv
-import os
 from datetime import datetime
-from services.household_service import households, save_households
+from services.household_service import (
+    households,
+    deduct_vouchers,
+    deduct_selection,
+    household_lock,
+    load_households
+)
+from services.token_service import token_store
+from services.analytics_service import log_redemption_rows
+from utils.id_generator import generate_transaction_id
+
+def write_redemption_rows(rows, now=None):
+    """
+    Queue redemption rows for the hourly redemption log and merchant analytics
+
+    Args:
+        rows: Lists in REDEMPTION_COLUMNS order
+        now: Time used to pick the hourly Redeem file (defaults to now)
+    """
+    log_redemption_rows(rows, now)
+
+def log_token_redemption(household_id, merchant_id, voucher_values, total_amount):
+    """
+    Log a token redemption with one row per voucher used
+
+    Args:
+        household_id: Household that owned the token
+        merchant_id: Redeeming merchant
+        voucher_values: Face value of every voucher used (e.g. [2, 2, 10])
+        total_amount: Total value of the redemption
+
+    Returns:
+        Transaction ID
+    """
+    now = datetime.now()
+    txn_id = generate_transaction_id()
+    txn_time_str = now.strftime("%Y-%m-%d-%H%M%S")
+
+    # Sort for consistency
+    values = sorted(voucher_values)
+    total_items = len(values)
+
+    rows = []
+    for index, denom_val in enumerate(values):
+        remark = "Final denomination used" if index == total_items - 1 else str(index + 1)
+        v_code = f"V{household_id[-4:]}{str(index+1).zfill(3)}"
+        rows.append([
+            txn_id, household_id, merchant_id, txn_time_str,
+            v_code, f"${denom_val}.00", f"${total_amount}.00",
+            "Completed", remark
+        ])
+
+    write_redemption_rows(rows, now)
+    return txn_id
+
+def parse_voucher_selection(vouchers):
+    """
+    Normalize a {tranche: {denom: count}} selection
+
+    Denominations are stored in their canonical form ("05" and " 5" become
+    "5") so they match the household's balance keys.
+
+    Returns:
+        (selection with str denominations and positive int counts, error message or None)
+    """
+    if not isinstance(vouchers, dict) or not all(isinstance(d, dict) for d in vouchers.values()):
+        return None, "vouchers must be {tranche: {denomination: count}}"
+
+    selection = {}
+    for tranche, denoms in vouchers.items():
+        for denom, count in denoms.items():
+            try:
+                count = int(count)
+                value = int(denom)
+            except (TypeError, ValueError):
+                return None, f"Invalid count for {tranche} ${denom}"
+            if count < 0 or value <= 0:
+                return None, f"Invalid count for {tranche} ${denom}"
+            if count:
+                denoms_selected = selection.setdefault(str(tranche), {})
+                # "5" and "05" in one request are the same denomination
+                denoms_selected[str(value)] = denoms_selected.get(str(value), 0) + count
+
+    if not selection:
+        return None, "Please select at least one voucher"
+    return selection, None
+
+def generate_household_token(household_id, vouchers):
+    """
+    Issue a redemption token and reserve the vouchers it covers
+
+    Args:
+        household_id: Household generating the token
+        vouchers: {tranche: {denom: count}} to hold for the merchant
+
+    Returns:
+        (token entry or error dict, status code)
+    """
+    load_households()
+    if household_id not in households:
+        return {"error": "Household not found"}, 404
+
+    selection, error = parse_voucher_selection(vouchers)
+    if error:
+        return {"error": error}, 400
+
+    with household_lock(household_id):
+        try:
+            entry = token_store.issue(
+                household_id, selection, households[household_id].vouchers
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    return entry, 200
+
+def redeem_household_token(token):
+    """
+    Consume a token and deduct its vouchers from the owning household
+
+    The token is taken out of the token store under that household's lock,
+    so two merchants redeeming the same token cannot both succeed. Its
+    vouchers were reserved when it was issued, so the deduction is applied
+    as-is without checking the balance again.
+
+    Args:
+        token: Token shown by the household
+
+    Returns:
+        Dict with household_id, vouchers, total_amount and voucher_values,
+        or None if the token is invalid or already redeemed
+    """
+    entry = token_store.get(token)
+    if entry is None:
+        return None
+    household_id = entry["household_id"]
+
+    with household_lock(household_id):
+        # Only one caller can take the token out of the store
+        entry = token_store.consume(token)
+        household = households.get(household_id)
+        if entry is None or household is None:
+            return None
+        # Commit the reservation: { "Jan2026": { "10": 1 }, "May2025": { "2": 2 } }
+        deduct_selection(household_id, entry["vouchers"])
+
+    return {
+        "household_id": household_id,
+        "vouchers": entry["vouchers"],
+        "total_amount": entry["total"],
+        "voucher_values": entry["voucher_values"]
+    }
 
 def redeem_voucher(household_id, data):
     if not data:
@@ -12,11 +160,17 @@ def redeem_voucher(household_id, data):
         if field not in data:
             return {"error": f"Missing field: {field}"}, 400
 
+    # Number of vouchers to use; zero or negative would add vouchers back
+    amount = data["amount"]
+    if isinstance(amount, str) and amount.strip().isdigit():
+        amount = int(amount)
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        return {"error": "Amount must be a positive whole number"}, 400
+
+    load_households()
     if household_id not in households:
         return {"error": "Household not found"}, 404
 
-    household = households[household_id]
-
     # ✅ Safe extraction + normalization
     voucher_code = data.get("voucher_code")
     denomination_raw = data.get("denomination")
@@ -26,58 +180,61 @@ def redeem_voucher(household_id, data):
 
     tranche = str(voucher_code).strip()
     denomination = str(denomination_raw).strip()
-    amount = int(data["amount"])
-
-    print("DEBUG tranche:", tranche)
-    print("DEBUG available tranches:", household.vouchers.keys())
 
-    # ✅ Validate voucher existence
-    if tranche not in household.vouchers:
-        return {"error": "Voucher tranche not found"}, 400
-    
-    household.vouchers[tranche] = {
-    str(k): v for k, v in household.vouchers[tranche].items()
-}
+    # Only the balance check and deduction run under the lock
+    with household_lock(household_id):
+        error = _check_voucher_balance(household_id, tranche, denomination, amount)
+        if error:
+            return error
 
-    if denomination not in household.vouchers[tranche]:
-        return {"error": "Invalid denomination"}, 400
+        # ✅ Deduct balance (journalled)
+        remaining = deduct_vouchers(household_id, tranche, denomination, amount)
+        remaining_balance = households[household_id].vouchers
 
-    if household.vouchers[tranche][denomination] < amount:
-        return {"error": "Insufficient voucher balance"}, 400
+    # ✅ Generate transaction ID server-side (unique per redemption)
+    transaction_id = generate_transaction_id()
 
-    # ✅ Deduct balance
-    household.vouchers[tranche][denomination] -= amount
-    remaining = household.vouchers[tranche][denomination]
-
-    # ✅ Persist to households.json
-    save_households()
-
-    # ✅ Generate transaction ID server-side
-    transaction_id = f"TX-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-
-    # ✅ CSV logging
-    os.makedirs("storage/redemptions", exist_ok=True)
+    # ✅ Redemption logging
     now = datetime.now()
-    filename = f"storage/redemptions/Redeem{now.strftime('%Y%m%d%H')}.csv"
-
     remark = "Final denomination used" if remaining == 0 else ""
 
-    with open(filename, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            transaction_id,
-            household_id,
-            data["merchant_id"],
-            now.strftime("%Y%m%d%H%M%S"),
-            tranche,
-            denomination,
-            amount,
-            "Completed",
-            remark
-        ])
+    write_redemption_rows([[
+        transaction_id,
+        household_id,
+        data["merchant_id"],
+        now.strftime("%Y%m%d%H%M%S"),
+        tranche,
+        denomination,
+        amount,
+        "Completed",
+        remark
+    ]], now)
 
     return {
         "message": "Redemption successful",
         "transaction_id": transaction_id,
-        "remaining_balance": household.vouchers
+        "remaining_balance": remaining_balance
     }, 200
+
+def _check_voucher_balance(household_id, tranche, denomination, amount):
+    """
+    Check that a household can spend `amount` vouchers (hold its lock)
+
+    Returns:
+        (error dict, status code), or None if the redemption can go ahead
+    """
+    household = households[household_id]
+
+    # ✅ Validate voucher existence
+    if not household.has_tranche(tranche):
+        return {"error": "Voucher tranche not found"}, 400
+
+    balance = household.count(tranche, denomination)
+    if balance is None:
+        return {"error": "Invalid denomination"}, 400
+
+    # Vouchers reserved by the household's live tokens cannot be spent here
+    held = token_store.reserved(household_id).get(tranche, {}).get(denomination, 0)
+    if balance - held < amount:
+        return {"error": "Insufficient voucher balance"}, 400
+    return None
@@ -0,0 +1,131 @@
+"""
+Response Cache
+LRU cache of serialised API responses, keyed by entity
+
+Entries are keyed by (kind, id), e.g. ("balance", household_id) or
+("merchant", merchant_id), and hold the JSON body exactly as served plus a
+strong ETag, so clients can revalidate with If-None-Match and get a 304.
+The services invalidate an entity whenever they change it (claims, token
+issue and redemption, deductions, disbursements, reloads of changed
+rows). An entry can also carry an expiry time, e.g. when a token
+reservation shown in a balance lapses.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Entries kept before the least recently used are evicted
+RESPONSE_CACHE_SIZE = int(os.environ.get("CDC_RESPONSE_CACHE_SIZE", "10000"))
+
+class CachedResponse:
+    """Serialised JSON response with its ETag"""
+
+    __slots__ = ("body", "status", "etag", "expires_at")
+
+    def __init__(self, data, status=200, expires_at=None):
+        # Same form as Flask's jsonify(), so cached and fresh bodies match
+        self.body = json.dumps(data, separators=(",", ":"), sort_keys=True) + "\n"
+        self.status = status
+        self.etag = '"' + hashlib.blake2b(self.body.encode("utf-8"), digest_size=12).hexdigest() + '"'
+        self.expires_at = expires_at
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header value covers this response"""
+        if self.status != 200 or not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*" or candidate.removeprefix("W/") == self.etag:
+                return True
+        return False
+
+class ResponseCache:
+    """Thread-safe LRU of CachedResponse objects with hit-rate counters"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; a response built across one is not stored
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.not_modified = 0
+
+    def fetch(self, key, build):
+        """
+        Cached response for key, building (and caching) it on a miss
+
+        Args:
+            key: (kind, id) tuple
+            build: Function returning (data, status, expires_at or None);
+                only 200 responses are cached
+
+        Returns:
+            CachedResponse
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.expires_at is None or entry.expires_at > time.time()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            epoch = self._epoch
+
+        data, status, expires_at = build()
+        entry = CachedResponse(data, status, expires_at)
+        if status != 200:
+            return entry
+
+        with self._lock:
+            # Skipped if anything changed while the response was being built
+            if self._epoch == epoch:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def invalidate(self, kind, entity_id):
+        """Drop the cached response for one entity"""
+        with self._lock:
+            self._epoch += 1
+            if self._entries.pop((kind, entity_id), None) is not None:
+                self.invalidations += 1
+
+    def invalidate_kind(self, kind):
+        """Drop every cached response of one kind (e.g. after a full reload)"""
+        with self._lock:
+            self._epoch += 1
+            stale = [key for key in self._entries if key[0] == kind]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "not_modified": self.not_modified
+            }
+
+# Shared cache for the API process
+response_cache = ResponseCache()
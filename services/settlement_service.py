@@ -0,0 +1,259 @@
+"""
+Settlement Service
+Amount payable to each merchant per day, written as one file per bank
+
+Redemptions are streamed from the redemption archive one segment at a time
+and from the open Redeem files (or the SQLite table) in fixed-size chunks,
+so memory stays bounded by the number of (merchant, day) groups. Each chunk
+is aggregated with NumPy when it is installed and with plain Python
+otherwise.
+
+    python -m services.settlement_service [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+"""
+import csv
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # Optional: grouping falls back to plain Python
+    np = None
+
+from services.merchant_service import merchants, load_merchants
+from services.redemption_archive import (
+    iter_segments,
+    read_redemption_batches,
+    to_epoch,
+    from_epoch
+)
+from services.redemption_log import parse_redemption_row
+from services.storage_backend import get_backend, STORAGE_DIR
+from utils.file_utils import atomic_open
+
+SETTLEMENTS_DIR = os.path.join(STORAGE_DIR, "settlements")
+
+# Rows aggregated at a time from CSV files and the database
+CHUNK_ROWS = 100000
+SECONDS_PER_DAY = 86400
+
+# Only completed redemptions are paid out
+PAYABLE_STATUS = "Completed"
+
+SETTLEMENT_COLUMNS = [
+    "Settlement_Date", "Merchant_ID", "Merchant_Name", "Bank_Name", "Bank_Code",
+    "Branch_Code", "Account_Number", "Account_Holder", "Vouchers_Redeemed", "Amount_Payable"
+]
+
+db = get_backend()
+
+def _group_sum(merchant_codes, merchant_ids, days, vouchers, cents, totals):
+    """
+    Add per-(merchant, day) sums of one chunk into totals
+
+    Args:
+        merchant_codes: Index into merchant_ids for each row
+        merchant_ids: Dictionary of merchant IDs for this chunk
+        days: Day number (epoch days) for each row
+        vouchers, cents: Values to sum for each row
+        totals: (merchant_id, day) -> [vouchers, cents], updated in place
+    """
+    if np is not None:
+        codes = np.asarray(merchant_codes, dtype=np.int64)
+        if codes.size == 0:
+            return
+        keys = (codes << 32) | np.asarray(days, dtype=np.int64)
+        groups, inverse = np.unique(keys, return_inverse=True)
+        voucher_sums = np.bincount(inverse, weights=np.asarray(vouchers, dtype=np.float64))
+        cent_sums = np.bincount(inverse, weights=np.asarray(cents, dtype=np.float64))
+        group_rows = zip(groups.tolist(), voucher_sums.tolist(), cent_sums.tolist())
+        for key, voucher_sum, cent_sum in group_rows:
+            entry = totals.setdefault((merchant_ids[key >> 32], key & 0xFFFFFFFF), [0, 0])
+            entry[0] += int(round(voucher_sum))
+            entry[1] += int(round(cent_sum))
+        return
+
+    for code, day, voucher_count, value in zip(merchant_codes, days, vouchers, cents):
+        entry = totals.setdefault((merchant_ids[code], day), [0, 0])
+        entry[0] += voucher_count
+        entry[1] += value
+
+def _aggregate_segment(segment, totals, start, end):
+    """Grouped sums over one archive segment, using its column arrays directly"""
+    statuses = segment.dictionary("payment_status")
+    if PAYABLE_STATUS not in statuses:
+        return 0
+    paid = statuses.index(PAYABLE_STATUS)
+    low = to_epoch(start) if start is not None else 1
+    high = to_epoch(end) if end is not None else None
+
+    if np is not None:
+        ts = np.frombuffer(segment.column("timestamp"), dtype=np.int64)
+        mask = (np.frombuffer(segment.column("payment_status"), dtype=np.uint32) == paid) & (ts >= low)
+        if high is not None:
+            mask &= ts < high
+        _group_sum(
+            np.frombuffer(segment.column("merchant_id"), dtype=np.uint32)[mask],
+            segment.dictionary("merchant_id"),
+            ts[mask] // SECONDS_PER_DAY,
+            np.frombuffer(segment.column("voucher_count"), dtype=np.int64)[mask],
+            np.frombuffer(segment.column("value_cents"), dtype=np.int64)[mask],
+            totals
+        )
+        return int(mask.sum())
+
+    ts = segment.column("timestamp")
+    status = segment.column("payment_status")
+    selected = [
+        i for i in range(segment.rows)
+        if status[i] == paid and ts[i] >= low and (high is None or ts[i] < high)
+    ]
+    merchant_col = segment.column("merchant_id")
+    voucher_col = segment.column("voucher_count")
+    cent_col = segment.column("value_cents")
+    _group_sum(
+        [merchant_col[i] for i in selected],
+        segment.dictionary("merchant_id"),
+        [ts[i] // SECONDS_PER_DAY for i in selected],
+        [voucher_col[i] for i in selected],
+        [cent_col[i] for i in selected],
+        totals
+    )
+    return len(selected)
+
+def _aggregate_records(records, totals, start, end):
+    """Grouped sums over normalized records, CHUNK_ROWS at a time"""
+    count = 0
+    chunk = ([], [], [], [])
+    merchant_ids, codes = [], {}
+
+    def flush():
+        _group_sum(chunk[0], merchant_ids, chunk[1], chunk[2], chunk[3], totals)
+        for column in chunk:
+            column.clear()
+
+    for record in records:
+        ts = record["timestamp"]
+        if record["payment_status"] != PAYABLE_STATUS or ts is None:
+            continue
+        if (start is not None and ts < start) or (end is not None and ts >= end):
+            continue
+        code = codes.get(record["merchant_id"])
+        if code is None:
+            code = codes[record["merchant_id"]] = len(merchant_ids)
+            merchant_ids.append(record["merchant_id"])
+        chunk[0].append(code)
+        chunk[1].append(to_epoch(ts) // SECONDS_PER_DAY)
+        chunk[2].append(record["voucher_count"])
+        chunk[3].append(record["value_cents"])
+        count += 1
+        if len(chunk[0]) >= CHUNK_ROWS:
+            flush()
+    flush()
+    return count
+
+def _database_records():
+    for rows in db.iter_redemptions(CHUNK_ROWS):
+        for row in rows:
+            record = parse_redemption_row(row)
+            if record is not None:
+                yield record
+
+def _open_file_records(start, end):
+    """Records from Redeem files that have not been archived yet"""
+    for _, records in read_redemption_batches(start=start, end=end, include_archive=False):
+        yield from records
+
+def compute_settlement_totals(start=None, end=None):
+    """
+    Sum payable vouchers and cents per merchant and day
+
+    Args:
+        start, end: Only redemptions with start <= time < end (datetimes)
+
+    Returns:
+        Tuple of ({(merchant_id, day_number): [vouchers, cents]}, rows counted)
+    """
+    totals = {}
+    rows = 0
+    if db is not None:
+        rows += _aggregate_records(_database_records(), totals, start, end)
+    else:
+        for segment in iter_segments(start=start, end=end):
+            rows += _aggregate_segment(segment, totals, start, end)
+        rows += _aggregate_records(_open_file_records(start, end), totals, start, end)
+    return totals, rows
+
+def generate_settlement(start=None, end=None, output_dir=None):
+    """
+    Write one settlement file per bank
+
+    Args:
+        start, end: Only redemptions with start <= time < end (datetimes)
+        output_dir: Where to write (defaults to storage/settlements/<run time>)
+
+    Returns:
+        Dict with output_dir, rows, seconds and per-bank file, merchants and amount
+    """
+    started = time.perf_counter()
+    load_merchants()
+    totals, rows = compute_settlement_totals(start, end)
+
+    output_dir = output_dir or os.path.join(SETTLEMENTS_DIR, datetime.now().strftime("%Y%m%d%H%M%S"))
+    by_bank = {}
+    for (merchant_id, day), (vouchers, cents) in sorted(totals.items()):
+        merchant = merchants.get(merchant_id, {})
+        bank_code = merchant.get("bank_code") or "UNKNOWN"
+        by_bank.setdefault(bank_code, []).append(([
+            from_epoch(day * SECONDS_PER_DAY).strftime("%Y-%m-%d"),
+            merchant_id,
+            merchant.get("merchant_name", ""),
+            merchant.get("bank_name", ""),
+            bank_code,
+            merchant.get("branch_code", ""),
+            merchant.get("account_number", ""),
+            merchant.get("account_holder", ""),
+            vouchers,
+            f"{cents / 100:.2f}"
+        ], cents))
+
+    banks = {}
+    for bank_code, lines in by_bank.items():
+        path = os.path.join(output_dir, f"settlement_{bank_code}.csv")
+        with atomic_open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(SETTLEMENT_COLUMNS)
+            writer.writerows(line for line, _ in lines)
+        banks[bank_code] = {
+            "file": path,
+            "merchants": len({line[1] for line, _ in lines}),
+            "amount": f"{sum(cents for _, cents in lines) / 100:.2f}"
+        }
+
+    return {
+        "output_dir": output_dir,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - started, 3),
+        "banks": banks
+    }
+
+def _parse_date_arg(flag):
+    if flag not in sys.argv:
+        return None
+    return datetime.strptime(sys.argv[sys.argv.index(flag) + 1], "%Y-%m-%d")
+
+if __name__ == "__main__":
+    try:
+        start = _parse_date_arg("--from")
+        end = _parse_date_arg("--to")
+    except (IndexError, ValueError):
+        print("Usage: python -m services.settlement_service [--from YYYY-MM-DD] [--to YYYY-MM-DD]")
+        sys.exit(1)
+
+    # --to is inclusive on the command line
+    result = generate_settlement(start, end + timedelta(days=1) if end else None)
+    for bank_code, info in sorted(result["banks"].items()):
+        print(f"✅ Bank {bank_code}: {info['merchants']} merchants, ${info['amount']} -> {info['file']}")
+    print(f"✅ Settled {result['rows']} redemption rows in {result['seconds']}s "
+          f"({'numpy' if np is not None else 'pure Python'})")
@@ -0,0 +1,539 @@
+"""
+Storage Backend Selection
+JSON/CSV files (default) or a SQLite database in WAL mode
+
+Set CDC_STORAGE_BACKEND=sqlite to keep households, merchants, tokens,
+redemptions, transactions and notifications in storage/cdc.db. This is
+also the shared state used when several API worker processes run (wsgi.py).
+Existing files can be imported once with:
+
+    python -m services.storage_backend migrate
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+# Get the project root directory (parent of services folder)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # This is the services folder
+PROJECT_ROOT = os.path.dirname(BASE_DIR)  # Go up one level to project root
+
+# CDC_STORAGE_DIR moves every data file elsewhere (the tests use a temporary directory)
+STORAGE_DIR = os.environ.get("CDC_STORAGE_DIR", os.path.join(PROJECT_ROOT, "storage"))
+STORAGE_BACKEND = os.environ.get("CDC_STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.environ.get("CDC_SQLITE_PATH", os.path.join(STORAGE_DIR, "cdc.db"))
+
+# Held by one running API process (see app.py); offline tools that write
+# the household storage refuse to run while it is taken
+API_LEADER_LOCK = os.path.join(STORAGE_DIR, "api_leader.lock")
+
+# Column order of the redemption CSV files
+REDEMPTION_COLUMNS = [
+    "Transaction_ID", "Household_ID", "Merchant_ID",
+    "Transaction_Date_Time", "Voucher_Code", "Denomination_Used",
+    "Amount_Redeemed", "Payment_Status", "Remarks"
+]
+
+# Tables filled by migrate_files_to_sqlite()
+MIGRATED_TABLES = ["households", "merchants", "redemptions", "transactions", "notifications"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS households (
+    household_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    household_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tokens_household ON tokens(household_id);
+CREATE INDEX IF NOT EXISTS idx_tokens_expiry ON tokens(expires_at);
+
+CREATE TABLE IF NOT EXISTS merchants (
+    merchant_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS redemptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT,
+    household_id TEXT,
+    merchant_id TEXT,
+    transaction_date_time TEXT,
+    voucher_code TEXT,
+    denomination_used TEXT,
+    amount_redeemed TEXT,
+    payment_status TEXT,
+    remarks TEXT,
+    source_file TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_redemptions_merchant ON redemptions(merchant_id);
+CREATE INDEX IF NOT EXISTS idx_redemptions_household ON redemptions(household_id);
+CREATE INDEX IF NOT EXISTS idx_redemptions_transaction ON redemptions(transaction_id);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    household_id TEXT NOT NULL,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_household ON transactions(household_id, id);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    notification_id TEXT PRIMARY KEY,
+    household_id TEXT NOT NULL,
+    timestamp REAL,
+    read INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_household ON notifications(household_id, read);
+"""
+
+class SqliteBackend:
+    """SQLite storage with one connection per thread"""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn.executescript(SCHEMA)
+        # Databases created before households had a change sequence
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(households)")]
+        if "seq" not in columns:
+            try:
+                self.conn.execute("ALTER TABLE households ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # Another worker added it first
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_households_seq ON households(seq)")
+        # Databases from before tokens moved to their own table
+        if "active_token" in columns:
+            try:
+                self.conn.execute("DROP INDEX IF EXISTS idx_households_token")
+                self.conn.execute("ALTER TABLE households DROP COLUMN active_token")
+            except sqlite3.OperationalError:
+                pass  # Dropped by another worker, or SQLite before 3.35 (column left unused)
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Write transaction on this thread's connection
+
+        The outermost call takes SQLite's write lock up front (BEGIN
+        IMMEDIATE), so it also excludes writers in other worker processes.
+        Nested calls join the enclosing transaction.
+        """
+        depth = getattr(self._local, "depth", 0)
+        conn = self.conn
+        if depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth == 0:
+                conn.rollback()
+            raise
+        self._local.depth = depth
+        if depth == 0:
+            conn.commit()
+
+    def _bump_version(self, name):
+        self.conn.execute(
+            "INSERT INTO versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (name,)
+        )
+
+    def row_count(self, table):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def table_version(self, name):
+        """Counter bumped by every write to a table, from any process"""
+        row = self.conn.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    # ==================
+    # HOUSEHOLDS
+    # ==================
+
+    def load_households(self):
+        rows = self.conn.execute("SELECT household_id, data FROM households")
+        return {hid: json.loads(data) for hid, data in rows}
+
+    def load_households_since(self, seq):
+        """
+        Households written after change sequence `seq`, from any process
+
+        Returns:
+            ({household_id: record}, highest sequence seen)
+        """
+        latest = seq
+        records = {}
+        for hid, data, row_seq in self.conn.execute(
+                "SELECT household_id, data, seq FROM households WHERE seq > ?", (seq,)):
+            records[hid] = json.loads(data)
+            latest = max(latest, row_seq)
+        return records, latest
+
+    def load_households_by_id(self, household_ids):
+        """{household_id: record} for the given households that exist"""
+        records = {}
+        household_ids = list(household_ids)
+        # Kept under SQLite's default limit of 999 bound parameters
+        for i in range(0, len(household_ids), 500):
+            batch = household_ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT household_id, data FROM households WHERE household_id IN ({', '.join('?' * len(batch))})",
+                batch
+            )
+            records.update((hid, json.loads(data)) for hid, data in rows)
+        return records
+
+    def upsert_households(self, records):
+        with self.transaction():
+            # Every row in the batch gets the new table version as its sequence
+            self._bump_version("households")
+            seq = self.table_version("households")
+            self.conn.executemany(
+                "INSERT INTO households (household_id, data, seq) VALUES (?, ?, ?) "
+                "ON CONFLICT(household_id) DO UPDATE SET data = excluded.data, seq = excluded.seq",
+                [(r["household_id"], json.dumps(r), seq) for r in records]
+            )
+
+    def upsert_household(self, record):
+        self.upsert_households([record])
+
+    def touch_household(self, household_id):
+        """Give a household row a new sequence so other workers reload it"""
+        with self.transaction():
+            self._bump_version("households")
+            self.conn.execute(
+                "UPDATE households SET seq = ? WHERE household_id = ?",
+                (self.table_version("households"), household_id)
+            )
+
+    # ==================
+    # MERCHANTS
+    # ==================
+
+    def load_merchants(self):
+        rows = self.conn.execute("SELECT merchant_id, data FROM merchants")
+        return {mid: json.loads(data) for mid, data in rows}
+
+    def upsert_merchants(self, records):
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT INTO merchants (merchant_id, data) VALUES (?, ?) "
+                "ON CONFLICT(merchant_id) DO UPDATE SET data = excluded.data",
+                [(mid, json.dumps(data)) for mid, data in records.items()]
+            )
+            self._bump_version("merchants")
+
+    def insert_merchant(self, merchant_id, record):
+        """
+        Add a new merchant
+
+        Raises:
+            sqlite3.IntegrityError: if the merchant ID is already taken,
+                including by another worker process
+        """
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO merchants (merchant_id, data) VALUES (?, ?)",
+                (merchant_id, json.dumps(record))
+            )
+            self._bump_version("merchants")
+
+    # ==================
+    # REDEMPTIONS
+    # ==================
+
+    def append_redemptions(self, rows, source_file=None):
+        """Insert redemption rows in REDEMPTION_COLUMNS order"""
+        padded = [list(row)[:9] + [""] * (9 - len(row)) + [source_file] for row in rows]
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT INTO redemptions (transaction_id, household_id, merchant_id, "
+                "transaction_date_time, voucher_code, denomination_used, amount_redeemed, "
+                "payment_status, remarks, source_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                padded
+            )
+
+    def get_redemptions_since(self, last_id):
+        """
+        Redemption rows inserted after row id `last_id`, from any process
+
+        Returns:
+            (rows in REDEMPTION_COLUMNS order, highest row id seen)
+        """
+        rows = []
+        for row in self.conn.execute(
+                "SELECT id, transaction_id, household_id, merchant_id, transaction_date_time, "
+                "voucher_code, denomination_used, amount_redeemed, payment_status, remarks "
+                "FROM redemptions WHERE id > ? ORDER BY id", (last_id,)):
+            last_id = row[0]
+            rows.append(list(row[1:]))
+        return rows, last_id
+
+    def last_redemption_id(self):
+        row = self.conn.execute("SELECT MAX(id) FROM redemptions").fetchone()
+        return row[0] or 0
+
+    def iter_redemptions(self, batch_size=10000):
+        """Yield all redemption rows in batches, without loading the table"""
+        cur = self.conn.execute(
+            "SELECT transaction_id, household_id, merchant_id, transaction_date_time, "
+            "voucher_code, denomination_used, amount_redeemed, payment_status, remarks "
+            "FROM redemptions ORDER BY id"
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [list(row) for row in rows]
+
+    def get_redemptions(self, merchant_id=None, household_id=None):
+        query = "SELECT transaction_id, household_id, merchant_id, transaction_date_time, " \
+                "voucher_code, denomination_used, amount_redeemed, payment_status, remarks " \
+                "FROM redemptions"
+        clauses, params = [], []
+        if merchant_id is not None:
+            clauses.append("merchant_id = ?")
+            params.append(merchant_id)
+        if household_id is not None:
+            clauses.append("household_id = ?")
+            params.append(household_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return [list(row) for row in self.conn.execute(query + " ORDER BY id", params)]
+
+    # ==================
+    # TOKENS
+    # ==================
+
+    def insert_token(self, entry):
+        """Store a token entry; raises sqlite3.IntegrityError if the token exists"""
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO tokens (token, household_id, expires_at, data) VALUES (?, ?, ?, ?)",
+                (entry["token"], entry["household_id"], entry["expires_at"], json.dumps(entry))
+            )
+
+    def get_token(self, token, now):
+        row = self.conn.execute(
+            "SELECT data FROM tokens WHERE token = ? AND expires_at > ?", (token, now)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def take_token(self, token, now):
+        """Delete a live token and return its entry; only one caller gets it"""
+        with self.transaction():
+            entry = self.get_token(token, now)
+            if entry is not None:
+                self.conn.execute("DELETE FROM tokens WHERE token = ?", (token,))
+        return entry
+
+    def household_tokens(self, household_id, now):
+        """Live token entries of one household, oldest first"""
+        rows = self.conn.execute(
+            "SELECT data FROM tokens WHERE household_id = ? AND expires_at > ? ORDER BY expires_at",
+            (household_id, now)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def delete_expired_tokens(self, now):
+        with self.transaction():
+            cur = self.conn.execute("DELETE FROM tokens WHERE expires_at <= ?", (now,))
+        return cur.rowcount
+
+    def count_tokens(self, now):
+        return self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT household_id) FROM tokens WHERE expires_at > ?", (now,)
+        ).fetchone()
+
+    # ==================
+    # TRANSACTIONS
+    # ==================
+
+    def log_transactions(self, transactions):
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT INTO transactions (household_id, timestamp, data) VALUES (?, ?, ?)",
+                [(t["household_id"], t.get("timestamp"), json.dumps(t)) for t in transactions]
+            )
+
+    def log_transaction(self, transaction):
+        self.log_transactions([transaction])
+
+    def trim_transactions(self, household_id, keep):
+        """Delete all but the most recent `keep` transactions of a household"""
+        with self.transaction():
+            self.conn.execute(
+                "DELETE FROM transactions WHERE household_id = ? AND id NOT IN "
+                "(SELECT id FROM transactions WHERE household_id = ? ORDER BY id DESC LIMIT ?)",
+                (household_id, household_id, keep)
+            )
+
+    def get_transactions(self, household_id, limit=10):
+        """Most recent first"""
+        rows = self.conn.execute(
+            "SELECT data FROM transactions WHERE household_id = ? ORDER BY id DESC LIMIT ?",
+            (household_id, limit)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    # ==================
+    # NOTIFICATIONS
+    # ==================
+
+    def add_notification(self, notification_id, notification):
+        with self.transaction():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO notifications (notification_id, household_id, timestamp, read, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (notification_id, notification["household_id"], notification.get("timestamp"),
+                 1 if notification.get("read") else 0, json.dumps(notification))
+            )
+
+    def get_unread_notifications(self, household_id):
+        """Newest first, as (notification_id, notification) pairs"""
+        rows = self.conn.execute(
+            "SELECT notification_id, data FROM notifications "
+            "WHERE household_id = ? AND read = 0 ORDER BY timestamp DESC",
+            (household_id,)
+        )
+        return [(nid, json.loads(data)) for nid, data in rows]
+
+    def mark_notifications_read(self, household_id, notification_ids=None):
+        query = "UPDATE notifications SET read = 1 WHERE household_id = ? AND read = 0"
+        params = [household_id]
+        if notification_ids is not None:
+            if not notification_ids:
+                return 0
+            query += f" AND notification_id IN ({', '.join('?' * len(notification_ids))})"
+            params.extend(notification_ids)
+        with self.transaction():
+            cur = self.conn.execute(query, params)
+        return cur.rowcount
+
+    def delete_notification(self, notification_id):
+        with self.transaction():
+            cur = self.conn.execute(
+                "DELETE FROM notifications WHERE notification_id = ?", (notification_id,)
+            )
+        return cur.rowcount > 0
+
+    def clear_notifications(self, household_id):
+        with self.transaction():
+            cur = self.conn.execute(
+                "DELETE FROM notifications WHERE household_id = ?", (household_id,)
+            )
+        return cur.rowcount
+
+_backend = None
+
+def get_backend():
+    """
+    Return the SQLite backend when enabled, otherwise None (JSON/CSV files)
+    """
+    global _backend
+    if STORAGE_BACKEND != "sqlite":
+        return None
+    if _backend is None:
+        _backend = SqliteBackend(SQLITE_PATH)
+        print(f"[INIT] Using SQLite storage at: {SQLITE_PATH}")
+    return _backend
+
+def migrate_files_to_sqlite(path=SQLITE_PATH):
+    """
+    One-shot import of the JSON/CSV storage files into a SQLite database
+
+    Must run with the JSON backend so the services read from the files, and
+    into a database with no data yet: redemptions and transactions are
+    appended, so a second run would duplicate them.
+    """
+    if STORAGE_BACKEND != "json":
+        raise RuntimeError("Run the migration with CDC_STORAGE_BACKEND=json")
+
+    db = SqliteBackend(path)
+    populated = [table for table in MIGRATED_TABLES if db.row_count(table)]
+    if populated:
+        raise RuntimeError(f"{path} already has {', '.join(populated)}; migrate into a new database")
+
+    from services.household_service import households
+    from services.merchant_service import merchants
+    from services import notification_service
+    from services.redemption_archive import read_redemption_batches
+    from services.redemption_log import format_redemption_row
+
+    if notification_service.legacy_files_pending():
+        raise RuntimeError("Convert the old notification files first: "
+                           "python -m services.notification_service migrate")
+
+    counts = {}
+
+    db.upsert_households([h.to_dict() for h in households.values()])
+    counts["households"] = len(households)
+
+    db.upsert_merchants(merchants)
+    counts["merchants"] = len(merchants)
+
+    # Archived and not-yet-archived Redeem files, one batch per hourly file
+    counts["redemptions"] = 0
+    for filename, records in read_redemption_batches():
+        rows = [format_redemption_row(record) for record in records]
+        db.append_redemptions(rows, source_file=filename)
+        counts["redemptions"] += len(rows)
+
+    counts["transactions"] = 0
+    for hid in households:
+        # History files are newest first; insert oldest first so ids follow time
+        history = notification_service.get_transaction_history(hid, limit=None)
+        db.log_transactions(list(reversed(history)))
+        counts["transactions"] += len(history)
+
+    counts["notifications"] = 0
+    for hid in households:
+        for item in notification_service.get_unread_notifications(hid):
+            db.add_notification(item["notification_id"], item["notification"])
+            counts["notifications"] += 1
+
+    return counts
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python -m services.storage_backend migrate [sqlite_path]")
+        sys.exit(1)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    try:
+        result = migrate_files_to_sqlite(target)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    for name, count in result.items():
+        print(f"✅ Migrated {count} {name}")
+    print(f"✅ Database written to {target}")
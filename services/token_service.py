@@ -0,0 +1,325 @@
+"""
+Token Service
+Short-lived redemption tokens with TTL expiry
+
+Tokens are drawn from a 50-bit `secrets` space and stay valid for
+TOKEN_TTL_SECONDS. With the default file storage they live only in the API
+process: expiry times sit in a min-heap, so expiring a burst of tokens
+costs O(log n) each and lookups never scan. Tokens are not written to
+households.json; restarting the API invalidates any that are outstanding
+and households simply generate new ones. With the SQLite backend they are
+kept in its tokens table instead, so every API worker process sees them.
+
+A household may hold several tokens at once (one per shop, say). The
+vouchers each token covers are reserved when it is issued, so a token can
+only be issued against vouchers that are not already held by another one.
+Redeeming a token commits its reservation and expiry releases it; balances
+are shown net of outstanding reservations.
+"""
+import heapq
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from services.storage_backend import get_backend
+from services.response_cache import response_cache
+
+# Seconds a token stays valid (override with CDC_TOKEN_TTL)
+TOKEN_TTL_SECONDS = int(os.environ.get("CDC_TOKEN_TTL", "900"))
+
+# "TXN-" + 10 characters of Crockford base32 (no I, L, O, U): 50 random bits
+TOKEN_PREFIX = "TXN-"
+TOKEN_LENGTH = 10
+TOKEN_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# SQLite store: expired rows are deleted at most this often, on lookups
+# (never inside a household's write transaction)
+TOKEN_PURGE_INTERVAL = 60
+
+db = get_backend()
+
+def voucher_total(vouchers):
+    """Dollar value of a {tranche: {denom: count}} selection"""
+    return sum(int(d) * int(c) for denoms in vouchers.values() for d, c in denoms.items())
+
+def new_token_code():
+    return TOKEN_PREFIX + "".join(secrets.choice(TOKEN_ALPHABET) for _ in range(TOKEN_LENGTH))
+
+def make_entry(token, household_id, vouchers, now, ttl):
+    return {
+        "token": token,
+        "household_id": household_id,
+        "vouchers": vouchers,
+        "total": voucher_total(vouchers),
+        "voucher_values": sorted(
+            int(denom)
+            for denoms in vouchers.values()
+            for denom, count in denoms.items()
+            for _ in range(int(count))
+        ),
+        "created_at": now,
+        "expires_at": now + ttl
+    }
+
+def add_held(held, vouchers, sign):
+    """Add (sign=1) or release (sign=-1) a selection in a {tranche: {denom: count}} dict"""
+    for tranche, denoms in vouchers.items():
+        counts = held.setdefault(tranche, {})
+        for denom, count in denoms.items():
+            remaining = counts.get(str(denom), 0) + sign * int(count)
+            if remaining:
+                counts[str(denom)] = remaining
+            else:
+                counts.pop(str(denom), None)
+        if not counts:
+            del held[tranche]
+
+def check_available(vouchers, balance, held):
+    """Raise ValueError if balance less held counts cannot cover vouchers"""
+    for tranche, denoms in vouchers.items():
+        for denom, count in denoms.items():
+            available = balance.get(tranche, {}).get(denom, 0) - held.get(tranche, {}).get(denom, 0)
+            if count > available:
+                raise ValueError(
+                    f"Insufficient balance for {tranche} ${denom}. Max: {max(0, available)}"
+                )
+
+class TokenStore:
+    """
+    token -> entry map with heap-ordered expiry and per-household reservations
+
+    Entries are dicts with token, household_id, vouchers, total,
+    voucher_values, created_at and expires_at. Expired tokens are purged
+    on every operation, oldest first, so the store only holds live tokens.
+    """
+
+    def __init__(self, ttl=TOKEN_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._household_tokens = {}   # household_id -> {token: entry}
+        self._reserved = {}           # household_id -> {tranche: {denom: count}}
+        self._expiry = []             # (expires_at, token) min-heap
+        self.issued = 0
+        self.redeemed = 0
+        self.expired = 0
+        self.collisions = 0
+
+    def _new_token(self):
+        while True:
+            token = new_token_code()
+            if token not in self._tokens:
+                return token
+            self.collisions += 1
+
+    def _hold(self, entry, sign):
+        """Add (sign=1) or release (sign=-1) the vouchers an entry reserves"""
+        household_id = entry["household_id"]
+        held = self._reserved.setdefault(household_id, {})
+        add_held(held, entry["vouchers"], sign)
+        if not held:
+            del self._reserved[household_id]
+
+    def _remove(self, token):
+        entry = self._tokens.pop(token)
+        household_id = entry["household_id"]
+        tokens = self._household_tokens[household_id]
+        del tokens[token]
+        if not tokens:
+            del self._household_tokens[household_id]
+        self._hold(entry, -1)
+        response_cache.invalidate("balance", household_id)
+        return entry
+
+    def _expire(self, now):
+        """Pop every token whose time is up (hold _lock); returns how many"""
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, token = heapq.heappop(self._expiry)
+            entry = self._tokens.get(token)
+            # Skip heap items for tokens already redeemed
+            if entry is not None and entry["expires_at"] == expires_at:
+                self._remove(token)
+                expired += 1
+        self.expired += expired
+        return expired
+
+    def issue(self, household_id, vouchers, balance=None, ttl=None):
+        """
+        Create a token for a voucher selection and reserve its vouchers
+
+        The household's other tokens stay valid. Callers hold the
+        household's lock so the balance cannot change underneath the check.
+
+        Args:
+            household_id: Owner of the token
+            vouchers: {tranche: {denom: count}} selection
+            balance: The household's vouchers; when given, the selection
+                must fit in what is not already reserved
+            ttl: Seconds until expiry (defaults to the store TTL)
+
+        Returns:
+            The new token entry
+
+        Raises:
+            ValueError: If the selection exceeds the unreserved balance
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if balance is not None:
+                check_available(vouchers, balance, self._reserved.get(household_id, {}))
+            entry = make_entry(self._new_token(), household_id, vouchers, now, ttl or self.ttl)
+            self._tokens[entry["token"]] = entry
+            self._household_tokens.setdefault(household_id, {})[entry["token"]] = entry
+            self._hold(entry, 1)
+            heapq.heappush(self._expiry, (entry["expires_at"], entry["token"]))
+            self.issued += 1
+        response_cache.invalidate("balance", household_id)
+        return entry
+
+    def get(self, token):
+        """Live entry for a token, or None if unknown or expired"""
+        with self._lock:
+            self._expire(time.time())
+            return self._tokens.get(token)
+
+    def consume(self, token):
+        """
+        Take a token out of the store and release its reservation
+
+        Only one caller can get the entry; it must then deduct the entry's
+        vouchers (under the household lock) to commit the hold.
+
+        Returns:
+            The entry, or None if the token is unknown, expired or already used
+        """
+        with self._lock:
+            self._expire(time.time())
+            if token not in self._tokens:
+                return None
+            self.redeemed += 1
+            return self._remove(token)
+
+    def tokens_for(self, household_id):
+        """Live token entries held by one household, oldest first"""
+        with self._lock:
+            self._expire(time.time())
+            return list(self._household_tokens.get(household_id, {}).values())
+
+    def reserved(self, household_id):
+        """{tranche: {denom: count}} held by the household's live tokens"""
+        with self._lock:
+            self._expire(time.time())
+            held = self._reserved.get(household_id, {})
+            return {tranche: dict(counts) for tranche, counts in held.items()}
+
+    def expire(self, now=None):
+        """Purge expired tokens now; returns how many were removed"""
+        with self._lock:
+            return self._expire(now if now is not None else time.time())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._tokens),
+                "households": len(self._household_tokens),
+                "issued": self.issued,
+                "redeemed": self.redeemed,
+                "expired": self.expired,
+                "collisions": self.collisions,
+                "ttl_seconds": self.ttl
+            }
+
+class SqliteTokenStore:
+    """
+    Token store kept in the SQLite tokens table, shared by worker processes
+
+    Same interface as TokenStore. A household's reservations are summed
+    from its live token rows (indexed by household), and consume() deletes
+    the row inside a write transaction, so only one worker can redeem a
+    token. Issue/redeem/expiry counters are per process.
+    """
+
+    def __init__(self, backend, ttl=TOKEN_TTL_SECONDS):
+        self.db = backend
+        self.ttl = ttl
+        self._last_purge = 0.0
+        self.issued = 0
+        self.redeemed = 0
+        self.expired = 0
+        self.collisions = 0
+
+    def _held(self, household_id, now):
+        held = {}
+        for entry in self.db.household_tokens(household_id, now):
+            add_held(held, entry["vouchers"], 1)
+        return held
+
+    def issue(self, household_id, vouchers, balance=None, ttl=None):
+        """See TokenStore.issue"""
+        now = time.time()
+        with self.db.transaction():
+            if balance is not None:
+                check_available(vouchers, balance, self._held(household_id, now))
+            while True:
+                entry = make_entry(new_token_code(), household_id, vouchers, now, ttl or self.ttl)
+                try:
+                    self.db.insert_token(entry)
+                    break
+                except sqlite3.IntegrityError:
+                    self.collisions += 1
+            # The reservation changes the household's balance in every worker
+            self.db.touch_household(household_id)
+        self.issued += 1
+        response_cache.invalidate("balance", household_id)
+        return entry
+
+    def get(self, token):
+        """Live entry for a token, or None if unknown or expired"""
+        now = time.time()
+        if now - self._last_purge >= TOKEN_PURGE_INTERVAL:
+            self.expire(now)
+        return self.db.get_token(token, now)
+
+    def consume(self, token):
+        """See TokenStore.consume"""
+        entry = self.db.take_token(token, time.time())
+        if entry is not None:
+            self.redeemed += 1
+            response_cache.invalidate("balance", entry["household_id"])
+        return entry
+
+    def tokens_for(self, household_id):
+        """Live token entries held by one household, oldest first"""
+        return self.db.household_tokens(household_id, time.time())
+
+    def reserved(self, household_id):
+        """{tranche: {denom: count}} held by the household's live tokens"""
+        return self._held(household_id, time.time())
+
+    def expire(self, now=None):
+        """Delete expired token rows now; returns how many were removed"""
+        now = now if now is not None else time.time()
+        expired = self.db.delete_expired_tokens(now)
+        self._last_purge = now
+        self.expired += expired
+        return expired
+
+    def stats(self):
+        active, households = self.db.count_tokens(time.time())
+        return {
+            "active": active,
+            "households": households,
+            "issued": self.issued,
+            "redeemed": self.redeemed,
+            "expired": self.expired,
+            "collisions": self.collisions,
+            "ttl_seconds": self.ttl,
+            "shared": True
+        }
+
+# Shared store for the API: in memory, or in SQLite when that backend is on
+token_store = SqliteTokenStore(db) if db is not None else TokenStore()
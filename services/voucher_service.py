@@ -1,10 +1,18 @@
 """
-Voucher Service - Fixed to work with dict-based households
+Voucher Service - Claims tranches into Household voucher arrays
 """
-from services.household_service import households, save_households
+from services.household_service import households, household_lock, record_change, load_households
+from services.response_cache import response_cache
+
+# Voucher schemes: tranche -> {denomination: count issued per household}
+schemes = {
+    "Jan2026": {"2": 30, "5": 12, "10": 18},
+    "May2025": {"2": 50, "5": 20, "10": 30}
+}
 
 def claim_voucher(household_id, data):
     """Claim vouchers for a household"""
+    load_households()
     if household_id not in households:
         return {"error": "Household not found"}, 404
     
@@ -12,28 +20,25 @@ def claim_voucher(household_id, data):
         return {"error": "Missing field: tranche"}, 400
     
     tranche = data["tranche"]
+
+    with household_lock(household_id):
+        return _claim_voucher_locked(household_id, tranche)
+
+def _claim_voucher_locked(household_id, tranche):
     household = households[household_id]
     
     # Check if already claimed
-    if tranche in household.get("vouchers", {}):
+    if household.has_tranche(tranche):
         return {"error": f"{tranche} already claimed"}, 400
     
-    # Define voucher schemes
-    schemes = {
-        "Jan2026": {"2": 30, "5": 12, "10": 18},
-        "May2025": {"2": 50, "5": 20, "10": 30}
-    }
-    
     if tranche not in schemes:
         return {"error": "Invalid tranche"}, 400
     
     # Add vouchers to household
-    if "vouchers" not in household:
-        household["vouchers"] = {}
-    
-    household["vouchers"][tranche] = schemes[tranche].copy()
+    household.set_tranche(tranche, schemes[tranche])
     
-    save_households()
+    record_change("claim", household_id, tranche=tranche, vouchers=schemes[tranche])
+    response_cache.invalidate("balance", household_id)
     
     return {
         "message": "Voucher claimed successfully",
@@ -0,0 +1,12 @@
+"""
+The tests run against an empty temporary storage directory, set before any
+service module is imported, so they never touch the files under storage/
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+STORAGE_DIR = tempfile.mkdtemp(prefix="cdc-tests-")
+os.environ["CDC_STORAGE_DIR"] = STORAGE_DIR
+atexit.register(shutil.rmtree, STORAGE_DIR, ignore_errors=True)
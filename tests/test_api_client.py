@@ -0,0 +1,87 @@
+"""
+API client retry tests
+
+Idempotent calls are retried on 502/503/504 and dropped connections; POST
+calls (register, generate, redeem) are sent exactly once, since the server
+may already have acted on them.
+"""
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import api_client
+from api_client import CDCApiClient
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers /unavailable with a 503 and drops the connection on /drop"""
+
+    def handle_any(self):
+        self.server.calls.append((self.command, self.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if self.path.startswith("/drop"):
+            self.close_connection = True
+            return
+        body = json.dumps({"error": "Service unavailable"}).encode("utf-8")
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_DELETE = handle_any
+
+    def log_message(self, format, *args):
+        pass
+
+class RetryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        cls.server.calls = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.calls.clear()
+        with mock.patch.object(api_client, "RETRY_BACKOFF", 0):
+            self.client = CDCApiClient(base_url=f"http://127.0.0.1:{self.server.server_port}", retries=2)
+        self.addCleanup(self.client.close)
+
+    def call(self, method, path):
+        return self.client._request("test", method, path, json={} if method == "POST" else None)
+
+    def test_get_is_retried(self):
+        response, status = self.call("GET", "/unavailable")
+        self.assertEqual(status, 503)
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_delete_is_retried(self):
+        self.call("DELETE", "/unavailable")
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_post_is_sent_once(self):
+        response, status = self.call("POST", "/unavailable")
+        self.assertEqual((response, status), ({"error": "Service unavailable"}, 503))
+        self.assertEqual(self.server.calls, [("POST", "/unavailable")])
+
+    def test_dropped_connection(self):
+        self.call("GET", "/drop")
+        self.assertEqual(len(self.server.calls), 3)
+
+        self.server.calls.clear()
+        response, status = self.call("POST", "/drop")
+        self.assertEqual(status, 500)
+        self.assertEqual(len(self.server.calls), 1)
+        # Retries are part of one call's latency, not separate calls
+        self.assertEqual(self.client.get_latency_stats()["test"]["calls"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Disbursement tests
+
+A job resumes from its checkpoint after a restart, and a tranche is never
+credited to a household twice, however often the job runs.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from services import disbursement_service
+from services.disbursement_service import DisbursementJob
+from services.household_service import households, register_households_bulk
+from services.voucher_service import claim_voucher, schemes
+from tests.test_household_journal import reset_households
+
+TRANCHE = "Jan2026"
+
+@unittest.skipIf(disbursement_service.db is not None, "uses the file journal")
+class DisbursementTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_households()
+        self.addCleanup(reset_households)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.object(disbursement_service, "CHUNK_PAUSE", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        rows = [{"members": [f"Member {i}"], "postal_code": "123456"} for i in range(7)]
+        self.ids = sorted(h["household_id"] for h in register_households_bulk(rows)["households"])
+
+    def run_job(self):
+        job = DisbursementJob(TRANCHE, chunk_size=3, directory=self.directory)
+        self.assertTrue(job.start())
+        job._thread.join()
+        return job.status()
+
+    def assert_all_credited_once(self):
+        for hid in self.ids:
+            self.assertEqual(households[hid].count(TRANCHE, "2"), schemes[TRANCHE]["2"])
+
+    def test_credits_every_household(self):
+        progress = self.run_job()
+
+        self.assertEqual(progress["status"], "completed")
+        self.assertEqual((progress["credited"], progress["skipped"]), (7, 0))
+        self.assertEqual(progress["last_household_id"], self.ids[-1])
+        self.assert_all_credited_once()
+
+    def test_second_run_credits_nobody(self):
+        self.run_job()
+        # A spent voucher must not be topped up again by the re-run
+        hid = self.ids[0]
+        households[hid].set_count(TRANCHE, "2", 1)
+
+        progress = self.run_job()
+        self.assertEqual(progress["credited"], 0)
+        self.assertEqual(households[hid].count(TRANCHE, "2"), 1)
+
+    def test_households_that_claimed_are_skipped(self):
+        claim_voucher(self.ids[3], {"tranche": TRANCHE})
+
+        progress = self.run_job()
+        self.assertEqual((progress["credited"], progress["skipped"]), (6, 1))
+        self.assert_all_credited_once()
+
+    def test_resumes_from_checkpoint(self):
+        # Stopped after the first chunk of three, which was credited
+        for hid in self.ids[:3]:
+            claim_voucher(hid, {"tranche": TRANCHE})
+        with open(os.path.join(self.directory, f"{TRANCHE}.json"), "w") as f:
+            json.dump({"tranche": TRANCHE, "status": "running", "total": 7, "processed": 3,
+                       "credited": 3, "skipped": 0, "last_household_id": self.ids[2]}, f)
+
+        progress = self.run_job()
+        self.assertEqual(progress["status"], "completed")
+        self.assertEqual((progress["processed"], progress["credited"], progress["skipped"]), (7, 7, 0))
+        self.assert_all_credited_once()
+
+    def test_household_before_checkpoint_without_tranche_is_credited(self):
+        # Registered while the job ran, with an ID sorting before the checkpoint
+        for hid in self.ids[1:3]:
+            claim_voucher(hid, {"tranche": TRANCHE})
+        with open(os.path.join(self.directory, f"{TRANCHE}.json"), "w") as f:
+            json.dump({"tranche": TRANCHE, "status": "running", "total": 3, "processed": 3,
+                       "credited": 3, "skipped": 0, "last_household_id": self.ids[2]}, f)
+
+        progress = self.run_job()
+        self.assertEqual(progress["credited"], 3 + 4 + 1)
+        self.assert_all_credited_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Bulk household registration tests
+
+Bad rows are rejected one by one with their 1-based row number; the rest of
+the file is still registered, in batches.
+"""
+import unittest
+
+from services import household_service
+from services.household_service import households, register_households_bulk
+from services.household_loader import iter_households
+from tests.test_household_journal import reset_households
+
+CSV_LINES = [
+    "members,postal_code\n",
+    "Tan Ah Kow; Tan Mei Ling,123456\n",
+    ",123456\n",
+    "Lim Bee Hoon,12345\n",
+    "Goh Siew Lan,900000\n",
+    "Ong Kah Seng,654321\n",
+]
+
+JSONL_LINES = [
+    '{"members": ["Tan Ah Kow"], "postal_code": "123456"}\n',
+    '{"members": ["Lim Bee Hoon"], "postal_code": \n',
+    '["not", "an", "object"]\n',
+    '{"members": "Goh Siew Lan; Ong Kah Seng", "postal_code": 654321}\n',
+]
+
+@unittest.skipIf(household_service.db is not None, "uses the file journal")
+class HouseholdBulkTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_households()
+        self.addCleanup(reset_households)
+
+    def errors(self, result):
+        return {error["row"]: error["error"] for error in result["errors"]}
+
+    def test_csv_rows_rejected_by_row_number(self):
+        result = register_households_bulk(iter_households(CSV_LINES, "csv"), batch_size=2)
+
+        self.assertEqual((result["registered"], result["failed"]), (2, 3))
+        self.assertEqual(self.errors(result), {
+            2: "At least one member is required",
+            3: "Postal code must be exactly 6 digits",
+            4: "Invalid Singapore postal code range",
+        })
+        self.assertEqual([h["row"] for h in result["households"]], [1, 5])
+        first = households[result["households"][0]["household_id"]]
+        self.assertEqual(first.members, ["Tan Ah Kow", "Tan Mei Ling"])
+
+    def test_jsonl_unreadable_lines_keep_their_row(self):
+        result = register_households_bulk(iter_households(JSONL_LINES, "jsonl"))
+
+        self.assertEqual((result["registered"], result["failed"]), (2, 2))
+        errors = self.errors(result)
+        self.assertEqual(sorted(errors), [2, 3])
+        self.assertTrue(errors[2].startswith("Invalid JSON"))
+        self.assertEqual(errors[3], "Household must be an object")
+        self.assertEqual([h["row"] for h in result["households"]], [1, 4])
+
+    def test_csv_without_members_column(self):
+        result = register_households_bulk(iter_households(["name,postal_code\n", "Tan,123456\n"], "csv"))
+        self.assertEqual(result["registered"], 0)
+        self.assertEqual(self.errors(result), {1: "CSV header must include members and postal_code"})
+
+    def test_ids_are_unique_across_batches(self):
+        rows = [{"members": [f"Member {i}"], "postal_code": "123456"} for i in range(7)]
+        result = register_households_bulk(rows, batch_size=3)
+
+        ids = [h["household_id"] for h in result["households"]]
+        self.assertEqual(len(set(ids)), 7)
+        self.assertTrue(all(hid in households for hid in ids))
+
+if __name__ == "__main__":
+    unittest.main()
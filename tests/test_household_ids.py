@@ -0,0 +1,108 @@
+"""
+Household ID tests
+
+IDs carry a Luhn check digit, come from blocks of a shared counter, and are
+the counter passed through a keyed permutation, so they never collide and
+do not run in sequence.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils.id_generator import (
+    HouseholdIdAllocator,
+    IdPermutation,
+    is_valid_household_id,
+    luhn_check_digit,
+    load_id_key
+)
+
+KEY = bytes(range(16))
+
+class LuhnTest(unittest.TestCase):
+
+    def test_check_digit(self):
+        self.assertEqual(luhn_check_digit("7992739871"), "3")
+        self.assertEqual(luhn_check_digit("0000000000"), "0")
+
+    def test_typos_are_caught(self):
+        self.assertTrue(is_valid_household_id("H79927398713"))
+        self.assertFalse(is_valid_household_id("H79927398714"))   # wrong digit
+        self.assertFalse(is_valid_household_id("H97927398713"))   # swapped digits
+        self.assertFalse(is_valid_household_id("H7992739871"))    # too short
+        self.assertFalse(is_valid_household_id("X79927398713"))
+
+class IdPermutationTest(unittest.TestCase):
+
+    def test_one_to_one(self):
+        permutation = IdPermutation(KEY, digits=4)
+        outputs = [permutation.permute(n) for n in range(10 ** 4)]
+        self.assertEqual(sorted(outputs), list(range(10 ** 4)))
+
+    def test_invert(self):
+        permutation = IdPermutation(KEY)
+        for number in (0, 1, 2, 12345, 10 ** 10 - 1):
+            self.assertEqual(permutation.invert(permutation.permute(number)), number)
+
+    def test_depends_on_key(self):
+        first = IdPermutation(KEY).permute(1)
+        self.assertNotEqual(first, IdPermutation(bytes(16)).permute(1))
+        self.assertEqual(first, IdPermutation(KEY).permute(1))
+
+class HouseholdIdAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.counter_path = os.path.join(self.directory, "household_id.counter")
+        self.key_path = os.path.join(self.directory, "household_id.key")
+
+    def allocator(self, block_size=5):
+        return HouseholdIdAllocator(self.counter_path, block_size, self.key_path)
+
+    def test_processes_sharing_a_counter_never_collide(self):
+        first, second = self.allocator(), self.allocator()
+        ids = [allocator.allocate() for _ in range(12) for allocator in (first, second)]
+        ids += first.allocate_many(7) + second.allocate_many(3)
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertTrue(all(is_valid_household_id(hid) for hid in ids))
+
+    def test_threads_never_collide(self):
+        allocator = self.allocator(block_size=3)
+        ids = []
+
+        def allocate():
+            for _ in range(50):
+                ids.append(allocator.allocate())
+
+        threads = [threading.Thread(target=allocate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 200)
+
+    def test_taken_ids_are_skipped(self):
+        allocator = self.allocator()
+        taken = {allocator.household_id(1), allocator.household_id(3)}
+
+        self.assertEqual(allocator.allocate(taken), allocator.household_id(2))
+        self.assertEqual(allocator.allocate(taken), allocator.household_id(4))
+        self.assertEqual(allocator.allocate_many(2, taken), [allocator.household_id(6), allocator.household_id(7)])
+
+    def test_ids_are_not_sequential(self):
+        allocator = self.allocator()
+        first, second = allocator.allocate(), allocator.allocate()
+        self.assertNotEqual(abs(int(first[1:-1]) - int(second[1:-1])), 1)
+
+    def test_key_is_created_once(self):
+        key = load_id_key(self.key_path)
+        self.assertEqual(len(key), 16)
+        self.assertEqual(load_id_key(self.key_path), key)
+        self.assertEqual(os.stat(self.key_path).st_mode & 0o777, 0o600)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Household journal tests
+
+Changes are appended to households.journal and replayed on load; compaction
+folds them into a households.json snapshot and truncates the journal.
+"""
+import json
+import os
+import unittest
+from unittest import mock
+
+from services import household_service
+from services.household_service import (
+    households,
+    load_households,
+    register_household,
+    deduct_vouchers,
+    compact_households,
+    record_changes,
+    HOUSEHOLD_FILE_JSON,
+    HOUSEHOLD_JOURNAL
+)
+from services.voucher_service import claim_voucher
+
+def reset_households():
+    """Empty the household files and reload, so each test starts from nothing"""
+    household_service._close_journal()
+    for path in (HOUSEHOLD_FILE_JSON, HOUSEHOLD_JOURNAL):
+        if os.path.exists(path):
+            os.remove(path)
+    load_households(force=True)
+
+def journal_records():
+    if not os.path.exists(HOUSEHOLD_JOURNAL):
+        return []
+    with open(HOUSEHOLD_JOURNAL, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+@unittest.skipIf(household_service.db is not None, "uses the file journal")
+class HouseholdJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        reset_households()
+        self.addCleanup(reset_households)
+        self.hid = register_household({"members": ["Tan"], "postal_code": "123456"})[0]["household_id"]
+        claim_voucher(self.hid, {"tranche": "Jan2026"})
+        deduct_vouchers(self.hid, "Jan2026", "2", 3)
+
+    def test_changes_are_journalled_not_snapshotted(self):
+        self.assertEqual([r["op"] for r in journal_records()], ["register", "claim", "deduct"])
+        self.assertFalse(os.path.exists(HOUSEHOLD_FILE_JSON))
+
+    def test_reload_replays_journal(self):
+        households.clear()
+        load_households(force=True)
+
+        household = households[self.hid]
+        self.assertEqual(household.members, ["Tan"])
+        self.assertEqual(household.count("Jan2026", "2"), 27)
+        self.assertEqual(household.count("Jan2026", "10"), 18)
+
+    def test_replaying_twice_is_harmless(self):
+        # Deductions record the remaining count, not the amount taken
+        with open(HOUSEHOLD_JOURNAL, "r") as f:
+            lines = f.read()
+        household_service._close_journal()
+        with open(HOUSEHOLD_JOURNAL, "a") as f:
+            f.write(lines)
+        load_households(force=True)
+        self.assertEqual(households[self.hid].count("Jan2026", "2"), 27)
+
+    def test_torn_last_line_is_skipped(self):
+        household_service._close_journal()
+        with open(HOUSEHOLD_JOURNAL, "a") as f:
+            f.write('{"op":"deduct","hid":"%s","tranche":"Jan2026","den' % self.hid)
+        load_households(force=True)
+        self.assertEqual(households[self.hid].count("Jan2026", "2"), 27)
+
+    def test_compaction_snapshots_and_truncates(self):
+        compact_households()
+
+        self.assertEqual(os.path.getsize(HOUSEHOLD_JOURNAL), 0)
+        with open(HOUSEHOLD_FILE_JSON, "r") as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot[self.hid]["vouchers"]["Jan2026"]["2"], 27)
+
+        load_households(force=True)
+        self.assertEqual(households[self.hid].count("Jan2026", "2"), 27)
+
+    def test_compacts_once_journal_is_long(self):
+        with mock.patch.object(household_service, "JOURNAL_COMPACT_EVERY", 5):
+            deduct_vouchers(self.hid, "Jan2026", "5", 1)
+            self.assertEqual(len(journal_records()), 4)
+            deduct_vouchers(self.hid, "Jan2026", "5", 1)
+        self.assertEqual(journal_records(), [])
+        self.assertTrue(os.path.exists(HOUSEHOLD_FILE_JSON))
+
+    def test_other_process_records_are_not_lost(self):
+        # Another process appends a deduction this one has not loaded
+        with open(HOUSEHOLD_JOURNAL, "a") as f:
+            f.write(json.dumps({"op": "deduct", "hid": self.hid, "tranche": "Jan2026",
+                                "denom": "10", "remaining": 11}) + "\n")
+
+        record_changes([("deduct", self.hid, {"tranche": "Jan2026", "denom": "5", "remaining": 10})])
+        # Our write must not mark the cache fresh over the unseen record,
+        # and a snapshot of our copy must not drop it
+        self.assertFalse(household_service.household_cache.unchanged())
+        compact_households()
+        self.assertTrue(len(journal_records()) > 0)
+
+        load_households()
+        self.assertEqual(households[self.hid].count("Jan2026", "10"), 11)
+        self.assertEqual(households[self.hid].count("Jan2026", "5"), 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Household model tests
+
+Packed voucher counts must read and serialise exactly like the voucher
+dicts they replace.
+"""
+import json
+import unittest
+
+from models.household import Household
+
+DATA = {
+    "household_id": "H00000000018",
+    "members": ["Tan Ah Kow", "Tan Mei Ling"],
+    "postal_code": "123456",
+    "vouchers": {
+        "May2025": {"2": 0, "5": 4, "10": 3},
+        "Jan2026": {"2": 30, "5": 12, "10": 15}
+    }
+}
+
+class HouseholdModelTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        household = Household.from_dict(json.loads(json.dumps(DATA)))
+        self.assertEqual(household.to_dict(), DATA)
+        self.assertEqual(Household.from_dict(household.to_dict()).to_dict(), DATA)
+
+    def test_zero_counts_are_kept(self):
+        household = Household.from_dict(DATA)
+        self.assertEqual(household.count("May2025", "2"), 0)
+        self.assertIsNone(household.count("May2025", "50"))
+        self.assertEqual(household.get_total_balance(), 20 + 30 + 60 + 60 + 150)
+
+    def test_unknown_keys_survive(self):
+        household = Household.from_dict(dict(DATA, registered_at="2026-01-18"))
+        self.assertEqual(household["registered_at"], "2026-01-18")
+        self.assertEqual(household.to_dict()["registered_at"], "2026-01-18")
+
+    def test_vouchers_less_reserved(self):
+        household = Household.from_dict(DATA)
+        vouchers = household.vouchers_less({"Jan2026": {"2": 5, "10": 15}})
+        self.assertEqual(vouchers["Jan2026"], {"2": 25, "5": 12, "10": 0})
+        self.assertEqual(vouchers["May2025"], DATA["vouchers"]["May2025"])
+        # The household itself is unchanged
+        self.assertEqual(household.count("Jan2026", "2"), 30)
+
+    def test_households_do_not_share_counts(self):
+        first, second = Household.from_dict(DATA), Household.from_dict(DATA)
+        first.deduct("Jan2026", "2", 4)
+        second.remove_tranche("May2025")
+
+        self.assertEqual(first.count("Jan2026", "2"), 26)
+        self.assertEqual(second.count("Jan2026", "2"), 30)
+        self.assertTrue(first.has_tranche("May2025"))
+        self.assertFalse(second.has_tranche("May2025"))
+        self.assertEqual(list(second.vouchers), ["Jan2026"])
+
+    def test_tranche_added_after_household_was_built(self):
+        household = Household.from_dict(DATA)
+        # Registers new slots past the end of this household's array
+        Household("H00000000026", [], "123456", {"Test2099": {"20": 1}})
+
+        self.assertEqual(household.to_dict(), DATA)
+        self.assertFalse(household.has_tranche("Test2099"))
+        household.set_tranche("Test2099", {"20": 2})
+        self.assertEqual(household.vouchers["Test2099"], {"20": 2})
+
+if __name__ == "__main__":
+    unittest.main()
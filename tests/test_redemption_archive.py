@@ -0,0 +1,99 @@
+"""
+Redemption archive tests
+
+Closed hourly Redeem CSVs become columnar segments. A CSV that grows, or is
+re-created under the same name, after it was archived is read for exactly
+the rows the archive does not hold yet.
+"""
+import csv
+import os
+import shutil
+import time
+import unittest
+from datetime import datetime
+
+from services import redemption_archive
+from services.redemption_archive import (
+    ARCHIVE_DIR,
+    ARCHIVED_CSV_DIR_NAME,
+    compact_redemption_logs,
+    read_archive,
+    read_redemption_batches
+)
+from services.redemption_log import REDEMPTIONS_DIR
+
+FILENAME = "Redeem2026011810.csv"
+CSV_PATH = os.path.join(REDEMPTIONS_DIR, FILENAME)
+
+def make_row(number, merchant_id="M001"):
+    """Direct-redemption layout row: one $5 voucher at 10:MM on 2026-01-18"""
+    return [f"TX-{number:04d}", "H00000000018", merchant_id, f"2026011810{number % 60:02d}00",
+            "Jan2026", "5", "1", "Completed", ""]
+
+def append_rows(rows, path=CSV_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+    # Closed: older than the compaction grace period
+    old = time.time() - redemption_archive.CLOSE_GRACE_SECONDS - 10
+    os.utime(path, (old, old))
+
+def transaction_ids():
+    return sorted(
+        record["transaction_id"]
+        for _, records in read_redemption_batches()
+        for record in records
+    )
+
+def compact(keep_csv=False):
+    return compact_redemption_logs(keep_csv=keep_csv, now=datetime(2026, 1, 19))
+
+@unittest.skipIf(redemption_archive.db is not None, "uses the Redeem files")
+class RedemptionArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.remove_files)
+        self.remove_files()
+        append_rows([make_row(i) for i in range(3)] + [make_row(3, "M002")])
+
+    def remove_files(self):
+        for directory in (REDEMPTIONS_DIR, ARCHIVE_DIR):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_closed_csv_is_archived_and_set_aside(self):
+        self.assertEqual(compact(), {"files": 1, "rows": 4})
+
+        self.assertFalse(os.path.exists(CSV_PATH))
+        self.assertTrue(os.path.exists(os.path.join(REDEMPTIONS_DIR, ARCHIVED_CSV_DIR_NAME, FILENAME)))
+        self.assertEqual(transaction_ids(), ["TX-0000", "TX-0001", "TX-0002", "TX-0003"])
+
+        archived = list(read_archive(["transaction_id", "value_cents"], merchant_id="M002"))
+        self.assertEqual(archived, [{"transaction_id": "TX-0003", "value_cents": 500}])
+
+    def test_current_hour_is_left_alone(self):
+        result = compact_redemption_logs(now=datetime(2026, 1, 18, 10, 30))
+        self.assertEqual(result["files"], 0)
+        self.assertTrue(os.path.exists(CSV_PATH))
+
+    def test_rows_added_after_archiving_are_read_once(self):
+        compact(keep_csv=True)
+        append_rows([make_row(4), make_row(5)])
+
+        self.assertEqual(transaction_ids(), [f"TX-{i:04d}" for i in range(6)])
+
+        # Only the new tail goes into the next segment
+        self.assertEqual(compact(keep_csv=True)["rows"], 2)
+        self.assertEqual(transaction_ids(), [f"TX-{i:04d}" for i in range(6)])
+
+    def test_recreated_csv_is_read_in_full(self):
+        compact()
+        # Same name, different rows (e.g. a retried write after archiving)
+        append_rows([make_row(7), make_row(8)])
+
+        self.assertEqual(transaction_ids(), ["TX-0000", "TX-0001", "TX-0002", "TX-0003", "TX-0007", "TX-0008"])
+        self.assertEqual(compact()["rows"], 2)
+        self.assertEqual(len(os.listdir(os.path.join(REDEMPTIONS_DIR, ARCHIVED_CSV_DIR_NAME))), 2)
+        self.assertEqual(len(transaction_ids()), 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Concurrent redemption tests
+
+Many threads race to redeem one token, or to issue tokens against one
+household's balance; the household locks must let exactly the right number
+through. Household changes are journalled to a temporary directory.
+
+    python -m pytest -q tests
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from models.household import Household
+from services import household_service
+from services.household_service import households
+from services.redemption_service import generate_household_token, redeem_household_token
+from services.token_service import token_store
+from utils.file_utils import FileCache
+
+THREADS = 32
+HOUSEHOLD_ID = "HTEST00000001"
+
+def run_concurrently(target, count=THREADS):
+    """Start count threads together on target(); returns their results"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        barrier.wait()
+        results[index] = target()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+@unittest.skipIf(household_service.db is not None, "uses the file journal")
+class ConcurrentRedemptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        journal = os.path.join(self.storage_dir, "households.journal")
+        cache = FileCache(os.path.join(self.storage_dir, "households.json"), journal)
+        cache.mark_loaded()
+        for name, value in [
+            ("STORAGE_DIR", self.storage_dir),
+            ("HOUSEHOLD_JOURNAL", journal),
+            ("HOUSEHOLD_JOURNAL_LOCK", journal + ".lock"),
+            ("household_cache", cache),
+            ("_journal_file", None),
+        ]:
+            patcher = mock.patch.object(household_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        households[HOUSEHOLD_ID] = Household.from_dict({
+            "household_id": HOUSEHOLD_ID,
+            "members": ["Test"],
+            "postal_code": "123456",
+            "vouchers": {"Jan2026": {"2": 30, "5": 12, "10": 18}}
+        })
+
+    def tearDown(self):
+        for entry in token_store.tokens_for(HOUSEHOLD_ID):
+            token_store.consume(entry["token"])
+        households.pop(HOUSEHOLD_ID, None)
+        household_service._close_journal()
+        shutil.rmtree(self.storage_dir)
+
+    def test_token_redeemed_once(self):
+        entry, status = generate_household_token(HOUSEHOLD_ID, {"Jan2026": {"10": 1, "2": 2}})
+        self.assertEqual(status, 200)
+
+        results = run_concurrently(lambda: redeem_household_token(entry["token"]))
+
+        successes = [result for result in results if result is not None]
+        self.assertEqual(len(successes), 1)
+        self.assertEqual(successes[0]["total_amount"], 14)
+        household = households[HOUSEHOLD_ID]
+        self.assertEqual(household.count("Jan2026", "10"), 17)
+        self.assertEqual(household.count("Jan2026", "2"), 28)
+
+    def test_tokens_never_exceed_balance(self):
+        # 12 $5 vouchers: only 12 single-voucher tokens can be reserved
+        results = run_concurrently(lambda: generate_household_token(HOUSEHOLD_ID, {"Jan2026": {"5": 1}}))
+
+        issued = [entry for entry, status in results if status == 200]
+        self.assertEqual(len(issued), 12)
+
+        redeemed = run_concurrently(
+            lambda: [redeem_household_token(entry["token"]) for entry in issued], count=4
+        )
+        successes = [result for batch in redeemed for result in batch if result is not None]
+        self.assertEqual(len(successes), 12)
+        self.assertEqual(households[HOUSEHOLD_ID].count("Jan2026", "5"), 0)
+
+if __name__ == "__main__":
+    unittest.main()
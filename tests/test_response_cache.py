@@ -0,0 +1,115 @@
+"""
+Response cache tests
+
+Cached responses carry a strong ETag; a matching If-None-Match gets a 304
+until the entity changes, and a response built while it changed is never
+cached.
+"""
+import unittest
+from unittest import mock
+
+from services import household_service, response_cache as response_cache_module
+from services.response_cache import CachedResponse, ResponseCache
+from tests.test_household_journal import reset_households
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=2)
+        self.builds = 0
+
+    def build(self, data=None, status=200, expires_at=None):
+        def build():
+            self.builds += 1
+            return data or {"build": self.builds}, status, expires_at
+        return build
+
+    def test_hit_until_invalidated(self):
+        first = self.cache.fetch(("balance", "H1"), self.build())
+        self.assertIs(self.cache.fetch(("balance", "H1"), self.build()), first)
+
+        self.cache.invalidate("balance", "H1")
+        second = self.cache.fetch(("balance", "H1"), self.build())
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertEqual(self.builds, 2)
+
+    def test_etag_matching(self):
+        entry = CachedResponse({"a": 1})
+        self.assertEqual(entry.etag, CachedResponse({"a": 1}).etag)
+        self.assertTrue(entry.matches(entry.etag))
+        self.assertTrue(entry.matches(f'"other", W/{entry.etag}'))
+        self.assertTrue(entry.matches("*"))
+        self.assertFalse(entry.matches('"other"'))
+        self.assertFalse(entry.matches(None))
+        self.assertFalse(CachedResponse({"error": "x"}, 404).matches("*"))
+
+    def test_errors_are_not_cached(self):
+        self.cache.fetch(("balance", "H1"), self.build({"error": "Household not found"}, 404))
+        self.cache.fetch(("balance", "H1"), self.build({"error": "Household not found"}, 404))
+        self.assertEqual(self.builds, 2)
+
+    def test_expired_entry_is_rebuilt(self):
+        with mock.patch.object(response_cache_module.time, "time", return_value=1000):
+            self.cache.fetch(("balance", "H1"), self.build(expires_at=1001))
+            self.cache.fetch(("balance", "H1"), self.build())
+        with mock.patch.object(response_cache_module.time, "time", return_value=1001):
+            self.cache.fetch(("balance", "H1"), self.build())
+        self.assertEqual(self.builds, 2)
+
+    def test_response_built_across_an_invalidation_is_not_cached(self):
+        def build():
+            self.builds += 1
+            # Another request changes the household while this one reads it
+            self.cache.invalidate("balance", "H1")
+            return {"stale": True}, 200, None
+
+        self.cache.fetch(("balance", "H1"), build)
+        self.cache.fetch(("balance", "H1"), self.build())
+        self.assertEqual(self.builds, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        for hid in ("H1", "H2"):
+            self.cache.fetch(("balance", hid), self.build())
+        self.cache.fetch(("balance", "H1"), self.build())
+        self.cache.fetch(("balance", "H3"), self.build())
+
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.cache.fetch(("balance", "H1"), self.build())
+        self.assertEqual(self.builds, 3)
+
+@unittest.skipIf(household_service.db is not None, "uses the file journal")
+class BalanceRevalidationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from app import app
+        cls.client = app.test_client()
+
+    def setUp(self):
+        reset_households()
+        self.addCleanup(reset_households)
+        response = self.client.post("/api/households", json={"members": ["Tan"], "postal_code": "123456"})
+        self.url = f"/api/households/{response.get_json()['household_id']}/balance"
+
+    def test_not_modified_until_balance_changes(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers["ETag"]
+
+        revalidated = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers["ETag"], etag)
+
+        self.client.post(self.url.replace("/balance", "/claim"), json={"tranche": "Jan2026"})
+        changed = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertEqual(changed.get_json()["vouchers"]["Jan2026"]["2"], 30)
+
+    def test_unknown_household_has_no_etag(self):
+        response = self.client.get("/api/households/H00000000000/balance", headers={"If-None-Match": "*"})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response.headers)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Settlement tests
+
+Totals per merchant and day must be the same whether the rows come from the
+archive or from open Redeem files, and with or without NumPy.
+"""
+import csv
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from services import settlement_service
+from services.redemption_archive import ARCHIVE_DIR, CLOSE_GRACE_SECONDS, compact_redemption_logs
+from services.redemption_log import REDEMPTIONS_DIR
+from services.settlement_service import compute_settlement_totals, generate_settlement, to_epoch
+
+MERCHANTS = {
+    "M001": {"merchant_id": "M001", "merchant_name": "Ah Seng Provision", "bank_code": "7171"},
+    "M002": {"merchant_id": "M002", "merchant_name": "Kopi Corner", "bank_code": "7339"},
+}
+
+def day_number(year, month, day):
+    return to_epoch(datetime(year, month, day)) // settlement_service.SECONDS_PER_DAY
+
+def write_csv(filename, rows):
+    os.makedirs(REDEMPTIONS_DIR, exist_ok=True)
+    path = os.path.join(REDEMPTIONS_DIR, filename)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+    old = time.time() - CLOSE_GRACE_SECONDS - 10
+    os.utime(path, (old, old))
+
+@unittest.skipIf(settlement_service.db is not None, "uses the Redeem files")
+class SettlementTotalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.remove_files)
+        self.remove_files()
+        # 17 Jan: archived. Direct redemption (3 x $5) and a token
+        # redemption (two rows, $2 + $10) for M001; one failed row
+        write_csv("Redeem2026011709.csv", [
+            ["TX-1", "H1", "M001", "20260117090000", "Jan2026", "5", "3", "Completed", ""],
+            ["TX-2", "H2", "M001", "2026-01-17-091500", "V0001", "$2.00", "$12.00", "Completed", "1"],
+            ["TX-2", "H2", "M001", "2026-01-17-091500", "V0002", "$10.00", "$12.00", "Completed", "Final"],
+            ["TX-3", "H3", "M002", "20260117092000", "Jan2026", "10", "4", "Failed", ""],
+        ])
+        compact_redemption_logs(now=datetime(2026, 1, 18))
+        # 18 Jan: still an open file
+        write_csv("Redeem2026011811.csv", [
+            ["TX-4", "H1", "M002", "20260118110000", "May2025", "2", "5", "Completed", ""],
+            ["TX-5", "H4", "M001", "20260118113000", "May2025", "10", "1", "Completed", ""],
+        ])
+
+    def remove_files(self):
+        for directory in (REDEMPTIONS_DIR, ARCHIVE_DIR):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def expected(self):
+        return {
+            ("M001", day_number(2026, 1, 17)): [5, 2700],
+            ("M002", day_number(2026, 1, 18)): [5, 1000],
+            ("M001", day_number(2026, 1, 18)): [1, 1000],
+        }
+
+    def test_totals_with_numpy(self):
+        if settlement_service.np is None:
+            self.skipTest("NumPy is not installed")
+        totals, rows = compute_settlement_totals()
+        self.assertEqual(totals, self.expected())
+        self.assertEqual(rows, 5)
+
+    def test_totals_without_numpy(self):
+        with mock.patch.object(settlement_service, "np", None):
+            totals, rows = compute_settlement_totals()
+        self.assertEqual(totals, self.expected())
+        self.assertEqual(rows, 5)
+
+    def test_date_range(self):
+        totals, rows = compute_settlement_totals(datetime(2026, 1, 18), datetime(2026, 1, 19))
+        self.assertEqual(set(totals), {("M002", day_number(2026, 1, 18)), ("M001", day_number(2026, 1, 18))})
+        self.assertEqual(rows, 2)
+
+    def test_one_file_per_bank(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with mock.patch.dict(settlement_service.merchants, MERCHANTS), \
+                mock.patch.object(settlement_service, "load_merchants"):
+            result = generate_settlement(output_dir=output_dir)
+
+        self.assertEqual(result["banks"]["7171"]["amount"], "37.00")
+        self.assertEqual(result["banks"]["7339"]["amount"], "10.00")
+        with open(result["banks"]["7171"]["file"], newline="") as f:
+            lines = list(csv.reader(f))
+        self.assertEqual(lines[0], settlement_service.SETTLEMENT_COLUMNS)
+        self.assertEqual([(line[0], line[8], line[9]) for line in lines[1:]],
+                         [("2026-01-17", "5", "27.00"), ("2026-01-18", "1", "10.00")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Token store tests
+
+A token reserves the vouchers it covers until it is redeemed or its TTL
+runs out; either way the reservation is released exactly once.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from services import token_service
+from services.storage_backend import SqliteBackend
+from services.token_service import TokenStore, SqliteTokenStore
+
+HID = "H00000000018"
+BALANCE = {"Jan2026": {"2": 30, "5": 12, "10": 15}}
+NOW = 1768708165.0
+
+class TokenStoreTests:
+    """Shared by the in-memory and SQLite stores; make_store() returns one"""
+
+    def setUp(self):
+        self.now = NOW
+        patcher = mock.patch.object(token_service.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.make_store()
+
+    def test_issue_reserves_vouchers(self):
+        entry = self.store.issue(HID, {"Jan2026": {"2": 3, "10": 1}}, BALANCE)
+
+        self.assertEqual(entry["total"], 16)
+        self.assertEqual(entry["voucher_values"], [2, 2, 2, 10])
+        self.assertEqual(self.store.reserved(HID), {"Jan2026": {"2": 3, "10": 1}})
+
+    def test_reserved_vouchers_cannot_be_issued_again(self):
+        self.store.issue(HID, {"Jan2026": {"5": 10}}, BALANCE)
+        self.store.issue(HID, {"Jan2026": {"5": 2}}, BALANCE)
+        with self.assertRaises(ValueError):
+            self.store.issue(HID, {"Jan2026": {"5": 1}}, BALANCE)
+
+    def test_expiry_releases_reservation(self):
+        entry = self.store.issue(HID, {"Jan2026": {"5": 12}}, BALANCE)
+
+        self.now += self.store.ttl - 1
+        self.assertIsNotNone(self.store.get(entry["token"]))
+        self.now += 1
+        self.assertIsNone(self.store.get(entry["token"]))
+        self.assertEqual(self.store.reserved(HID), {})
+        self.assertIsNone(self.store.consume(entry["token"]))
+        # The released vouchers can back a new token
+        self.store.issue(HID, {"Jan2026": {"5": 12}}, BALANCE)
+
+    def test_consume_releases_reservation_once(self):
+        first = self.store.issue(HID, {"Jan2026": {"2": 5}}, BALANCE)
+        second = self.store.issue(HID, {"Jan2026": {"2": 5}}, BALANCE)
+
+        self.assertEqual(self.store.consume(first["token"])["total"], 10)
+        self.assertIsNone(self.store.consume(first["token"]))
+        self.assertEqual(self.store.reserved(HID), {"Jan2026": {"2": 5}})
+        self.assertEqual([t["token"] for t in self.store.tokens_for(HID)], [second["token"]])
+
+        # The consumed token's heap item must not expire the other one early
+        self.now += self.store.ttl
+        self.assertEqual(self.store.expire(), 1)
+        self.assertEqual(self.store.reserved(HID), {})
+
+class InMemoryTokenStoreTest(TokenStoreTests, unittest.TestCase):
+
+    def make_store(self):
+        return TokenStore(ttl=60)
+
+class SqliteTokenStoreTest(TokenStoreTests, unittest.TestCase):
+
+    def make_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return SqliteTokenStore(SqliteBackend(os.path.join(directory, "cdc.db")), ttl=60)
+
+if __name__ == "__main__":
+    unittest.main()
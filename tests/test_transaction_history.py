@@ -0,0 +1,83 @@
+"""
+Transaction history tests
+
+Each household's history is an append-only .log with an .idx of record
+offsets. An index left out of step with its log by a crash is rebuilt the
+first time the household's history is used.
+"""
+import os
+import unittest
+import uuid
+
+from services import notification_service
+from services.notification_service import (
+    log_transaction,
+    get_transaction_history,
+    compact_transaction_history,
+    INDEX_ENTRY,
+    _history_paths
+)
+
+@unittest.skipIf(notification_service.db is not None, "uses the history files")
+class TransactionHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hid = f"HTEST{uuid.uuid4().hex[:8]}"
+        self.log_path, self.idx_path = _history_paths(self.hid)
+        for amount in range(1, 6):
+            log_transaction(self.hid, amount, {"2": amount})
+        self.addCleanup(self.remove_files)
+
+    def remove_files(self):
+        for path in (self.log_path, self.idx_path):
+            if os.path.exists(path):
+                os.remove(path)
+        notification_service._checked_indexes.discard(self.hid)
+
+    def restart(self):
+        """Forget that this process already checked the index"""
+        notification_service._checked_indexes.discard(self.hid)
+
+    def amounts(self, limit=None):
+        return [t["amount"] for t in get_transaction_history(self.hid, limit=limit)]
+
+    def test_newest_first_with_limit(self):
+        self.assertEqual(self.amounts(), [5, 4, 3, 2, 1])
+        self.assertEqual(self.amounts(limit=2), [5, 4])
+        self.assertEqual(os.path.getsize(self.idx_path), 5 * INDEX_ENTRY.size)
+
+    def test_compaction_keeps_most_recent(self):
+        compact_transaction_history(self.hid, keep=3)
+        self.assertEqual(self.amounts(), [5, 4, 3])
+        log_transaction(self.hid, 6, {"2": 6})
+        self.assertEqual(self.amounts(limit=2), [6, 5])
+
+    def test_index_missing_last_records_is_rebuilt(self):
+        # Crash after the log append, before the index append
+        with open(self.idx_path, "r+b") as idx:
+            idx.truncate(3 * INDEX_ENTRY.size)
+        self.restart()
+        self.assertEqual(self.amounts(limit=2), [5, 4])
+        self.assertEqual(os.path.getsize(self.idx_path), 5 * INDEX_ENTRY.size)
+
+    def test_index_of_older_log_is_rebuilt(self):
+        # Compaction replaced the log but crashed before replacing the index
+        with open(self.idx_path, "rb") as idx:
+            old_index = idx.read()
+        compact_transaction_history(self.hid, keep=2)
+        with open(self.idx_path, "wb") as idx:
+            idx.write(old_index)
+        self.restart()
+        self.assertEqual(self.amounts(limit=1), [5])
+        log_transaction(self.hid, 6, {"2": 6})
+        self.assertEqual(self.amounts(limit=2), [6, 5])
+
+    def test_torn_index_entry_is_rebuilt(self):
+        with open(self.idx_path, "ab") as idx:
+            idx.write(b"\x01\x02")
+        self.restart()
+        self.assertEqual(self.amounts(limit=1), [5])
+        self.assertEqual(os.path.getsize(self.idx_path), 5 * INDEX_ENTRY.size)
+
+if __name__ == "__main__":
+    unittest.main()
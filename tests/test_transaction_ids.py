@@ -0,0 +1,75 @@
+"""
+Transaction ID tests
+
+IDs from one generator are unique and sort in issue order, within a
+millisecond, across threads and when the clock steps back; generators on
+different nodes never clash.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from utils import id_generator
+from utils.id_generator import TransactionIdGenerator
+
+# 2026-01-18 03:49:25.123 UTC
+FIXED_TIME = 1768708165.123
+
+class TransactionIdTest(unittest.TestCase):
+
+    def test_same_millisecond_ids_are_ordered(self):
+        generator = TransactionIdGenerator(node_id="00A")
+        with mock.patch.object(id_generator.time, "time", return_value=FIXED_TIME):
+            ids = [generator.next_id() for _ in range(3)]
+
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual([tx[-4:] for tx in ids], ["0000", "0001", "0002"])
+        self.assertTrue(all(tx.startswith("TX-") and "-00A-" in tx for tx in ids))
+
+    def test_clock_stepping_back_keeps_order(self):
+        generator = TransactionIdGenerator(node_id="00A")
+        with mock.patch.object(id_generator.time, "time", side_effect=[FIXED_TIME, FIXED_TIME - 5]):
+            first, second = generator.next_id(), generator.next_id()
+        self.assertLess(first, second)
+
+    def test_sequence_overflow_moves_to_next_millisecond(self):
+        generator = TransactionIdGenerator(node_id="00A")
+        count = 10 ** id_generator.TXN_SEQUENCE_DIGITS + 1
+        with mock.patch.object(id_generator.time, "time", return_value=FIXED_TIME):
+            ids = [generator.next_id() for _ in range(count)]
+        self.assertEqual(len(set(ids)), count)
+        self.assertEqual(ids, sorted(ids))
+
+    def test_threads_get_unique_ids(self):
+        generator = TransactionIdGenerator(node_id="00A")
+        ids = []
+
+        def issue():
+            for _ in range(500):
+                ids.append(generator.next_id())
+
+        threads = [threading.Thread(target=issue) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 2000)
+
+    def test_processes_get_different_nodes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        counter_path = os.path.join(directory, "node_id.counter")
+
+        with mock.patch.dict(os.environ), mock.patch.object(id_generator.time, "time", return_value=FIXED_TIME):
+            os.environ.pop("CDC_NODE_ID", None)
+            first = TransactionIdGenerator(node_counter_path=counter_path)
+            second = TransactionIdGenerator(node_counter_path=counter_path)
+            self.assertNotEqual(first.node, second.node)
+            self.assertNotEqual(first.next_id(), second.next_id())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+File helpers shared by the storage services
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Set CDC_STORAGE_OWNER=1 when the API process is the only writer of the
+# storage files, so cached data is never re-read from disk after startup
+STORAGE_OWNER = os.environ.get("CDC_STORAGE_OWNER", "0") == "1"
+
+def file_signature(*paths):
+    """
+    Build a cheap change signature for one or more files
+
+    Args:
+        paths: File paths to stat
+
+    Returns:
+        Tuple of (mtime_ns, size) per path, None for missing files
+    """
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+@contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    """
+    Open a temporary file that replaces path only once writing succeeds
+
+    Readers never see a half-written file, and a crash mid-write leaves the
+    previous version in place.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def locked_file(path):
+    """
+    Open (creating if needed) a small file under an exclusive cross-process lock
+
+    Yields:
+        File descriptor open for reading and writing
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # msvcrt locks bytes from the current position
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        try:
+            yield fd
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+def try_lock_file(path):
+    """
+    Take an exclusive cross-process lock on path without waiting
+
+    The lock is held until the returned descriptor is closed (or the
+    process exits).
+
+    Returns:
+        File descriptor, or None if another process holds the lock
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+class FileCache:
+    """
+    Tracks whether a set of files changed since they were last loaded
+
+    The owning service calls is_fresh() before re-parsing and mark_loaded()
+    after every load or save, so its own writes never trigger a reload.
+    A custom signature function (e.g. a database table version) can be
+    given instead of file paths.
+    """
+
+    def __init__(self, *paths, signature=None):
+        self.paths = paths
+        self._signature_fn = signature or (lambda: file_signature(*self.paths))
+        self.signature = None
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def is_fresh(self):
+        """Return True (and count a hit) if the cached data is still valid"""
+        if self.signature is not None:
+            if STORAGE_OWNER or self._signature_fn() == self.signature:
+                self.hits += 1
+                return True
+            self.reloads += 1
+        self.misses += 1
+        return False
+
+    def unchanged(self):
+        """
+        True if the files still match the cached state
+
+        Unlike is_fresh() this counts nothing and ignores owner mode; writers
+        call it before writing to tell whether someone else wrote first.
+        """
+        return self.signature is not None and self._signature_fn() == self.signature
+
+    def mark_loaded(self):
+        """Record the current file state as the cached state"""
+        self.signature = self._signature_fn()
+        self.generation += 1
+
+    def invalidate(self):
+        """Force the next load to re-read the files"""
+        self.signature = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "generation": self.generation,
+            "owner_mode": STORAGE_OWNER
+        }
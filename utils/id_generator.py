@@ -1,5 +1,275 @@
-import random
+"""
+Household and transaction ID allocation
 
-def generate_household_id():
-    return "H" + "".join(str(random.randint(0, 9)) for _ in range(11))
+Household IDs are "H" + 10 digits + a Luhn check digit. The digits are a
+sequence number passed through a keyed permutation of all 10-digit
+numbers: the household ID is also the login credential, so issued IDs must
+not reveal their neighbours. Sequence numbers come from a counter file
+shared by every process: each process reserves a block of numbers under a
+file lock, then hands them out from memory without locking. Two processes
+can never be given the same block and the permutation is one-to-one, so new
+IDs never collide and no retries are needed.
 
+The permutation key is CDC_ID_KEY (hex) if set, otherwise a random key
+created in storage/household_id.key on first use. Keep it secret and never
+change it once IDs have been issued.
+
+Transaction IDs are "TX-" + millisecond time + node + sequence. The node
+number is taken once per process from a shared counter (or CDC_NODE_ID),
+and the sequence orders IDs issued within the same millisecond.
+"""
+import hashlib
+import itertools
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from utils.file_utils import locked_file
+
+# Get the project root directory (parent of utils folder)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORAGE_DIR = os.environ.get("CDC_STORAGE_DIR", os.path.join(PROJECT_ROOT, "storage"))
+COUNTER_PATH = os.path.join(STORAGE_DIR, "household_id.counter")
+ID_KEY_PATH = os.path.join(STORAGE_DIR, "household_id.key")
+
+NODE_COUNTER_PATH = os.path.join(STORAGE_DIR, "node_id.counter")
+
+# Numbers reserved per trip to the counter file
+ID_BLOCK_SIZE = 1000
+SEQUENCE_DIGITS = 10
+# Feistel rounds of the household ID permutation
+PERMUTATION_ROUNDS = 8
+
+# Transaction IDs: base-36 node number and per-millisecond sequence widths
+NODE_DIGITS = 3
+TXN_SEQUENCE_DIGITS = 4
+BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def reserve_sequence(path, count):
+    """
+    Take `count` numbers from a counter file shared by all processes
+
+    Returns:
+        First number of the reserved range (counters start at 1)
+    """
+    with locked_file(path) as fd:
+        raw = os.read(fd, 64).strip()
+        start = int(raw) if raw else 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(start + count).encode("ascii"))
+        os.fsync(fd)
+    return start
+
+def luhn_check_digit(digits):
+    """Check digit that makes digits + check pass the Luhn test"""
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return str((10 - total % 10) % 10)
+
+def is_valid_household_id(household_id):
+    """True for IDs issued by the allocator (catches typos and swapped digits)"""
+    if len(household_id) != SEQUENCE_DIGITS + 2 or household_id[0] != "H" or not household_id[1:].isdigit():
+        return False
+    return luhn_check_digit(household_id[1:-1]) == household_id[-1]
+
+def format_household_id(number):
+    digits = str(number).zfill(SEQUENCE_DIGITS)
+    return f"H{digits}{luhn_check_digit(digits)}"
+
+def load_id_key(path=ID_KEY_PATH):
+    """
+    Secret key of the household ID permutation
+
+    Returns:
+        CDC_ID_KEY decoded from hex, else the key in `path`, created with
+        random bytes by the first process that needs it
+    """
+    key = os.environ.get("CDC_ID_KEY")
+    if key:
+        return bytes.fromhex(key)
+    with locked_file(path) as fd:
+        raw = os.read(fd, 128).strip()
+        if not raw:
+            raw = secrets.token_hex(16).encode("ascii")
+            if hasattr(os, "fchmod"):
+                os.fchmod(fd, 0o600)
+            os.write(fd, raw)
+            os.fsync(fd)
+    return bytes.fromhex(raw.decode("ascii"))
+
+class IdPermutation:
+    """
+    Keyed one-to-one mapping of the numbers 0 .. 10**digits - 1 onto themselves
+
+    A balanced Feistel network over the two halves of the digits, with a
+    keyed BLAKE2b round function. Without the key, consecutive inputs give
+    unrelated outputs, so one ID does not lead to the next.
+    """
+
+    def __init__(self, key, digits=SEQUENCE_DIGITS, rounds=PERMUTATION_ROUNDS):
+        if digits % 2:
+            raise ValueError("digits must be even")
+        self.half = 10 ** (digits // 2)
+        self.rounds = rounds
+        # Keyed hash state copied for every round instead of re-keyed
+        self._keyed = hashlib.blake2b(key=key, digest_size=8)
+
+    def _round(self, index, value):
+        h = self._keyed.copy()
+        h.update(bytes((index,)) + value.to_bytes(8, "big"))
+        return int.from_bytes(h.digest(), "big") % self.half
+
+    def permute(self, number):
+        left, right = divmod(number, self.half)
+        for index in range(self.rounds):
+            left, right = right, (left + self._round(index, right)) % self.half
+        return left * self.half + right
+
+    def invert(self, number):
+        left, right = divmod(number, self.half)
+        for index in reversed(range(self.rounds)):
+            left, right = (right - self._round(index, left)) % self.half, left
+        return left * self.half + right
+
+class HouseholdIdAllocator:
+    """Block-reserving allocator; the in-block fast path takes no lock"""
+
+    def __init__(self, counter_path=COUNTER_PATH, block_size=ID_BLOCK_SIZE, key_path=ID_KEY_PATH):
+        self.counter_path = counter_path
+        self.block_size = block_size
+        self.key_path = key_path
+        self._permutation = None
+        self._block = (iter(()), 0)
+        self._refill_lock = threading.Lock()
+
+    @property
+    def permutation(self):
+        # Loaded on first use, so importing never creates the key file
+        if self._permutation is None:
+            self._permutation = IdPermutation(load_id_key(self.key_path))
+        return self._permutation
+
+    def household_id(self, number):
+        """Household ID for a sequence number"""
+        return format_household_id(self.permutation.permute(number))
+
+    def reserve(self, count):
+        """
+        Reserve `count` consecutive sequence numbers for this process
+
+        Returns:
+            First number of the reserved range
+        """
+        return reserve_sequence(self.counter_path, count)
+
+    def _next_number(self):
+        while True:
+            block = self._block
+            number = next(block[0], None)
+            if number is not None and number < block[1]:
+                return number
+            with self._refill_lock:
+                # Another thread may have refilled while we waited
+                if self._block is block:
+                    start = self.reserve(self.block_size)
+                    self._block = (itertools.count(start), start + self.block_size)
+
+    def allocate(self, taken=()):
+        """
+        Next household ID
+
+        Args:
+            taken: IDs already in use (legacy random IDs are skipped)
+        """
+        while True:
+            household_id = self.household_id(self._next_number())
+            if household_id not in taken:
+                return household_id
+
+    def allocate_many(self, count, taken=()):
+        """Allocate `count` IDs with a single reservation"""
+        ids = []
+        while len(ids) < count:
+            needed = count - len(ids)
+            start = self.reserve(needed)
+            for number in range(start, start + needed):
+                household_id = self.household_id(number)
+                if household_id not in taken:
+                    ids.append(household_id)
+        return ids
+
+# Shared allocator for this process
+household_ids = HouseholdIdAllocator()
+
+def generate_household_id(taken=()):
+    return household_ids.allocate(taken)
+
+def generate_household_ids(count, taken=()):
+    """Generate `count` distinct household IDs not present in `taken`"""
+    return household_ids.allocate_many(count, taken)
+
+def _base36(number, width):
+    digits = []
+    for _ in range(width):
+        number, rem = divmod(number, 36)
+        digits.append(BASE36[rem])
+    return "".join(reversed(digits))
+
+class TransactionIdGenerator:
+    """
+    Monotonic, node-unique transaction IDs
+
+    Format: TX-<YYYYmmddHHMMSSfff>-<node>-<sequence>, e.g.
+    TX-20260118034925123-00A-0001. IDs from one process sort in issue order
+    even if the clock steps back; up to 10,000 IDs per millisecond, after
+    which the ID time runs ahead of the clock until it catches up.
+    """
+
+    def __init__(self, node_id=None, node_counter_path=NODE_COUNTER_PATH):
+        self._node = node_id
+        self._node_counter_path = node_counter_path
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    @property
+    def node(self):
+        if self._node is None:
+            node = os.environ.get("CDC_NODE_ID")
+            if node is None:
+                number = reserve_sequence(self._node_counter_path, 1) % 36 ** NODE_DIGITS
+                node = _base36(number, NODE_DIGITS)
+            self._node = node.upper().rjust(NODE_DIGITS, "0")[-NODE_DIGITS:]
+        return self._node
+
+    def next_id(self):
+        node = self.node
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence >= 10 ** TXN_SEQUENCE_DIGITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            ms, sequence = self._last_ms, self._sequence
+
+        stamp = datetime.fromtimestamp(ms / 1000).strftime("%Y%m%d%H%M%S")
+        return f"TX-{stamp}{ms % 1000:03d}-{node}-{sequence:0{TXN_SEQUENCE_DIGITS}d}"
+
+# Shared generator for this process
+transaction_ids = TransactionIdGenerator()
+
+def generate_transaction_id():
+    return transaction_ids.next_id()
@@ -0,0 +1,35 @@
+"""
+Production entry point for the CDC Voucher API
+
+Several worker processes, all cores (gunicorn, Linux/macOS):
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+One process, many threads (waitress, any OS):
+
+    python wsgi.py
+
+Workers share state through the SQLite backend, selected here unless
+CDC_STORAGE_BACKEND is set: household changes are made under SQLite's
+write lock against the latest committed row, tokens live in its tokens
+table, and each worker picks up other workers' changes by change sequence.
+The JSON file storage is single-process only (waitress, or one worker).
+Import existing files first with `python -m services.storage_backend migrate`.
+"""
+import os
+
+os.environ.setdefault("CDC_STORAGE_BACKEND", "sqlite")
+
+from app import app
+
+# WSGI callable for gunicorn / waitress / mod_wsgi
+application = app
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    host = os.environ.get("CDC_HOST", "0.0.0.0")
+    port = int(os.environ.get("CDC_PORT", "8000"))
+    threads = int(os.environ.get("CDC_THREADS", "16"))
+    print(f"🚀 Serving on http://{host}:{port} with {threads} threads (waitress)")
+    serve(application, host=host, port=port, threads=threads)